@@ -0,0 +1,335 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file build.py
+#
+# This file runs the whole pipeline incrementally: tableviewer files are generated from the XML files
+# (see faostat_main.py), diagrams are rendered from the tableviewer files (see generate_diagrams.py) and
+# LaTeX documents are generated (see generate_latex.py).
+#
+# The content hash of the inputs of each target is recorded in a manifest, and only the targets whose
+# inputs changed are rebuilt:
+#  - the tableviewer files of a commodity are regenerated when the regions, the country-to-region mapping,
+#    the XML files of the commodity, the conversion code or the conversion settings change, but only the
+#    files whose contents actually differ are written;
+#  - a diagram is rendered again when its tableviewer file, the Circos configuration or the rendering code change;
+#  - a LaTeX document is written when its contents differ.
+# With --dry-run, the plan of what would be rebuilt and why is printed and nothing is written.
+
+from faostat_trade_data import FAOStatTradeData
+from faostat_cache import ParsedFileCache
+from faostat_metrics import Metrics
+from generate_diagrams import DiagramRenderer
+import faostat_main
+import generate_latex
+import os, os.path, sys
+import argparse
+# Modules needed to compute content hashes and to read and write the manifest.
+import hashlib, json, tempfile
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+
+## Directory holding this script.
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+## Returns the source files of the faostat_* modules loaded by the conversion step (faostat_main.py and
+# every module it imports, directly or not), any of which may change the tableviewer files.
+# @return A sorted list of paths.
+def get_conversion_modules():
+    file_names = set()
+    for name, module in sys.modules.items():
+        if name.startswith("faostat_") and getattr(module, "__file__", None) is not None:
+            file_names.add(os.path.splitext(module.__file__)[0] + ".py")
+    return sorted(file_names)
+
+## This class records the inputs each target was last built from, identified by their content hash.
+# Files are only hashed again when their size or modification time have changed.
+class BuildManifest:
+
+    # Attributes
+
+    ## Version of the manifest format, to be increased whenever its layout changes.
+    version = 1
+    ## Path to the manifest file.
+    path = None
+    ## Dictionary mapping the absolute path of each file hashed so far to a [size, mtime, sha1] list.
+    files = None
+    ## Dictionary mapping each target to a dictionary holding the hash of each of its inputs.
+    targets = None
+
+    ## The constructor loads the manifest file, if it exists and has the right version.
+    # @param path Path to the manifest file.
+    def __init__(self, path):
+        self.path = path
+        self.files = dict()
+        self.targets = dict()
+        try:
+            with open(path, 'r') as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            return
+        if manifest.get("version") == self.version:
+            self.files = manifest["files"]
+            self.targets = manifest["targets"]
+
+    ## Returns the SHA-1 hash of the contents of a file, or None if the file does not exist.
+    # @param file_name Path to the file.
+    def hash_file(self, file_name):
+        file_name = os.path.abspath(file_name)
+        try:
+            stat = os.stat(file_name)
+        except OSError:
+            return None
+        entry = self.files.get(file_name)
+        if entry is None or entry[0] != stat.st_size or entry[1] != stat.st_mtime:
+            entry = [stat.st_size, stat.st_mtime, ParsedFileCache.get_content_hash(file_name)]
+            self.files[file_name] = entry
+        return entry[2]
+
+    ## Returns the SHA-1 hash of a text.
+    # @param text The text, as a string.
+    @staticmethod
+    def hash_text(text):
+        return hashlib.sha1(text).hexdigest()
+
+    ## Compares the inputs of a target to those it was last built from.
+    # @param target The name of the target.
+    # @param inputs A dictionary holding the hash of each input.
+    # @return The list of reasons to rebuild the target (empty if it is up to date).
+    def get_changes(self, target, inputs):
+        recorded = self.targets.get(target)
+        if recorded is None:
+            return ["never built"]
+        reasons = []
+        for name in sorted(inputs):
+            if name not in recorded:
+                reasons.append("{} added".format(name))
+            elif recorded[name] != inputs[name]:
+                reasons.append("{} changed".format(name))
+        reasons += ["{} removed".format(name) for name in sorted(recorded) if name not in inputs]
+        return reasons
+
+    ## Records the inputs a target was built from.
+    # @param target The name of the target.
+    # @param inputs A dictionary holding the hash of each input.
+    def set_target(self, target, inputs):
+        self.targets[target] = inputs
+
+    ## Writes the manifest file, through a temporary file.
+    def save(self):
+        manifest_dir = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(manifest_dir)
+        except OSError:
+            pass
+        handle, temp_path = tempfile.mkstemp(dir = manifest_dir, suffix = ".tmp")
+        with os.fdopen(handle, 'w') as f:
+            json.dump({"version": self.version, "files": self.files, "targets": self.targets}, f)
+        os.rename(temp_path, self.path)
+
+## This class builds the targets of the pipeline whose inputs changed.
+class IncrementalBuild:
+
+    # Attributes
+
+    ## The parsed command-line arguments.
+    args = None
+    ## The manifest (see BuildManifest).
+    manifest = None
+    ## Whether to only print the plan.
+    dry_run = None
+    ## Dictionary holding the hash of the contents each tableviewer file has (or would have, in a dry run)
+    # after the conversion step.
+    matrix_hashes = None
+
+    ## The constructor.
+    # @param args The parsed command-line arguments.
+    def __init__(self, args):
+        self.args = args
+        self.dry_run = args.dry_run
+        self.manifest = BuildManifest(args.manifest)
+        self.matrix_hashes = dict()
+
+    ## Prints a step of the plan.
+    # @param target The target (re)built.
+    # @param reasons The list of reasons to rebuild the target.
+    def _plan(self, target, reasons):
+        print("{} {} ({})".format("Would rebuild" if self.dry_run else "Rebuilding", target, ", ".join(reasons)))
+
+    ## Returns the path of a tableviewer file.
+    # @param commodity The commodity.
+    # @param year The year.
+    # @param suffix Either "" or "_without_productions".
+    def _get_matrix_file(self, commodity, year, suffix):
+        return os.path.join(self.args.output_dir, commodity, "{}_{}{}.txt".format(commodity, year, suffix))
+
+    ## Writes a file if its contents differ from the given text.
+    # @param file_name Path to the file.
+    # @param contents The text to write.
+    # @param reasons Reasons for its inputs to have changed, printed in the plan.
+    # @return The hash of the contents.
+    def _update_file(self, file_name, contents, reasons):
+        new_hash = self.manifest.hash_text(contents)
+        old_hash = self.manifest.hash_file(file_name)
+        if old_hash != new_hash:
+            self._plan(file_name, reasons + ["contents changed" if old_hash is not None else "missing"])
+            if not self.dry_run:
+                try:
+                    os.makedirs(os.path.dirname(file_name))
+                except OSError:
+                    pass
+                with open(file_name, 'w') as f:
+                    f.write(contents)
+                self.manifest.hash_file(file_name)
+        return new_hash
+
+    ## Regenerates the tableviewer files of the commodities whose inputs changed.
+    def build_matrices(self):
+        data_dir = self.args.data_dir
+        common_inputs = {
+            "regions.csv": self.manifest.hash_file(os.path.join(data_dir, "regions.csv")),
+            "country_regions.csv": self.manifest.hash_file(os.path.join(data_dir, "country_regions.csv")),
+            "settings": self.manifest.hash_text(repr((list(faostat_main.years), faostat_main.threshold))),
+        }
+        for file_name in get_conversion_modules():
+            common_inputs[os.path.basename(file_name)] = self.manifest.hash_file(file_name)
+
+        changed = []
+        for commodity in self.args.commodities:
+            inputs = dict(common_inputs)
+            for job_commodity, file_name in faostat_main.get_jobs(data_dir, [commodity]):
+                inputs[os.path.basename(file_name)] = self.manifest.hash_file(file_name)
+            missing_inputs = sorted(name for name, input_hash in inputs.items() if input_hash is None)
+            if missing_inputs:
+                print("WARNING! Skipping commodity {}, missing files: {}".format(commodity, ", ".join(missing_inputs)))
+                continue
+            reasons = self.manifest.get_changes("matrices:" + commodity, inputs)
+            matrix_files = [self._get_matrix_file(commodity, year, suffix)
+                            for year in faostat_main.years for suffix in ("", "_without_productions")]
+            missing = [f for f in matrix_files if not os.path.exists(f)]
+            if missing and not reasons:
+                reasons = ["{} files missing".format(len(missing))]
+            if reasons:
+                changed.append((commodity, inputs, reasons))
+            else:
+                for file_name in matrix_files:
+                    self.matrix_hashes[file_name] = self.manifest.hash_file(file_name)
+
+        if not changed:
+            return
+
+        # Only the commodities whose inputs changed are loaded. The XML files are parsed through the
+        # cache, so loading a commodity whose XML files did not change is cheap. Dry runs do not use the cache,
+        # which would otherwise be written.
+        cache_dir = None if self.args.no_cache or self.dry_run else os.path.join(data_dir, ".cache")
+        # The loading messages of dry runs would bury the plan, only the warnings are printed
+        data_structure = FAOStatTradeData(cache_dir, Metrics(Metrics.QUIET) if self.dry_run else None)
+        data_structure.load_regions(os.path.join(data_dir, "regions.csv"))
+        data_structure.load_country_regions(os.path.join(data_dir, "country_regions.csv"))
+        data_structure.load_data_parallel(faostat_main.get_jobs(data_dir, [commodity for commodity, inputs, reasons in changed]))
+
+        for commodity, inputs, reasons in changed:
+            for year in faostat_main.years:
+                for suffix, contents in data_structure.format_trade_matrix_pair(year, commodity, faostat_main.threshold):
+                    file_name = self._get_matrix_file(commodity, year, suffix)
+                    self.matrix_hashes[file_name] = self._update_file(file_name, contents, reasons)
+            if not self.dry_run:
+                self.manifest.set_target("matrices:" + commodity, inputs)
+
+    ## Renders the diagrams whose tableviewer file, configuration or rendering code (see DiagramRenderer.code_files) changed.
+    # @return The list of tableviewer files whose diagrams failed to render.
+    def build_diagrams(self):
+        renderer = DiagramRenderer(self.args.results_dir, force = True)
+        conf_inputs = dict((os.path.join("etc", f), self.manifest.hash_file(os.path.join(renderer.conf_dir, f)))
+                           for f in os.listdir(renderer.conf_dir))
+        for file_name in renderer.code_files:
+            conf_inputs[os.path.basename(file_name)] = self.manifest.hash_file(file_name)
+
+        to_render = []
+        for file_name in sorted(self.matrix_hashes):
+            inputs = dict(conf_inputs)
+            inputs["data"] = self.matrix_hashes[file_name]
+            base_name = os.path.join(self.args.results_dir, os.path.splitext(os.path.basename(file_name))[0])
+            reasons = self.manifest.get_changes("diagram:" + os.path.abspath(file_name), inputs)
+            if not reasons and not all(os.path.exists(base_name + extension)
+                                       for extension in (".svg", ".jpg", ".eps", ".pdf")):
+                reasons = ["diagrams missing"]
+            if reasons:
+                self._plan("diagrams of " + file_name, reasons)
+                to_render.append((file_name, inputs))
+
+        if self.dry_run or not to_render:
+            return []
+
+        failures = []
+        inputs = dict((os.path.abspath(file_name), file_inputs) for file_name, file_inputs in to_render)
+        pool = ThreadPool(max(1, self.args.jobs))
+        try:
+            for data_file, timings, error in pool.imap_unordered(renderer.render, [f for f, i in to_render]):
+                if error is None:
+                    print("Rendered diagrams of {} in {:.2f} s".format(data_file, sum(t for stage, t in timings)))
+                    self.manifest.set_target("diagram:" + data_file, inputs[data_file])
+                else:
+                    print("ERROR: {}: {}".format(data_file, error))
+                    failures.append(data_file)
+        finally:
+            pool.close()
+            pool.join()
+        return failures
+
+    ## Writes the LaTeX documents whose contents changed.
+    def build_latex(self):
+        for commodity in self.args.commodities:
+            for suffix, contents in generate_latex.generate_documents(commodity, generate_latex.years):
+                self._update_file(os.path.join(self.args.latex_dir, commodity + suffix + ".tex"), contents, [])
+
+    ## Saves the manifest, unless this is a dry run.
+    def save(self):
+        if not self.dry_run:
+            self.manifest.save()
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Incrementally generates the tableviewer files, the diagrams and the LaTeX documents.")
+    parser.add_argument("--data-dir", default = os.path.join(script_dir, "..", "data"), help = "folder holding the regions, the country-to-region mapping and the XML files")
+    parser.add_argument("--output-dir", default = os.path.join(script_dir, "..", "output"), help = "folder where the tableviewer files are written")
+    parser.add_argument("--results-dir", default = os.path.join(script_dir, "results"), help = "folder where the diagrams are saved")
+    parser.add_argument("--latex-dir", default = os.path.join(script_dir, "latex"), help = "folder where the LaTeX documents are saved")
+    parser.add_argument("--manifest",
+                        help = "file recording the inputs of each target (default: <data_dir>/.cache/build_manifest.json)")
+    parser.add_argument("--commodities", nargs = "+", default = list(faostat_main.commodities), help = "commodities to build")
+    parser.add_argument("--jobs", type = int, default = multiprocessing.cpu_count(), help = "number of diagrams rendered in parallel")
+    parser.add_argument("--no-cache", action = "store_true", help = "always parse the XML files")
+    parser.add_argument("--no-diagrams", action = "store_true", help = "do not render the diagrams")
+    parser.add_argument("--dry-run", action = "store_true", help = "only print what would be rebuilt and why")
+    args = parser.parse_args()
+    if args.manifest is None:
+        args.manifest = os.path.join(args.data_dir, ".cache", "build_manifest.json")
+
+    build = IncrementalBuild(args)
+    build.build_matrices()
+    build.save()
+    failures = []
+    if not args.no_diagrams:
+        failures = build.build_diagrams()
+        build.save()
+    build.build_latex()
+    build.save()
+
+    if failures:
+        sys.exit("ERROR: {} files failed to render:\n{}".format(len(failures), "\n".join(sorted(failures))))
@@ -0,0 +1 @@
+../src/faostat_bulk_csv.py
\ No newline at end of file
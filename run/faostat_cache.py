@@ -0,0 +1 @@
+../src/faostat_cache.py
\ No newline at end of file
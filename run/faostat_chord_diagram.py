@@ -0,0 +1 @@
+../src/faostat_chord_diagram.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/faostat_derived_series.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/faostat_flow_index.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/faostat_main.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/faostat_metrics.py
\ No newline at end of file
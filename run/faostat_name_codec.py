@@ -0,0 +1 @@
+../src/faostat_name_codec.py
\ No newline at end of file
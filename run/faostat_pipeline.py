@@ -0,0 +1 @@
+../src/faostat_pipeline.py
\ No newline at end of file
@@ -0,0 +1 @@
+../src/faostat_table_index.py
\ No newline at end of file
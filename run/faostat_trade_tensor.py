@@ -0,0 +1 @@
+../src/faostat_trade_tensor.py
\ No newline at end of file
@@ -0,0 +1,306 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file generate_diagrams.py
+#
+# This file generates circular diagrams for a set of tabular files matching the requirement of the tableviewer
+# program in the circos-tools package. It runs the same stages as generate_diagrams.bash, but renders several
+# files in parallel, each in its own temporary directory, and skips the stages whose outputs are up to date.
+# Unlike generate_diagrams.bash, it can be run from any directory.
+
+from faostat_name_codec import NameCodec
+import os, os.path, sys
+import argparse
+# Modules needed to run the external programs and handle their working directories.
+import subprocess, tempfile, shutil
+import time
+from multiprocessing.pool import ThreadPool
+import multiprocessing
+
+## Directory holding this script, the configuration files and the results.
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+## Directories holding the Circos and tableviewer programs.
+tool_dirs = (os.path.join(script_dir, "..", "third-party", "circos-0.64", "bin"),
+             os.path.join(script_dir, "..", "third-party", "circos-tools-0.16", "tools", "tableviewer", "bin"))
+
+## Options passed to the parse-table program of tableviewer.
+parse_table_options = ["-segment_order=ascii,size_desc", "-placement_order=row,col", "-intra_cell_handling=hide",
+                       "-interpolate_type", "count", "-color_source", "row", "-transparency", "2",
+                       "-fade_transparency", "0", "-ribbon_bundle_order=size_asc", "-ribbon_layer_order=size_asc"]
+
+## This class renders tableviewer files into SVG, JPG, EPS and PDF diagrams.
+# The stages of a file are run in sequence, in a temporary directory unique to the file, and their
+# outputs are moved to the results directory once complete, so that a failed or interrupted stage
+# never leaves a partial file behind. A stage is skipped if its outputs are more recent than its inputs,
+# which include the source files of the code the SVG diagrams depend on (see code_files).
+class DiagramRenderer:
+
+    # Attributes
+
+    ## Names of the stages, in the order in which they are run.
+    stages = ("parse-table", "circos", "svg-name-fix", "jpg", "eps", "pdf")
+    ## Directory where the diagrams are saved.
+    results_dir = None
+    ## Directory holding the configuration files.
+    conf_dir = None
+    ## Source files of the code the SVG diagrams depend on: this script, the name codec run by the svg-name-fix stage
+    # and the in-process chord diagram renderer.
+    code_files = None
+    ## Whether all stages are run, even if their outputs are up to date.
+    force = None
+    ## Environment of the external programs.
+    environment = None
+
+    ## The constructor creates the results directory if needed.
+    # @param results_dir Directory where the diagrams are saved.
+    # @param force Whether all stages are run, even if their outputs are up to date.
+    def __init__(self, results_dir, force = False):
+        self.results_dir = results_dir
+        self.conf_dir = os.path.join(script_dir, "etc")
+        self.code_files = [os.path.join(script_dir, f)
+                           for f in ("generate_diagrams.py", "faostat_name_codec.py", "faostat_chord_diagram.py")]
+        self.force = force
+        self.environment = dict(os.environ)
+        self.environment["PATH"] = os.pathsep.join([os.path.abspath(d) for d in tool_dirs] + [os.environ.get("PATH", "")])
+        try:
+            os.makedirs(results_dir)
+        except OSError:
+            pass
+
+    ## Renders a tableviewer file.
+    # @param data_file Path to the tableviewer file.
+    # @return A (data_file, timings, error) tuple, where timings is a list of (stage, seconds) tuples
+    # (seconds being None for skipped stages) and error is an error message, or None if all stages succeeded.
+    def render(self, data_file):
+        base_name = os.path.splitext(os.path.basename(data_file))[0]
+        svg_file, jpg_file, eps_file, pdf_file = [os.path.join(self.results_dir, base_name + extension)
+                                                  for extension in (".svg", ".jpg", ".eps", ".pdf")]
+        conf_files = [os.path.join(self.conf_dir, f) for f in os.listdir(self.conf_dir)]
+        data_file = os.path.abspath(data_file)
+
+        timings = []
+        work_dir = tempfile.mkdtemp(prefix = base_name + "-")
+        try:
+            if self._is_current([svg_file], [data_file] + conf_files + self.code_files):
+                timings += [(stage, None) for stage in ("parse-table", "circos", "svg-name-fix")]
+            else:
+                shutil.copytree(self.conf_dir, os.path.join(work_dir, "etc"))
+                os.mkdir(os.path.join(work_dir, "results"))
+                self._run_stage(timings, "parse-table", self._parse_table, data_file, work_dir)
+                self._run_stage(timings, "circos", self._run_pipeline, [["circos", "-conf", "etc/circos.conf"]], work_dir)
+                self._run_stage(timings, "svg-name-fix", self._fix_names,
+                                os.path.join(work_dir, "results", "circos-table-conf-large.svg"), svg_file, work_dir)
+
+            if self._is_current([jpg_file], [svg_file]):
+                timings.append(("jpg", None))
+            else:
+                self._run_stage(timings, "jpg", self._convert_to_jpg, svg_file, jpg_file, work_dir)
+
+            if self._is_current([eps_file], [svg_file]):
+                timings.append(("eps", None))
+            else:
+                self._run_stage(timings, "eps", self._convert_to_eps, svg_file, eps_file, work_dir)
+
+            if self._is_current([pdf_file], [eps_file]):
+                timings.append(("pdf", None))
+            else:
+                self._run_stage(timings, "pdf", self._convert_to_pdf, eps_file, pdf_file, work_dir)
+        except (RuntimeError, EnvironmentError) as error:
+            return data_file, timings, "{}: {}".format(self.stages[len(timings)], error)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors = True)
+
+        return data_file, timings, None
+
+    ## Tells whether the outputs of a stage are more recent than its inputs.
+    # @param outputs List of paths to the output files.
+    # @param inputs List of paths to the input files.
+    def _is_current(self, outputs, inputs):
+        if self.force or not all(os.path.exists(path) for path in outputs):
+            return False
+        return min(os.path.getmtime(path) for path in outputs) >= max(os.path.getmtime(path) for path in inputs)
+
+    ## Runs a stage and records its wall time.
+    # @param timings The list of (stage, seconds) tuples to append to.
+    # @param stage The name of the stage.
+    # @param function The function running the stage, called with the remaining arguments.
+    def _run_stage(self, timings, stage, function, *args):
+        start = time.time()
+        function(*args)
+        timings.append((stage, time.time() - start))
+
+    ## Runs a pipeline of external programs in a given directory, logging their output to the log.txt file
+    # of the directory.
+    # @param commands List of commands (lists of arguments), the output of each one being piped to the next one.
+    # @param work_dir The working directory.
+    # @param output_file Path to a file to write the output of the last command to, or None to log it.
+    def _run_pipeline(self, commands, work_dir, output_file = None):
+        log_path = os.path.join(work_dir, "log.txt")
+        with open(log_path, 'a') as log:
+            output = log if output_file is None else open(output_file, 'wb')
+            processes = []
+            try:
+                for i, command in enumerate(commands):
+                    stdin = processes[-1].stdout if processes else None
+                    stdout = subprocess.PIPE if i < len(commands) - 1 else output
+                    try:
+                        processes.append(subprocess.Popen(command, cwd = work_dir, env = self.environment,
+                                                          stdin = stdin, stdout = stdout, stderr = log))
+                    except OSError as error:
+                        raise RuntimeError("cannot run {}: {}".format(command[0], error.strerror))
+                    # Only the next program holds the pipe, so that it gets closed if that program exits
+                    if stdin is not None:
+                        stdin.close()
+            finally:
+                for process in processes:
+                    process.wait()
+                if output_file is not None:
+                    output.close()
+
+        for command, process in zip(commands, processes):
+            if process.returncode != 0:
+                with open(log_path, 'r') as log:
+                    tail = log.readlines()[-10:]
+                raise RuntimeError("{} exited with status {}\n{}".format(command[0], process.returncode,
+                                                                        "".join("    " + line for line in tail)))
+
+    ## Moves a file produced in a working directory to its final location.
+    # @param source Path to the file in the working directory.
+    # @param target Path to the final file.
+    @staticmethod
+    def _install(source, target):
+        # The temporary file is moved next to the target first, since renaming is atomic on the same file system.
+        # Its name is unique, so that concurrent renders of the same target do not write to the same file.
+        handle, temp_target = tempfile.mkstemp(prefix = os.path.basename(target) + ".", suffix = ".tmp",
+                                               dir = os.path.dirname(target) or ".")
+        os.close(handle)
+        try:
+            shutil.move(source, temp_target)
+            os.rename(temp_target, target)
+        except:
+            if os.path.exists(temp_target):
+                os.remove(temp_target)
+            raise
+
+    ## Converts a tableviewer file into Circos data and configuration files.
+    # @param data_file Path to the tableviewer file.
+    # @param work_dir The working directory.
+    def _parse_table(self, data_file, work_dir):
+        if "without_productions" in data_file:
+            conf_file = "parse-table-without-productions.conf"
+        else:
+            conf_file = "parse-table.conf"
+        self._run_pipeline([["parse-table", "-conf", os.path.join("etc", conf_file), "-file", data_file] + parse_table_options,
+                            ["make-conf", "-dir", "data"]], work_dir)
+
+    ## Decodes the country names in the SVG file produced by Circos (see svg_name_fix.py).
+    # @param circos_file Path to the SVG file produced by Circos.
+    # @param svg_file Path to the final SVG file.
+    # @param work_dir The working directory.
+    def _fix_names(self, circos_file, svg_file, work_dir):
+        fixed_file = os.path.join(work_dir, os.path.basename(svg_file))
+        with open(circos_file, 'r') as f:
+            with open(fixed_file, 'w') as f_hdl:
+                NameCodec().decode_stream(f, f_hdl)
+        self._install(fixed_file, svg_file)
+
+    ## Renders an SVG file into a JPG image.
+    # @param svg_file Path to the SVG file.
+    # @param jpg_file Path to the JPG file.
+    # @param work_dir The working directory.
+    def _convert_to_jpg(self, svg_file, jpg_file, work_dir):
+        temp_file = os.path.join(work_dir, os.path.basename(jpg_file))
+        self._run_pipeline([["rsvg-convert", svg_file],
+                            ["convert", "png:-", "-units", "PixelsPerInch", "-background", "white", "-density", "300",
+                             "-flatten", "-trim", "-bordercolor", "White", temp_file]], work_dir)
+        self._install(temp_file, jpg_file)
+
+    ## Exports an SVG file into an EPS file.
+    # @param svg_file Path to the SVG file.
+    # @param eps_file Path to the EPS file.
+    # @param work_dir The working directory.
+    def _convert_to_eps(self, svg_file, eps_file, work_dir):
+        temp_file = os.path.join(work_dir, os.path.basename(eps_file))
+        self._run_pipeline([["inkscape", "-f", svg_file, "-E", temp_file]], work_dir)
+        self._install(temp_file, eps_file)
+
+    ## Converts an EPS file into a PDF file.
+    # @param eps_file Path to the EPS file.
+    # @param pdf_file Path to the PDF file.
+    # @param work_dir The working directory.
+    def _convert_to_pdf(self, eps_file, pdf_file, work_dir):
+        temp_file = os.path.join(work_dir, os.path.basename(pdf_file))
+        self._run_pipeline([["epstopdf", "--outfile=" + temp_file, eps_file]], work_dir)
+        self._install(temp_file, pdf_file)
+
+## Returns the tableviewer files given on the command line, folders being searched recursively for .txt files.
+# @param paths List of paths to files or folders.
+def find_data_files(paths):
+    data_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names.sort()
+                data_files += [os.path.join(dir_path, f) for f in sorted(file_names) if f.endswith(".txt")]
+        else:
+            data_files.append(path)
+    return data_files
+
+## Formats a duration for display.
+# @param seconds The duration, or None for skipped stages.
+def format_time(seconds):
+    if seconds is None:
+        return "skipped"
+    return "{:.2f} s".format(seconds)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Generates circular diagrams from Circos tableviewer files.")
+    parser.add_argument("data_files", nargs = "+", help = "tableviewer files, or folders holding them")
+    parser.add_argument("--results-dir", default = os.path.join(script_dir, "results"),
+                        help = "folder where the diagrams are saved (default: the results/ folder next to this script)")
+    parser.add_argument("--jobs", type = int, default = multiprocessing.cpu_count(),
+                        help = "number of files rendered in parallel (default: number of CPUs)")
+    parser.add_argument("--force", action = "store_true", help = "run all stages, even if their outputs are up to date")
+    args = parser.parse_args()
+
+    data_files = find_data_files(args.data_files)
+    renderer = DiagramRenderer(args.results_dir, args.force)
+
+    start = time.time()
+    stage_times = dict((stage, 0.0) for stage in DiagramRenderer.stages)
+    failures = []
+    pool = ThreadPool(max(1, args.jobs))
+    for data_file, timings, error in pool.imap_unordered(renderer.render, data_files):
+        print("{} ({}): {}".format(data_file, format_time(sum(t for stage, t in timings if t is not None)),
+                                   ", ".join("{} {}".format(stage, format_time(t)) for stage, t in timings)))
+        for stage, t in timings:
+            stage_times[stage] += t or 0.0
+        if error is not None:
+            print("ERROR: {}: {}".format(data_file, error))
+            failures.append(data_file)
+    pool.close()
+    pool.join()
+
+    print("Rendered {} files in {}".format(len(data_files) - len(failures), format_time(time.time() - start)))
+    for stage in DiagramRenderer.stages:
+        print("    {}: {}".format(stage, format_time(stage_times[stage])))
+
+    if failures:
+        sys.exit("ERROR: {} files failed:\n{}".format(len(failures), "\n".join(sorted(failures))))
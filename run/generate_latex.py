@@ -25,44 +25,14 @@
 
 import os, os.path
 
-## Generates the LaTeX code for the table
-# @param template Tempalte code with %%..%% placeholders
-# @param commodity Commodity
-# @years List of years (even, with one out of two years skipped)
-# @param Extension of image files
-# @suffix Suffix to add to the image files
-def generate_tables(template, commodity, years, img_ext, suffix=""):
-
-    tables = ""
-
-    for year in years:
-        tables += template.replace("%%YEAR1%%", str(year)).replace("%%YEAR2%%", str(year+1)).replace("%%SUFFIX%%", suffix).replace("%%EXT%%", img_ext).replace("%%COMMODITY%%", commodity)
-
-    return tables
-
-## Write to a text file
-# @param out_dir Name of sub-folder where to write the file
-# @param contents Text to write to the file
-# @param commodity Name of the commodity
-# @param suffix Suffix to append to the saved file name
-def write_to_file(out_dir, contents, commodity, suffix):
-    fpath = os.path.join(out_dir, commodity + suffix + ".tex")
-
-    with open(fpath, 'w') as f:
-        f.write(tex)
-    print("Saved LaTeX file: {}".format(fpath))
-
-
-if __name__ == "__main__":
-
-    ## The name of the sub-folder where the LaTeX is to be saved
-    out_dir = "latex"
-    ## The commodities to take into consideration
-    commodities = ("Wheat", "Maize", "Soybeans")
-    ## The years to take into consideration. For the time being, this only works for even numbers of years!
-    years = range(2000, 2012, 2)
-    ## Template of the LaTeX document. It contains %%..%% placeholders to substitute.
-    backbone = r"""
+## The name of the sub-folder where the LaTeX is to be saved
+out_dir = "latex"
+## The commodities to take into consideration
+commodities = ("Wheat", "Maize", "Soybeans")
+## The years to take into consideration. For the time being, this only works for even numbers of years!
+years = range(2000, 2012, 2)
+## Template of the LaTeX document. It contains %%..%% placeholders to substitute.
+backbone = r"""
 
 \documentclass[12pt, a4paper]{article}
 
@@ -93,8 +63,8 @@ if __name__ == "__main__":
 \end{document}
     """
 
-    ## Template of the LaTeX table containing the images. It contains %%..%% placeholders to substitute.
-    table_template = r"""
+## Template of the LaTeX table containing the images. It contains %%..%% placeholders to substitute.
+table_template = r"""
 \begin{center}
 \begin{tabular}{@{}cc@{}}
 \includegraphics[width=.45\linewidth]{%%COMMODITY%%_%%YEAR1%%%%SUFFIX%%.%%EXT%%} &
@@ -104,34 +74,65 @@ if __name__ == "__main__":
 \end{center}
     """
 
-    try:
-        os.mkdir("latex")
-    except OSError:
-        pass
+## Generates the LaTeX code for the table
+# @param template Tempalte code with %%..%% placeholders
+# @param commodity Commodity
+# @years List of years (even, with one out of two years skipped)
+# @param Extension of image files
+# @suffix Suffix to add to the image files
+def generate_tables(template, commodity, years, img_ext, suffix=""):
 
-    for commodity in commodities:
+    tables = ""
 
-        # With productions (raster)
-        tex = backbone.replace("%%COMMODITY%%", commodity).replace("%%WHAT%%", "production and trade")
-        tables = generate_tables(table_template, commodity, years, "jpg")
-        tex = tex.replace("%%TABLE%%", tables)
-        write_to_file(out_dir, tex, commodity, "_raster")
+    for year in years:
+        tables += template.replace("%%YEAR1%%", str(year)).replace("%%YEAR2%%", str(year+1)).replace("%%SUFFIX%%", suffix).replace("%%EXT%%", img_ext).replace("%%COMMODITY%%", commodity)
 
-        # With productions (raster)
-        tex = backbone.replace("%%COMMODITY%%", commodity).replace("%%WHAT%%", "trade")
-        tables = generate_tables(table_template, commodity, years, "jpg", suffix="_without_productions")
-        tex = tex.replace("%%TABLE%%", tables)
-        write_to_file(out_dir, tex, commodity, "_without_productions_raster")
+    return tables
+
+## Write to a text file
+# @param out_dir Name of sub-folder where to write the file
+# @param contents Text to write to the file
+# @param commodity Name of the commodity
+# @param suffix Suffix to append to the saved file name
+def write_to_file(out_dir, contents, commodity, suffix):
+    fpath = os.path.join(out_dir, commodity + suffix + ".tex")
 
-        # With productions (vectorized)
+    with open(fpath, 'w') as f:
+        f.write(contents)
+    print("Saved LaTeX file: {}".format(fpath))
+
+
+## Generates the four LaTeX documents of a commodity: with and without productions, with rasterized
+# and vectorized images.
+# @param commodity Commodity
+# @param years List of years (even, with one out of two years skipped)
+# @return A list of (suffix, contents) tuples, where suffix is appended to the commodity in the file name
+def generate_documents(commodity, years):
+
+    documents = []
+
+    for suffix, img_ext in (("_raster", "jpg"), ("_vectorized", "pdf")):
+
+        # With productions
         tex = backbone.replace("%%COMMODITY%%", commodity).replace("%%WHAT%%", "production and trade")
-        tables = generate_tables(table_template, commodity, years, "pdf")
-        tex = tex.replace("%%TABLE%%", tables)
-        write_to_file(out_dir, tex, commodity, "_vectorized")
+        tables = generate_tables(table_template, commodity, years, img_ext)
+        documents.append((suffix, tex.replace("%%TABLE%%", tables)))
 
-        # With productions (vectorized)
+        # Without productions
         tex = backbone.replace("%%COMMODITY%%", commodity).replace("%%WHAT%%", "trade")
-        tables = generate_tables(table_template, commodity, years, "pdf", suffix="_without_productions")
-        tex = tex.replace("%%TABLE%%", tables)
-        write_to_file(out_dir, tex, commodity, "_without_productions_vectorized")
+        tables = generate_tables(table_template, commodity, years, img_ext, suffix="_without_productions")
+        documents.append(("_without_productions" + suffix, tex.replace("%%TABLE%%", tables)))
+
+    return documents
 
+
+if __name__ == "__main__":
+
+    try:
+        os.mkdir(out_dir)
+    except OSError:
+        pass
+
+    for commodity in commodities:
+        for suffix, tex in generate_documents(commodity, years):
+            write_to_file(out_dir, tex, commodity, suffix)
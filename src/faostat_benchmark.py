@@ -0,0 +1,336 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_benchmark.py
+#
+# This file contains a benchmark of the public methods of FAOStatTradeData on synthetic data
+# (see faostat_synthetic_data.py).
+#
+# Each benchmark runs in its own process, so that the peak memory usage reported for a method is not
+# affected by the other benchmarks. The best time out of several runs is kept, and the throughput is
+# given in elements per second, the elements depending on the method (e.g. XML entries for the loading
+# methods, matrix cells for the saving methods). Results are saved as JSON, and can be compared to the
+# results of a previous run to detect regressions.
+#
+# The memo of the name codec is cleared before each run, so that every run starts from the same state,
+# and the number of names found (hits) and not found (misses) in the memo during a run is reported.
+
+from faostat_trade_data import FAOStatTradeData, name_codec
+from faostat_synthetic_data import SyntheticDataGenerator
+from faostat_trade_tensor import TradeTensor, ProductionTensor
+from faostat_network_analytics import NetworkAnalytics
+import os, os.path, sys
+import argparse
+import json
+import time
+# Modules needed to run each benchmark in its own process and measure its peak memory usage.
+import multiprocessing, resource, Queue
+import tempfile, shutil
+import platform
+
+## Version of the format of the results, to be increased whenever it changes.
+results_version = 2
+
+## Returns a FAOStatTradeData object with the regions and the country-to-region mapping of a data folder loaded.
+# @param data_dir Path to the data folder.
+def _load_regions(data_dir):
+    data_structure = FAOStatTradeData()
+    data_structure.load_regions(os.path.join(data_dir, "regions.csv"))
+    data_structure.load_country_regions(os.path.join(data_dir, "country_regions.csv"))
+    return data_structure
+
+## Returns a FAOStatTradeData object with all the files of a data folder loaded.
+# @param data_dir Path to the data folder.
+# @param description The description of the data folder (see SyntheticDataGenerator.generate()).
+def _load_all(data_dir, description):
+    data_structure = _load_regions(data_dir)
+    for commodity, file_name in description["trade_files"]:
+        data_structure.load_trade_data(os.path.join(data_dir, file_name))
+    for commodity, file_name in description["production_files"]:
+        data_structure.load_production_data(os.path.join(data_dir, file_name))
+    return data_structure
+
+## Returns the number of cells of the tableviewer files of all year/commodity combinations.
+# @param data_structure A FAOStatTradeData object with the data loaded.
+def _count_cells(data_structure):
+    count = 0
+    for year, commodity in data_structure.trade_matrices.keys():
+        sizes, regions_to_write = data_structure._get_region_sizes(year, commodity)
+        count += len(regions_to_write) ** 2
+    return count
+
+# Benchmarks: each function gets the data folder, its description and a scratch folder, and returns
+# a (run, elements) tuple, where run is the function to time and elements the number of elements it processes.
+
+def _benchmark_load_regions(data_dir, description, scratch_dir):
+    run = lambda: _load_regions(data_dir)
+    return run, description["parameters"]["regions"] + description["parameters"]["countries"]
+
+def _benchmark_load_trade_data(data_dir, description, scratch_dir):
+    data_structure = _load_regions(data_dir)
+    def run():
+        data_structure.trade_matrices = TradeTensor(len(data_structure.region_numbers))
+        data_structure.country_records = []
+        for commodity, file_name in description["trade_files"]:
+            data_structure.load_trade_data(os.path.join(data_dir, file_name))
+    return run, description["trade_entries"]
+
+def _benchmark_load_production_data(data_dir, description, scratch_dir):
+    data_structure = _load_regions(data_dir)
+    def run():
+        data_structure.productions = ProductionTensor(len(data_structure.region_numbers))
+        data_structure.country_records = []
+        for commodity, file_name in description["production_files"]:
+            data_structure.load_production_data(os.path.join(data_dir, file_name))
+    return run, description["production_entries"]
+
+def _benchmark_load_data_parallel(data_dir, description, scratch_dir):
+    jobs = [(commodity, os.path.join(data_dir, file_name))
+            for commodity, file_name in description["trade_files"] + description["production_files"]]
+    def run():
+        _load_regions(data_dir).load_data_parallel(jobs)
+    return run, description["trade_entries"] + description["production_entries"]
+
+def _benchmark_regroup(data_dir, description, scratch_dir):
+    data_structure = _load_all(data_dir, description)
+    run = lambda: data_structure.regroup(os.path.join(data_dir, "regions.csv"), os.path.join(data_dir, "country_regions.csv"))
+    return run, description["trade_quantities"] + description["production_entries"]
+
+def _benchmark_save_trade_matrix(data_dir, description, scratch_dir):
+    data_structure = _load_all(data_dir, description)
+    def run():
+        for year, commodity in data_structure.trade_matrices.keys():
+            data_structure.save_trade_matrix(year, commodity, os.path.join(scratch_dir, "matrix.txt"), True)
+    return run, _count_cells(data_structure)
+
+def _benchmark_save_trade_matrices(data_dir, description, scratch_dir):
+    data_structure = _load_all(data_dir, description)
+    run = lambda: data_structure.save_trade_matrices(scratch_dir)
+    return run, 2 * _count_cells(data_structure)
+
+def _benchmark_get_top_flows(data_dir, description, scratch_dir):
+    data_structure = _load_all(data_dir, description)
+    data_structure.build_flow_index()
+    keys = data_structure.trade_matrices.keys()
+    def run():
+        for year, commodity in keys:
+            data_structure.get_top_flows(year, commodity, 10)
+    return run, len(keys)
+
+def _benchmark_network_analytics(data_dir, description, scratch_dir):
+    analytics = NetworkAnalytics(_load_all(data_dir, description))
+    def run():
+        analytics.get_strengths()
+        analytics.get_import_concentration()
+        analytics.get_pagerank()
+        analytics.get_two_hop_exposure()
+    return run, _count_cells(analytics.data_structure)
+
+## Returns names which are all different, more than the memo of the name codec can hold.
+def _get_distinct_names():
+    return [SyntheticDataGenerator.get_country_name(i) for i in range(4 * name_codec.max_size)]
+
+def _benchmark_name_encode(data_dir, description, scratch_dir):
+    names = _get_distinct_names()
+    def run():
+        for name in names:
+            FAOStatTradeData.name_encode(name)
+    return run, len(names)
+
+def _benchmark_name_decode(data_dir, description, scratch_dir):
+    names = [FAOStatTradeData.name_encode(name) for name in _get_distinct_names()]
+    def run():
+        for name in names:
+            FAOStatTradeData.name_decode(name)
+    return run, len(names)
+
+def _benchmark_name_encode_memo(data_dir, description, scratch_dir):
+    names = [SyntheticDataGenerator.get_country_name(i) for i in range(description["parameters"]["countries"])] * 100
+    def run():
+        for name in names:
+            FAOStatTradeData.name_encode(name)
+    return run, len(names)
+
+def _benchmark_name_decode_memo(data_dir, description, scratch_dir):
+    names = [FAOStatTradeData.name_encode(SyntheticDataGenerator.get_country_name(i))
+             for i in range(description["parameters"]["countries"])] * 100
+    def run():
+        for name in names:
+            FAOStatTradeData.name_decode(name)
+    return run, len(names)
+
+## Benchmarks, by name of the method they time.
+benchmarks = (
+    ("load_regions", _benchmark_load_regions),
+    ("load_trade_data", _benchmark_load_trade_data),
+    ("load_production_data", _benchmark_load_production_data),
+    ("load_data_parallel", _benchmark_load_data_parallel),
+    ("regroup", _benchmark_regroup),
+    ("save_trade_matrix", _benchmark_save_trade_matrix),
+    ("save_trade_matrices", _benchmark_save_trade_matrices),
+    ("get_top_flows", _benchmark_get_top_flows),
+    ("network_analytics", _benchmark_network_analytics),
+    ("name_encode", _benchmark_name_encode),
+    ("name_decode", _benchmark_name_decode),
+    ("name_encode_memo", _benchmark_name_encode_memo),
+    ("name_decode_memo", _benchmark_name_decode_memo),
+)
+
+## Runs a benchmark in the current process and sends its result through a queue.
+# The output of the program is discarded while the benchmark runs.
+# @param queue The queue.
+# @param benchmark The benchmark function.
+# @param data_dir Path to the data folder.
+# @param description The description of the data folder.
+# @param repeat The number of runs.
+def _run_benchmark(queue, benchmark, data_dir, description, repeat):
+    scratch_dir = tempfile.mkdtemp()
+    try:
+        sys.stdout = open(os.devnull, 'w')
+        run, elements = benchmark(data_dir, description, scratch_dir)
+        times = []
+        for i in range(repeat):
+            name_codec.clear()
+            start = time.time()
+            run()
+            times.append(time.time() - start)
+        queue.put({
+            "seconds": min(times),
+            "elements": elements,
+            "elements_per_second": elements / min(times) if min(times) > 0 else None,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "memo_hits": name_codec.hits,
+            "memo_misses": name_codec.misses,
+        })
+    except Exception as error:
+        queue.put({"error": "{}: {}".format(type(error).__name__, error)})
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors = True)
+
+## Runs the benchmarks, each one in its own process.
+# @param data_dir Path to the data folder.
+# @param description The description of the data folder (see SyntheticDataGenerator.generate()).
+# @param names The names of the benchmarks to run, or None to run all of them.
+# @param repeat The number of runs of each benchmark.
+# @return A dictionary of results, indexed by benchmark name.
+def run_benchmarks(data_dir, description, names = None, repeat = 3):
+    results = dict()
+    for name, benchmark in benchmarks:
+        if names is not None and name not in names:
+            continue
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target = _run_benchmark, args = (queue, benchmark, data_dir, description, repeat))
+        process.start()
+        result = None
+        while result is None:
+            try:
+                result = queue.get(timeout = 1)
+            except Queue.Empty:
+                if not process.is_alive():
+                    result = {"error": "process exited with status {}".format(process.exitcode)}
+        process.join()
+        results[name] = result
+        if "error" in result:
+            print("{:>22}: ERROR: {}".format(name, result["error"]))
+        else:
+            print("{:>22}: {:9.3f} s, {:12.0f} elements/s, peak RSS {:7d} KB, memo {:9d} hits {:9d} misses".format(
+                name, result["seconds"], result["elements_per_second"] or 0, result["peak_rss_kb"],
+                result["memo_hits"], result["memo_misses"]))
+    return results
+
+## Compares results to reference results.
+# @param results The results (see run_benchmarks()).
+# @param reference The reference results.
+# @param tolerance The largest relative loss of throughput (or relative increase of peak memory usage) allowed.
+# @return The list of regressions, as text messages.
+def find_regressions(results, reference, tolerance):
+    regressions = []
+    for name in sorted(results):
+        result, reference_result = results[name], reference.get(name)
+        if "error" in result:
+            regressions.append("{}: {}".format(name, result["error"]))
+            continue
+        if reference_result is None or "error" in reference_result:
+            continue
+        if result["elements_per_second"] is not None and reference_result["elements_per_second"] is not None:
+            if result["elements_per_second"] < (1 - tolerance) * reference_result["elements_per_second"]:
+                regressions.append("{}: throughput dropped from {:.0f} to {:.0f} elements/s".format(
+                    name, reference_result["elements_per_second"], result["elements_per_second"]))
+        if result["peak_rss_kb"] > (1 + tolerance) * reference_result["peak_rss_kb"]:
+            regressions.append("{}: peak RSS grew from {} to {} KB".format(
+                name, reference_result["peak_rss_kb"], result["peak_rss_kb"]))
+    return regressions
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Benchmarks the public methods of FAOStatTradeData on synthetic data.")
+    parser.add_argument("--data-dir", help = "folder holding synthetic data (default: generated in a temporary folder); "
+                        "it is generated if it has no synthetic.json file")
+    parser.add_argument("--countries", type = int, default = 250, help = "number of countries")
+    parser.add_argument("--regions", type = int, default = 40, help = "number of regions")
+    parser.add_argument("--years", type = int, default = 12, help = "number of years")
+    parser.add_argument("--commodities", type = int, default = 3, help = "number of commodities")
+    parser.add_argument("--density", type = float, default = 0.2, help = "fraction of partner entries holding a quantity")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed of the random number generator")
+    parser.add_argument("--repeat", type = int, default = 3, help = "number of runs of each benchmark, the best one being kept")
+    parser.add_argument("--only", nargs = "+", choices = [name for name, benchmark in benchmarks], help = "benchmarks to run")
+    parser.add_argument("--output", help = "JSON file where the results are saved")
+    parser.add_argument("--compare", help = "JSON file holding reference results: exits with an error on regressions")
+    parser.add_argument("--tolerance", type = float, default = 0.2, help = "relative loss of performance tolerated (default: 0.2)")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir
+    temp_dir = None
+    if data_dir is None:
+        temp_dir = data_dir = tempfile.mkdtemp()
+    try:
+        description_file = os.path.join(data_dir, "synthetic.json")
+        if os.path.exists(description_file):
+            with open(description_file, 'r') as f:
+                description = json.load(f)
+            print("Using synthetic data from {}".format(data_dir))
+        else:
+            generator = SyntheticDataGenerator(args.countries, args.regions, range(2000, 2000 + args.years),
+                                               args.commodities, args.density, args.seed)
+            print("Generating synthetic data in {}".format(data_dir))
+            description = generator.generate(data_dir)
+        print("{} trade entries, {} production entries".format(description["trade_entries"], description["production_entries"]))
+
+        results = run_benchmarks(data_dir, description, args.only, args.repeat)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors = True)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({"version": results_version, "parameters": description["parameters"], "repeat": args.repeat,
+                       "python": platform.python_version(), "machine": platform.machine(),
+                       "cpus": multiprocessing.cpu_count(), "results": results}, f, indent = 1, sort_keys = True)
+        print("Results saved to {}".format(args.output))
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            reference = json.load(f)
+        if reference.get("version") != results_version:
+            sys.exit("ERROR: Results in {} have an unsupported format".format(args.compare))
+        if reference["parameters"] != description["parameters"]:
+            print("WARNING! Reference results were obtained with different parameters: {}".format(reference["parameters"]))
+        regressions = find_regressions(results, reference["results"], args.tolerance)
+        if regressions:
+            sys.exit("ERROR: {} regressions:\n{}".format(len(regressions), "\n".join(regressions)))
+        print("No regressions compared to {}".format(args.compare))
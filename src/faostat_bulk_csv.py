@@ -0,0 +1,184 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_bulk_csv.py
+#
+# This file contains a chunked reader of the bulk CSV files (normalized layout) distributed by FAOStat,
+# either as zip archives or extracted.
+
+# Numpy is used to turn the rows into column arrays.
+import numpy as np
+# Module needed for CSV file parsing
+import csv
+# Module needed to read the archives without extracting them.
+import zipfile
+import itertools
+
+## This class reads a FAOStat bulk CSV file in the normalized layout (one row per value), chunk by chunk,
+# so that only one chunk of rows is held in memory at a time. Zip archives are decompressed on the fly:
+# every CSV file of an archive is read, one after another.
+#
+# Two kinds of files are supported, told apart by their header:
+#  - "trade" files (detailed trade matrix), whose rows give a reporter, a partner, an item, an element
+#    ("Export Quantity", "Import Quantity", ...), a year and a value;
+#  - "production" files, whose rows give an area, an item, an element ("Production", ...), a year and a value.
+class BulkCSVReader:
+
+    # Attributes
+
+    ## Columns read from trade files, along with the names they are given in the chunks.
+    trade_columns = (("Reporter Country Code", "reporter_code"), ("Reporter Countries", "reporter"),
+                     ("Partner Country Code", "partner_code"), ("Partner Countries", "partner"),
+                     ("Item", "item"), ("Element", "element"), ("Year", "year"), ("Value", "value"))
+    ## Columns read from production files, along with the names they are given in the chunks.
+    production_columns = (("Area Code", "area_code"), ("Area", "area"),
+                          ("Item", "item"), ("Element", "element"), ("Year", "year"), ("Value", "value"))
+    ## Path to the zip archive or CSV file.
+    file_name = None
+    ## Number of rows per chunk.
+    chunk_size = None
+    ## Encoding of the text fields, or None to try UTF-8 and fall back to Latin-1 (used by older bulk files).
+    encoding = None
+
+    ## The constructor.
+    # @param file_name Path to a zip archive holding CSV files, or to a CSV file.
+    # @param chunk_size Number of rows per chunk.
+    # @param encoding Encoding of the text fields, or None to detect it.
+    def __init__(self, file_name, chunk_size = 20000, encoding = None):
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        self.encoding = encoding
+
+    ## Iterates over the chunks of rows of the file.
+    # Each chunk is a (file_type, columns) tuple, where file_type is either "trade" or "production" and columns
+    # a dictionary of Numpy arrays, one per column (see trade_columns and production_columns):
+    # codes and years are integers (-1 where missing), values are floats (NaN where missing)
+    # and the other columns are Unicode objects.
+    # Empty lines are skipped, and a ValueError is raised on rows whose number of fields differs from the header's.
+    def iter_chunks(self):
+        for csv_name, csv_file in self._iter_csv_files():
+            try:
+                reader = csv.reader(self._iter_lines(csv_file))
+                header = next(reader, None)
+                if header is None:
+                    continue
+                file_type, indices = self._parse_header(header)
+                rows_to_read = self._iter_rows(reader, len(header), csv_name)
+                while True:
+                    rows = list(itertools.islice(rows_to_read, self.chunk_size))
+                    if not rows:
+                        break
+                    yield file_type, self._get_columns(rows, indices, file_type)
+            finally:
+                csv_file.close()
+
+    ## Iterates over the CSV files to read, as (name, file object) tuples, the file objects decompressing the data
+    # as it is read. Members of zip archives are named after the archive, e.g. "archive.zip:member.csv".
+    def _iter_csv_files(self):
+        if not zipfile.is_zipfile(self.file_name):
+            yield self.file_name, open(self.file_name, 'rb')
+            return
+        with zipfile.ZipFile(self.file_name) as archive:
+            for name in archive.namelist():
+                if name.lower().endswith(".csv"):
+                    yield "{}:{}".format(self.file_name, name), archive.open(name)
+
+    ## Iterates over the rows of a CSV file following its header, skipping empty lines.
+    # @param reader The CSV reader.
+    # @param num_fields The number of fields of the header.
+    # @param csv_name The name of the CSV file, for error messages.
+    @staticmethod
+    def _iter_rows(reader, num_fields, csv_name):
+        for row in reader:
+            if not row:
+                continue
+            if len(row) != num_fields:
+                raise ValueError("{}, line {}: {} fields instead of the {} of the header".format(
+                    csv_name, reader.line_num, len(row), num_fields))
+            yield row
+
+    ## Iterates over the lines of a file, read by blocks (reading the members of zip archives line by line is slow).
+    # @param csv_file A file object.
+    @staticmethod
+    def _iter_lines(csv_file):
+        pending = b""
+        for block in iter(lambda: csv_file.read(1 << 20), b""):
+            lines = (pending + block).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line + b"\n"
+        if pending:
+            yield pending
+
+    ## Finds the columns to read in the header of a file.
+    # @param header The list of column names.
+    # @return A (file_type, indices) tuple, where indices maps the chunk column names to their index in the rows.
+    def _parse_header(self, header):
+        # Drop the byte order mark of UTF-8 files, along with the quotes it keeps the CSV reader from removing
+        header = [name.decode('utf-8-sig' if i == 0 else 'utf-8', 'replace').strip().strip('"') for i, name in enumerate(header)]
+        if "Partner Countries" in header:
+            file_type, columns = "trade", self.trade_columns
+        elif "Area" in header:
+            file_type, columns = "production", self.production_columns
+        else:
+            raise ValueError("{} is not a FAOStat bulk CSV file (unknown columns: {})".format(self.file_name, ", ".join(header)))
+
+        indices = dict()
+        for column, name in columns:
+            if column in header:
+                indices[name] = header.index(column)
+            elif not name.endswith("_code"):
+                raise ValueError("{}: missing column {}".format(self.file_name, column))
+        return file_type, indices
+
+    ## Turns a chunk of rows into column arrays.
+    # @param rows A list of rows, as lists of byte strings.
+    # @param indices The index of each column in the rows (see _parse_header()).
+    # @param file_type Either "trade" or "production".
+    def _get_columns(self, rows, indices, file_type):
+        columns = dict()
+        fields = zip(*rows)
+        for column, name in self.trade_columns if file_type == "trade" else self.production_columns:
+            if name not in indices:
+                columns[name] = np.full(len(rows), -1, dtype = np.int)
+                continue
+            values = np.array(fields[indices[name]])
+            if name == "value" or name == "year" or name.endswith("_code"):
+                present = values != ""
+                if name == "value":
+                    columns[name] = np.full(len(rows), np.nan)
+                    columns[name][present] = values[present].astype(np.float)
+                else:
+                    columns[name] = np.full(len(rows), -1, dtype = np.int)
+                    columns[name][present] = values[present].astype(np.int)
+            else:
+                # Each distinct text is only decoded once
+                unique_values, inverse = np.unique(values, return_inverse = True)
+                decoded = np.array([self._decode(value) for value in unique_values] or [u""], dtype = unicode)
+                columns[name] = decoded[inverse]
+        return columns
+
+    ## Decodes a text field.
+    # @param value A byte string.
+    def _decode(self, value):
+        if self.encoding is not None:
+            return value.decode(self.encoding)
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return value.decode('latin-1')
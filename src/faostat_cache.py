@@ -0,0 +1,169 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_cache.py
+#
+# This file contains an on-disk cache of the country-level records parsed from faostat XML files
+# and from the chunks of bulk CSV files.
+
+# Numpy is used to store the records in binary form.
+import numpy as np
+# Modules needed to handle files and paths.
+import os, os.path
+# Module needed to read and write the manifests.
+import json
+# Module needed to compute the content hash of the XML files.
+import hashlib
+# Module needed to write the cache entries atomically.
+import tempfile
+
+## This class stores the records returned by FAOStatTradeData._read_trade_records() and
+# FAOStatTradeData._read_production_records() in a directory, so that unchanged XML files
+# do not have to be parsed again.
+# Each XML file has two entries in the directory, named after a hash of its absolute path
+# (and, for the records holding the import tables, an "-imports" suffix):
+# a JSON manifest holding the fingerprint of the file (size, modification time and SHA-1 hash
+# of its contents) and a Numpy .npz archive holding the records.
+# An entry is valid if the fingerprint matches: the contents of the file are only hashed again
+# when its size or modification time have changed.
+class ParsedFileCache:
+
+    # Attributes
+
+    ## Version of the cache format, to be increased whenever the layout of the records changes.
+    version = 3
+    ## Path to the cache directory.
+    cache_dir = None
+
+    ## The constructor creates the cache directory if needed.
+    # @param cache_dir Path to the cache directory.
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            pass
+
+    ## Returns the records cached for a given XML file.
+    # @param file_name Path to the XML file.
+    # @param with_imports Boolean indicating whether the records hold the import tables (see FAOStatTradeData.with_imports).
+    # @return A (file_type, records) tuple, or None if there is no valid entry for the file.
+    def load(self, file_name, with_imports = False):
+        manifest_path, records_path = self._get_entry_paths(file_name, with_imports)
+        try:
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if manifest.get("version") != self.version:
+            return None
+
+        stat = os.stat(file_name)
+        if manifest["size"] != stat.st_size:
+            return None
+        if manifest["mtime"] != stat.st_mtime:
+            # The file has been touched: only its contents tell whether it has changed.
+            if manifest["sha1"] != self.get_content_hash(file_name):
+                return None
+            manifest["mtime"] = stat.st_mtime
+            self._write_atomically(manifest_path, lambda f: json.dump(manifest, f))
+
+        try:
+            with np.load(records_path) as data:
+                records = dict((key, data[key]) for key in data.files)
+        except IOError:
+            return None
+
+        return manifest["file_type"], records
+
+    ## Stores the records parsed from a given XML file.
+    # @param file_name Path to the XML file.
+    # @param file_type Either "trade" or "production".
+    # @param records A dictionary of Numpy arrays.
+    # @param with_imports Boolean indicating whether the records hold the import tables (see FAOStatTradeData.with_imports).
+    def store(self, file_name, file_type, records, with_imports = False):
+        manifest_path, records_path = self._get_entry_paths(file_name, with_imports)
+        stat = os.stat(file_name)
+        manifest = {
+            "version": self.version,
+            "file_name": os.path.abspath(file_name),
+            "file_type": file_type,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "sha1": self.get_content_hash(file_name),
+        }
+
+        # The records are written first, so that a valid manifest never points to missing records.
+        self._write_atomically(records_path, lambda f: np.savez(f, **records))
+        self._write_atomically(manifest_path, lambda f: json.dump(manifest, f))
+
+    ## Stores the records of a chunk of a bulk CSV file (see FAOStatTradeData.load_bulk_data()), so that they do not
+    # have to be held in memory. Unlike the records of XML files, they are not checked against the file when read
+    # back: they are only meant to be read by the process which loaded the file.
+    # @param file_name Path to the bulk CSV file.
+    # @param number A number telling the chunk apart from the other chunks stored for the file.
+    # @param records A dictionary of Numpy arrays.
+    def store_chunk(self, file_name, number, records):
+        self._write_atomically(self._get_chunk_path(file_name, number), lambda f: np.savez(f, **records))
+
+    ## Returns the records of a chunk of a bulk CSV file stored by store_chunk().
+    # @param file_name Path to the bulk CSV file.
+    # @param number The number the chunk was stored with.
+    # @return A dictionary of Numpy arrays.
+    def load_chunk(self, file_name, number):
+        with np.load(self._get_chunk_path(file_name, number)) as data:
+            return dict((key, data[key]) for key in data.files)
+
+    ## Returns the SHA-1 hash of the contents of a file, as a hexadecimal string.
+    # @param file_name Path to the file.
+    @staticmethod
+    def get_content_hash(file_name):
+        sha1 = hashlib.sha1()
+        with open(file_name, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    ## Returns the paths of the manifest and of the records of the entry of a given XML file.
+    # @param file_name Path to the XML file.
+    # @param with_imports Boolean indicating whether the records hold the import tables.
+    def _get_entry_paths(self, file_name, with_imports = False):
+        key = hashlib.sha1(os.path.abspath(file_name).encode('utf-8')).hexdigest()
+        base_name = os.path.join(self.cache_dir, key + ("-imports" if with_imports else ""))
+        return base_name + ".json", base_name + ".npz"
+
+    ## Returns the path of the records of a chunk of a bulk CSV file.
+    # @param file_name Path to the bulk CSV file.
+    # @param number The number the chunk was stored with.
+    def _get_chunk_path(self, file_name, number):
+        key = hashlib.sha1(os.path.abspath(file_name).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, "{}-chunk{}.npz".format(key, number))
+
+    ## Writes a file through a temporary file, so that concurrent readers never see a partial file.
+    # @param path Path to the target file.
+    # @param write A function writing the contents to the file object given as argument.
+    def _write_atomically(self, path, write):
+        handle, temp_path = tempfile.mkstemp(dir = self.cache_dir, suffix = ".tmp")
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                write(f)
+            os.rename(temp_path, path)
+        except:
+            os.remove(temp_path)
+            raise
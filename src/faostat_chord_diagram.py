@@ -0,0 +1,347 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_chord_diagram.py
+#
+# This file contains a renderer drawing the circular diagrams directly from the trade matrices,
+# as a fast alternative to the Circos toolchain (see run/generate_diagrams.bash).
+
+# Numpy provides handy matrix support.
+import numpy as np
+# Modules needed to handle files and paths.
+import os, os.path
+# Module needed to compute the colors of the regions.
+import colorsys
+# Module needed to escape the region names.
+from xml.sax.saxutils import escape
+# Module needed to write the diagrams from several threads.
+from multiprocessing.pool import ThreadPool
+
+## This class draws the trade matrices loaded by a FAOStatTradeData object as SVG chord diagrams.
+# The layout follows the tableviewer and Circos settings found in run/etc/ and in generate_diagrams.bash:
+#  - one segment per region written in the tableviewer file, in the order of the region numbers: parse-table.conf
+#    sets row_order_col = yes and use_row_order_col = yes, so that the first column of the tableviewer files
+#    (the region numbers) orders the segments, segment_order only breaking ties (see segment_order);
+#  - the size of a segment is the sum of its exports and imports, or its size from the tableviewer file
+#    (imports + production) if that is larger and production quantities are shown;
+#  - each ribbon starts at the exporter and ends at the importer, where it stops at a cap of the exporter color;
+#    ribbons leaving a segment are placed before the ribbons entering it, by ascending size, and
+#    ribbons are drawn by ascending size; trade within a region is hidden;
+#  - segment colors are interpolated in HSV space over the names in ASCII order, and ribbons take the color
+#    of their exporter, with a uniform transparency and no stroke: parse-table.conf sets color_remap = no,
+#    so that its <percentile> blocks are not applied, and the transparency is the one passed by
+#    generate_diagrams.py (-transparency 2 -fade_transparency 0).
+# Region names are decoded, so that the diagrams do not need to go through svg_name_fix.py.
+# Ticks are not drawn.
+class ChordDiagram:
+
+    # Attributes
+
+    ## The FAOStatTradeData object holding the trade matrices.
+    data_structure = None
+
+    ## Radius of the image, in pixels.
+    image_radius = 1000
+    ## Inner radius of the segments, in pixels.
+    segment_radius = 600
+    ## Thickness of the segments, in pixels.
+    segment_thickness = 35
+    ## Space between consecutive segments, as a fraction of the total size of the segments.
+    segment_spacing = 0.0075
+    ## Radius of the region labels, in pixels.
+    label_radius = 642
+    ## Font size of the region labels, in pixels.
+    label_size = 18
+    ## Inner and outer radii of the caps drawn where the ribbons enter the importers, in pixels.
+    cap_radii = (580, 590)
+    ## Radius where the ribbons leave the exporters, in pixels.
+    ribbon_exporter_radius = 600
+    ## Radius where the ribbons enter the importers, in pixels.
+    ribbon_importer_radius = 579
+
+    ## Hue, saturation and value of the first and last segment colors.
+    segment_colors = ((0.0, 0.8, 0.9), (300.0, 0.8, 0.9))
+    ## Order of the segments, as a list of criteria among "native" (region numbers), "ascii" (names), "size_asc"
+    # and "size_desc", the first one taking precedence. Circos orders the segments by the order column of the
+    # tableviewer files, i.e. by region number, the segment_order setting ("ascii,size_desc" on the command line of
+    # generate_diagrams.py) only applying to rows without an order.
+    segment_order = ("native",)
+    ## Transparency level of the ribbons (see transparency_levels).
+    ribbon_transparency = 2
+    ## Boolean indicating whether the ribbon styles depend on the percentile of their quantity (see ribbon_styles),
+    # as with color_remap = yes in the <linkcolor> block of parse-table.conf.
+    color_remap = False
+    ## Ribbon styles by percentile of the ribbon quantity, used when color_remap is True: (percentile, color
+    # (None for the exporter color), transparency level, stroke thickness (None for no stroke)).
+    ribbon_styles = ((50, "rgb(170,170,170)", 5, None),
+                     (60, None, 5, None),
+                     (70, None, 4, None),
+                     (80, None, 3, None),
+                     (90, None, 2, 1),
+                     (100, None, 1, 3))
+    ## Number of transparency levels: a level n gives an opacity of 1 - n / (levels + 1).
+    transparency_levels = 5
+
+    ## The constructor.
+    # @param data_structure A FAOStatTradeData object with the trade matrices and productions loaded.
+    def __init__(self, data_structure):
+        self.data_structure = data_structure
+
+    ## Draws the trade matrix of a year/commodity combination.
+    # @param year The year, as an integer.
+    # @param commodity The commodity, as a string.
+    # @param with_production Boolean indicating whether the segment sizes take the production quantities into account.
+    # @param threshold A quantity lower bound which filters out regions whose total imports + production is below the value
+    # @return The SVG document, as a UTF-8 encoded string.
+    def render(self, year, commodity, with_production = True, threshold = 0):
+        data_structure = self.data_structure
+        sizes, regions = data_structure._get_region_sizes(year, commodity, threshold)
+        matrix = data_structure._get_trade_matrix(year, commodity)[np.ix_(regions, regions)].astype(np.float64)
+        np.fill_diagonal(matrix, 0)
+        names = [data_structure.name_decode(data_structure.region_numbers_reverse[i]) for i in regions]
+
+        exports = matrix.sum(axis = 1)
+        imports = matrix.sum(axis = 0)
+        lengths = exports + imports
+        if with_production:
+            lengths = np.maximum(lengths, sizes[regions])
+
+        order = self._get_segment_order(names, lengths)
+        matrix = matrix[np.ix_(order, order)]
+        names = [names[i] for i in order]
+        exports, imports, lengths = exports[order], imports[order], lengths[order]
+
+        # Angles are measured clockwise from the top of the image
+        num_segments = len(regions)
+        total = lengths.sum()
+        if total == 0:
+            return self._format_document([], [])
+        gap = self.segment_spacing * total
+        scale = 2 * np.pi / (total + num_segments * gap)
+        segment_starts = (np.cumsum(lengths + gap) - lengths - gap) * scale
+
+        # Ribbons leaving a segment come first, ordered by ascending size, followed by the entering ribbons.
+        export_offsets = self._get_bundle_offsets(matrix)
+        import_offsets = self._get_bundle_offsets(matrix.T).T + exports[np.newaxis, :]
+
+        exporters, importers = np.nonzero(matrix > 0)
+        quantities = matrix[exporters, importers]
+        layer_order = np.argsort(quantities, kind = "mergesort")
+        exporters, importers, quantities = exporters[layer_order], importers[layer_order], quantities[layer_order]
+
+        source_starts = segment_starts[exporters] + export_offsets[exporters, importers] * scale
+        target_starts = segment_starts[importers] + import_offsets[exporters, importers] * scale
+        widths = quantities * scale
+        styles = self._get_ribbon_styles(quantities)
+
+        colors = self._get_segment_colors(names)
+        segments = zip(segment_starts.tolist(), (lengths * scale).tolist(), colors, names)
+        ribbons = zip(source_starts.tolist(), target_starts.tolist(), widths.tolist(),
+                      [colors[i] for i in exporters], styles)
+        return self._format_document(segments, ribbons)
+
+    ## Draws the trade matrices of any number of year/commodity combinations, both with and without
+    # production quantities, and saves them as SVG files.
+    # @param output_dir Path to the folder where to save the files.
+    # @param years A list of years, or None for all the years loaded.
+    # @param commodities A list of commodities, or None for all the commodities loaded.
+    # @param threshold A quantity lower bound which filters out regions whose total imports + production is below the value
+    # @param threads The number of threads drawing the diagrams, or None to draw them from the calling thread.
+    # @param file_name_format Path of the files relative to output_dir, where {commodity}, {year} and {suffix}
+    # (empty or "_without_productions") are replaced. Missing folders are created.
+    # @return The list of saved files.
+    def save_diagrams(self, output_dir, years = None, commodities = None, threshold = 0, threads = None,
+            file_name_format = os.path.join("{commodity}", "{commodity}_{year}{suffix}.svg")):
+        trade_matrices = self.data_structure.trade_matrices
+        if years is None:
+            years = sorted(trade_matrices.years)
+        if commodities is None:
+            commodities = trade_matrices.commodities
+
+        jobs = [(year, commodity, with_production, suffix) for year in years for commodity in commodities
+                for with_production, suffix in ((True, ""), (False, "_without_productions"))]
+        save = lambda job: self._save_diagram(output_dir, job[0], job[1], job[2], job[3], threshold, file_name_format)
+        if threads is None:
+            return map(save, jobs)
+
+        pool = ThreadPool(threads)
+        try:
+            return pool.map(save, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    ## Draws the trade matrix of a year/commodity combination and saves it as an SVG file.
+    # @param output_dir Path to the folder where to save the file.
+    # @param year The year, as an integer.
+    # @param commodity The commodity, as a string.
+    # @param with_production Boolean indicating whether the segment sizes take the production quantities into account.
+    # @param suffix The suffix of the file name.
+    # @param threshold A quantity lower bound which filters out regions whose total imports + production is below the value
+    # @param file_name_format Path of the file relative to output_dir (see save_diagrams()).
+    # @return The path of the file.
+    def _save_diagram(self, output_dir, year, commodity, with_production, suffix, threshold, file_name_format):
+        file_name = os.path.join(output_dir, file_name_format.format(commodity = commodity, year = year, suffix = suffix))
+        metrics = self.data_structure.metrics
+        with metrics.stage("render", file_name) as stage:
+            try:
+                os.makedirs(os.path.dirname(file_name))
+            except OSError:
+                pass
+
+            document = self.render(year, commodity, with_production, threshold)
+            with open(file_name, 'w') as file_handle:
+                file_handle.write(document)
+            stage["elements"] = len(document)
+        metrics.log("Diagram for commodity {} and year {} saved to {}".format(commodity, year, file_name))
+        return file_name
+
+    ## Computes the offset of each ribbon end within its segment, ribbons being placed by ascending size.
+    # @param matrix A square matrix whose rows hold the ribbons of each segment.
+    # @return A matrix of the same shape holding the offset of each ribbon end from the start of the segment.
+    @staticmethod
+    def _get_bundle_offsets(matrix):
+        order = np.argsort(matrix, axis = 1, kind = "mergesort")
+        sorted_values = np.take_along_axis(matrix, order, axis = 1)
+        offsets = np.empty_like(matrix)
+        np.put_along_axis(offsets, order, np.cumsum(sorted_values, axis = 1) - sorted_values, axis = 1)
+        return offsets
+
+    ## Computes the order of the segments (see segment_order).
+    # @param names The names of the segments, in the order of their region numbers.
+    # @param lengths The sizes of the segments.
+    # @return A Numpy array holding the indices of the segments, in drawing order.
+    def _get_segment_order(self, names, lengths):
+        ranks = dict((name, rank) for rank, name in enumerate(sorted(names)))
+        keys = {
+            "native": np.arange(len(names)),
+            "ascii": np.array([ranks[name] for name in names], dtype = np.int),
+            "size_asc": lengths,
+            "size_desc": -lengths,
+        }
+        for criterion in self.segment_order:
+            if criterion not in keys:
+                raise ValueError("Unknown segment order: {}".format(criterion))
+        # numpy.lexsort sorts by the last key first, ties being kept in region number order
+        return np.lexsort([keys["native"]] + [keys[criterion] for criterion in reversed(self.segment_order)])
+
+    ## Computes the style of each ribbon: the exporter color with a uniform transparency, or, if color_remap is True,
+    # a style depending on the percentile of its quantity among the distinct quantities.
+    # @param quantities A 1D Numpy array of ribbon quantities.
+    # @return A list of (color, opacity, stroke thickness) tuples, color being None for the exporter color.
+    def _get_ribbon_styles(self, quantities):
+        if not self.color_remap:
+            return [(None, 1.0 - float(self.ribbon_transparency) / (self.transparency_levels + 1), None)] * len(quantities)
+        unique_quantities = np.unique(quantities)
+        percentiles = 100.0 * (np.searchsorted(unique_quantities, quantities) + 1) / max(len(unique_quantities), 1)
+        limits = np.array([style[0] for style in self.ribbon_styles])
+        levels = np.minimum(np.searchsorted(limits, percentiles), len(limits) - 1)
+
+        styles = [(color, 1.0 - float(transparency) / (self.transparency_levels + 1), stroke)
+                  for limit, color, transparency, stroke in self.ribbon_styles]
+        return [styles[level] for level in levels]
+
+    ## Computes the color of each segment, colors being interpolated over the names in ASCII order.
+    # @param names The names of the segments.
+    # @return A list of "rgb(r,g,b)" strings.
+    def _get_segment_colors(self, names):
+        (h0, s0, v0), (h1, s1, v1) = self.segment_colors
+        ranks = dict((name, rank) for rank, name in enumerate(sorted(names)))
+        colors = []
+        for name in names:
+            t = float(ranks[name]) / max(len(names) - 1, 1)
+            r, g, b = colorsys.hsv_to_rgb((h0 + t * (h1 - h0)) / 360.0, s0 + t * (s1 - s0), v0 + t * (v1 - v0))
+            colors.append("rgb({},{},{})".format(int(round(255 * r)), int(round(255 * g)), int(round(255 * b))))
+        return colors
+
+    ## Returns the coordinates of a point of the image.
+    # @param angle The angle, clockwise from the top of the image.
+    # @param radius The distance to the center of the image.
+    def _get_point(self, angle, radius):
+        return "{:.2f},{:.2f}".format(self.image_radius + radius * np.sin(angle), self.image_radius - radius * np.cos(angle))
+
+    ## Returns the SVG path of an annular sector.
+    # @param start The start angle.
+    # @param width The angular width.
+    # @param inner_radius The inner radius.
+    # @param outer_radius The outer radius.
+    def _get_sector_path(self, start, width, inner_radius, outer_radius):
+        large_arc = 1 if width > np.pi else 0
+        return "M{} A{r1},{r1} 0 {large},1 {} L{} A{r0},{r0} 0 {large},0 {} Z".format(
+            self._get_point(start, outer_radius), self._get_point(start + width, outer_radius),
+            self._get_point(start + width, inner_radius), self._get_point(start, inner_radius),
+            r0 = inner_radius, r1 = outer_radius, large = large_arc)
+
+    ## Returns the SVG path of a ribbon linking two arcs through the center of the image.
+    # @param source_start The start angle of the arc at the exporter.
+    # @param target_start The start angle of the arc at the importer.
+    # @param width The angular width of both arcs.
+    def _get_ribbon_path(self, source_start, target_start, width):
+        r0, r1 = self.ribbon_exporter_radius, self.ribbon_importer_radius
+        center = self._get_point(0, 0)
+        return "M{} A{r0},{r0} 0 0,1 {} Q{c} {} A{r1},{r1} 0 0,1 {} Q{c} {} Z".format(
+            self._get_point(source_start, r0), self._get_point(source_start + width, r0),
+            self._get_point(target_start, r1), self._get_point(target_start + width, r1),
+            self._get_point(source_start, r0), r0 = r0, r1 = r1, c = center)
+
+    ## Assembles the SVG document.
+    # @param segments A list of (start, width, color, name) tuples.
+    # @param ribbons A list of (source_start, target_start, width, exporter_color, style) tuples, in drawing order.
+    # @return The SVG document, as a UTF-8 encoded string.
+    def _format_document(self, segments, ribbons):
+        size = 2 * self.image_radius
+        lines = [u'<?xml version="1.0" encoding="utf-8"?>',
+                 u'<svg xmlns="http://www.w3.org/2000/svg" width="{0}px" height="{0}px" viewBox="0 0 {0} {0}">'.format(size),
+                 u'<rect x="0" y="0" width="{0}" height="{0}" style="fill:white"/>'.format(size),
+                 u'<g id="ribbons" style="stroke:black">']
+
+        for source_start, target_start, width, exporter_color, (color, opacity, stroke) in ribbons:
+            lines.append(u'<path d="{}" style="fill:{};fill-opacity:{:.3f};stroke-width:{}"/>'.format(
+                self._get_ribbon_path(source_start, target_start, width), color or exporter_color, opacity, stroke or 0))
+        lines.append(u'</g>')
+
+        lines.append(u'<g id="caps" style="stroke:black;stroke-width:1">')
+        for source_start, target_start, width, exporter_color, style in ribbons:
+            lines.append(u'<path d="{}" style="fill:{}"/>'.format(
+                self._get_sector_path(target_start, width, self.cap_radii[0], self.cap_radii[1]), exporter_color))
+        lines.append(u'</g>')
+
+        lines.append(u'<g id="segments" style="stroke:black;stroke-width:1">')
+        for start, width, color, name in segments:
+            lines.append(u'<path d="{}" style="fill:{}"/>'.format(
+                self._get_sector_path(start, width, self.segment_radius, self.segment_radius + self.segment_thickness), color))
+        lines.append(u'</g>')
+
+        lines.append(u'<g id="labels" style="font-family:sans-serif;font-size:{}px;fill:rgb(85,85,85)">'.format(self.label_size))
+        for start, width, color, name in segments:
+            # Labels are written outwards, and flipped on the left half of the image to remain readable.
+            angle = np.degrees(start + width / 2)
+            x, y = self._get_point(np.radians(angle), self.label_radius).split(",")
+            if angle <= 180:
+                rotation, anchor = angle - 90, "start"
+            else:
+                rotation, anchor = angle + 90, "end"
+            lines.append(u'<text x="{}" y="{}" transform="rotate({:.2f} {} {})" style="text-anchor:{};dominant-baseline:middle">{}</text>'
+                .format(x, y, rotation, x, y, anchor, escape(name)))
+        lines.append(u'</g>')
+
+        lines.append(u'</svg>\n')
+        return u"\n".join(lines).encode('utf-8')
+
+if __name__ == "__main__":
+    pass
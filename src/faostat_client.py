@@ -0,0 +1,180 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_client.py
+#
+# This file contains the client of the trade data server (see faostat_server.py), along with the message format
+# shared by both.
+#
+# Each message (request or response) is made of:
+#  - two 32-bit unsigned integers in network byte order: the length of the header and the length of the payload;
+#  - the header, a UTF-8 encoded JSON object;
+#  - the payload, raw bytes.
+# Requests have a "command" header entry and no payload. Responses have a "status" header entry ("ok" or "error",
+# along with a "message"), and a "type" entry telling what the payload holds: "array" (the raw data of a Numpy array,
+# whose "dtype" and "shape" are given by the header), "text" (a UTF-8 encoded string) or "json" (the result is
+# held by the "result" header entry and the payload is empty).
+
+# Numpy is used to rebuild the arrays sent by the server.
+import numpy as np
+# Modules needed to talk to the server.
+import socket, struct
+import json
+import argparse, sys
+
+## Format of the lengths starting each message.
+length_format = "!II"
+
+## Writes a message.
+# @param file_handle A file object wrapping the socket.
+# @param header A dictionary which can be saved as JSON.
+# @param payload The payload, as a byte string.
+def write_message(file_handle, header, payload = b""):
+    header = json.dumps(header).encode('utf-8')
+    file_handle.write(struct.pack(length_format, len(header), len(payload)) + header)
+    file_handle.write(payload)
+    file_handle.flush()
+
+## Reads a message.
+# @param file_handle A file object wrapping the socket.
+# @return A (header, payload) tuple, or None if the connection was closed before the message.
+def read_message(file_handle):
+    lengths = file_handle.read(struct.calcsize(length_format))
+    if not lengths:
+        return None
+    if len(lengths) < struct.calcsize(length_format):
+        raise EOFError("Connection closed in the middle of a message")
+    header_length, payload_length = struct.unpack(length_format, lengths)
+    header = file_handle.read(header_length)
+    payload = file_handle.read(payload_length)
+    if len(header) < header_length or len(payload) < payload_length:
+        raise EOFError("Connection closed in the middle of a message")
+    return json.loads(header.decode('utf-8')), payload
+
+## Error reported by the server (e.g. a year/commodity combination which has not been loaded).
+class ServerError(Exception):
+    pass
+
+## This class sends requests to a trade data server over its Unix-domain socket.
+# A connection serves any number of requests, one at a time: threads should use a client each.
+# Arrays are returned read-only, as views onto the received bytes.
+# Years are integers and regions are given by name, as in the region list of the server (see get_regions()).
+class FAOStatClient:
+
+    # Attributes
+
+    ## Path to the socket of the server.
+    socket_path = None
+
+    ## The constructor connects to the server.
+    # @param socket_path Path to the socket of the server.
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_path)
+        self._file = self._socket.makefile('rwb')
+
+    ## Closes the connection.
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    ## Sends a request and returns the result.
+    # @param command The name of the command (see FAOStatRequestHandler.commands in faostat_server.py).
+    # @param arguments The arguments of the command.
+    # @return A Numpy array, a Unicode string or the JSON result, depending on the command.
+    def request(self, command, **arguments):
+        write_message(self._file, dict(arguments, command = command))
+        response = read_message(self._file)
+        if response is None:
+            raise EOFError("Connection closed by the server")
+        header, payload = response
+        if header["status"] != "ok":
+            raise ServerError(header.get("message"))
+        if header["type"] == "array":
+            return np.frombuffer(payload, dtype = np.dtype(str(header["dtype"]))).reshape(header["shape"])
+        if header["type"] == "text":
+            return payload.decode('utf-8')
+        return header["result"]
+
+    ## Returns the regions, in the order of their numbers.
+    def get_regions(self):
+        return self.request("regions")
+
+    ## Returns the (year, commodity) combinations of the trade matrices.
+    def get_keys(self):
+        return [tuple(key) for key in self.request("keys")]
+
+    ## Returns the trade matrix of a year/commodity combination, indexed by [exporter, importer] region numbers.
+    # @param year The year, as an integer.
+    # @param commodity The commodity.
+    def get_matrix(self, year, commodity):
+        return self.request("matrix", year = year, commodity = commodity)
+
+    ## Returns the production quantities of a year/commodity combination, indexed by region number.
+    # @param year The year, as an integer.
+    # @param commodity The commodity.
+    def get_production(self, year, commodity):
+        return self.request("production", year = year, commodity = commodity)
+
+    ## Returns a sub-array of the trade matrices (see TradeTensor.get_slice()).
+    # @param commodities A list of commodities, or None for all of them.
+    # @param years A list of years, or None for all of them in chronological order.
+    # @param exporters A list of exporting region names, or None for all of them.
+    # @param importers A list of importing region names, or None for all of them.
+    # @return A 4D Numpy array indexed by [commodity, year, exporter, importer].
+    def get_slice(self, commodities = None, years = None, exporters = None, importers = None):
+        return self.request("slice", commodities = commodities, years = years, exporters = exporters, importers = importers)
+
+    ## Returns the trade matrix of a year/commodity combination in the Circos tableviewer format
+    # (see FAOStatTradeData.save_trade_matrix()).
+    # @param year The year, as an integer.
+    # @param commodity The commodity.
+    # @param with_production Boolean indicating whether to write the size of each region.
+    # @param threshold A quantity lower bound which filters out regions whose total imports + production is below the value
+    def get_tableviewer(self, year, commodity, with_production = False, threshold = 0):
+        return self.request("tableviewer", year = year, commodity = commodity, with_production = with_production,
+                            threshold = threshold)
+
+    ## Makes the server read the data files which have changed since they were loaded.
+    # @return The list of files read again.
+    def reload(self):
+        return self.request("reload")
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Fetches a trade matrix in the Circos tableviewer format from a trade data server.")
+    parser.add_argument("socket", help = "socket of the server")
+    parser.add_argument("year", type = int, help = "year of the trade matrix")
+    parser.add_argument("commodity", help = "commodity of the trade matrix")
+    parser.add_argument("--with-production", action = "store_true", help = "write the size of each region")
+    parser.add_argument("--threshold", type = int, default = 0, help = "quantity below which regions are not written")
+    args = parser.parse_args()
+
+    with FAOStatClient(args.socket) as client:
+        try:
+            contents = client.get_tableviewer(args.year, args.commodity, args.with_production, args.threshold)
+        except ServerError as error:
+            sys.exit("ERROR: {}".format(error))
+    sys.stdout.write(contents.encode('utf-8'))
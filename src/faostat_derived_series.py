@@ -0,0 +1,209 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_derived_series.py
+#
+# This file contains the computation of series derived from the trade matrices (year-over-year deltas,
+# moving averages and supply shares), along with their export as Circos tableviewer files.
+
+# Numpy provides handy matrix support.
+import numpy as np
+# Modules needed to handle files and paths.
+import os, os.path
+
+## This class derives series from the trade matrices loaded by a FAOStatTradeData object, for all commodities
+# and years at once:
+#  - deltas: the change of each flow from one year to the next (see get_deltas());
+#  - moving averages: the mean of each flow over a window of consecutive years (see get_moving_averages());
+#  - supply shares: the share of the supply of each importer coming from each exporter (see get_supply_shares()).
+# Each series is a Numpy array indexed by [commodity, year, exporter, importer], years being in chronological order.
+# Consecutive years are the consecutive years loaded, whatever the gap between them.
+#
+# Results are cached (as read-only arrays) until the trade matrices or production quantities change: the cache is
+# cleared by FAOStatTradeData when files are loaded, and whenever its trade matrices or productions are replaced.
+class DerivedSeries:
+
+    # Attributes
+
+    ## Kinds of series which can be saved as tableviewer files (see save()).
+    kinds = ("delta", "average", "share")
+    ## The FAOStatTradeData object holding the trade matrices.
+    data_structure = None
+    ## Dictionary holding the computed series, indexed by (name, parameters...) tuples.
+    cache = None
+    ## The (trade_matrices, productions) tuple of the data structure the cached series were computed from.
+    _sources = None
+
+    ## The constructor.
+    # @param data_structure A FAOStatTradeData object.
+    def __init__(self, data_structure):
+        self.data_structure = data_structure
+        self.cache = dict()
+
+    ## Drops all the cached series.
+    def clear(self):
+        self.cache = dict()
+
+    ## Returns a cached series, computing it if needed.
+    # @param key The key of the series in the cache.
+    # @param compute A function computing the series, as a (commodities, years, array, present) tuple.
+    def _get_cached(self, key, compute):
+        sources = (self.data_structure.trade_matrices, self.data_structure.productions)
+        if self._sources is None or any(a is not b for a, b in zip(sources, self._sources)):
+            self.clear()
+            self._sources = sources
+        if key not in self.cache:
+            with self.data_structure.metrics.stage("derive") as stage:
+                result = compute()
+                result[2].setflags(write = False)
+                result[3].setflags(write = False)
+                stage["elements"] = result[2].size
+            self.cache[key] = result
+        return self.cache[key]
+
+    ## Returns the trade matrices of all commodities and years as a single array.
+    # @return A (commodities, years, array, present) tuple, where years is in chronological order, array an integer
+    # Numpy array indexed by [commodity, year, exporter, importer] and present a boolean Numpy array indexed by
+    # [commodity, year] telling which combinations have been loaded (the others hold zeros).
+    def get_trade_array(self):
+        def compute():
+            matrices = self.data_structure.trade_matrices
+            commodities = list(matrices.commodities)
+            years = matrices.get_sorted_years()[0].tolist()
+            present = np.array([[(year, commodity) in matrices for year in years] for commodity in commodities],
+                dtype = bool).reshape(len(commodities), len(years))
+            return commodities, years, matrices.get_aligned_array(commodities, years), present
+        return self._get_cached(("trade",), compute)
+
+    ## Computes the change of every flow from one year to a later one.
+    # @param lag The number of years between the two quantities.
+    # @return A (commodities, years, deltas, present) tuple (see get_trade_array()), where years starts at the
+    # lag-th year, deltas[:, j] is the quantity of years[j] minus the one of the year lag years before,
+    # and present tells which combinations have data for both years.
+    def get_deltas(self, lag = 1):
+        if lag < 1:
+            raise ValueError("Invalid lag: {}".format(lag))
+        def compute():
+            commodities, years, array, present = self.get_trade_array()
+            return commodities, years[lag:], array[:, lag:] - array[:, :-lag], present[:, lag:] & present[:, :-lag]
+        return self._get_cached(("delta", lag), compute)
+
+    ## Computes the mean of every flow over a window of consecutive years.
+    # @param window The number of years.
+    # @return A (commodities, years, averages, present) tuple (see get_trade_array()), where years starts at the
+    # window-th year, averages[:, j] is a float array holding the mean of the quantities of years[j] and
+    # the window - 1 previous years, and present tells which combinations have data for every year of the window.
+    def get_moving_averages(self, window = 3):
+        if window < 1:
+            raise ValueError("Invalid window: {}".format(window))
+        def compute():
+            commodities, years, array, present = self.get_trade_array()
+            # The sums over the windows are differences of cumulative sums along the year axis
+            padding = [(0, 0), (1, 0)] + [(0, 0)] * (array.ndim - 2)
+            sums = np.pad(np.cumsum(array, axis = 1, dtype = np.float64), padding, "constant")
+            counts = np.pad(np.cumsum(present, axis = 1), [(0, 0), (1, 0)], "constant")
+            averages = (sums[:, window:] - sums[:, :-window]) / window
+            return commodities, years[window - 1:], averages, counts[:, window:] - counts[:, :-window] == window
+        return self._get_cached(("average", window), compute)
+
+    ## Computes the share of the supply of each importer coming from each exporter.
+    # @param with_production Boolean indicating whether the supply includes the production of the importer
+    # (the shares of the exporters then add up to the share of the imports), or is made of the imports only.
+    # @return A (commodities, years, shares, present) tuple (see get_trade_array()), where shares[c, y, e, i] is
+    # the fraction of the supply of importer i coming from exporter e, 0 where the supply is 0.
+    def get_supply_shares(self, with_production = False):
+        def compute():
+            commodities, years, array, present = self.get_trade_array()
+            supplies = array.sum(axis = 2).astype(np.float64)
+            if with_production:
+                supplies += self.data_structure.productions.get_aligned_array(commodities, years)
+            shares = array / np.where(supplies > 0, supplies, 1)[:, :, np.newaxis, :]
+            return commodities, years, shares, present
+        return self._get_cached(("share", with_production), compute)
+
+    ## Returns the matrices to save as tableviewer files for a kind of series.
+    # Deltas are split into increases and decreases, the tableviewer utility only drawing positive quantities.
+    # Shares are written as whole percentages.
+    # @param kind One of kinds.
+    # @param lag The lag of the deltas (see get_deltas()).
+    # @param window The window of the moving averages (see get_moving_averages()).
+    # @return A (commodities, years, present, parts) tuple, where parts is a list of (suffix, array) tuples
+    # holding integer Numpy arrays indexed by [commodity, year, exporter, importer].
+    def _get_tableviewer_arrays(self, kind, lag = 1, window = 3):
+        if kind == "delta":
+            commodities, years, deltas, present = self.get_deltas(lag)
+            parts = [("_increase", np.maximum(deltas, 0)), ("_decrease", np.maximum(-deltas, 0))]
+        elif kind == "average":
+            commodities, years, averages, present = self.get_moving_averages(window)
+            parts = [("_average{}".format(window), np.rint(averages).astype(np.int))]
+        elif kind == "share":
+            commodities, years, shares, present = self.get_supply_shares()
+            parts = [("_shares", np.rint(shares * 100).astype(np.int))]
+        else:
+            raise ValueError("Unknown kind of series: {} (expected one of {})".format(kind, ", ".join(self.kinds)))
+        return commodities, years, present, parts
+
+    ## Saves a kind of series as files readable by the Circos tableviewer utility, in the format of
+    # FAOStatTradeData.save_trade_matrix() (without production quantities).
+    # Regions whose exports + imports are not above the threshold are not written.
+    # @param output_dir Path to the folder where to save the files.
+    # @param kind One of kinds.
+    # @param years A list of years, or None for all the years of the series.
+    # @param commodities A list of commodities, or None for all the commodities loaded.
+    # @param threshold A quantity lower bound which filters out regions whose total exports + imports is below the value
+    # @param lag The lag of the deltas (see get_deltas()).
+    # @param window The window of the moving averages (see get_moving_averages()).
+    # @param file_name_format Path of the files relative to output_dir, where {commodity}, {year} and {suffix}
+    # (e.g. "_increase" or "_shares") are replaced. Missing folders are created.
+    # @return The list of saved files.
+    def save(self, output_dir, kind, years = None, commodities = None, threshold = 0, lag = 1, window = 3,
+            file_name_format = os.path.join("{commodity}", "{commodity}_{year}{suffix}.txt")):
+        data_structure = self.data_structure
+        series_commodities, series_years, present, parts = self._get_tableviewer_arrays(kind, lag, window)
+        saved_files = []
+
+        for c, commodity in enumerate(series_commodities):
+            if commodities is not None and commodity not in commodities:
+                continue
+            for y, year in enumerate(series_years):
+                if not present[c, y] or (years is not None and year not in years):
+                    continue
+                for suffix, array in parts:
+                    matrix = array[c, y]
+                    sizes = matrix.sum(axis = 0) + matrix.sum(axis = 1)
+                    selected = sizes > threshold
+                    if "Unspecified" in data_structure.region_numbers:
+                        selected[data_structure.region_numbers["Unspecified"]] = False
+
+                    file_name = os.path.join(output_dir, file_name_format.format(commodity = commodity, year = year, suffix = suffix))
+                    with data_structure.metrics.stage("save", file_name) as stage:
+                        try:
+                            os.makedirs(os.path.dirname(file_name))
+                        except OSError:
+                            pass
+
+                        contents = data_structure._format_trade_matrix(year, commodity, sizes, np.flatnonzero(selected),
+                            matrix = matrix)
+                        with open(file_name, 'w') as file_handle:
+                            file_handle.write(contents)
+                        stage["elements"] = len(contents)
+                    data_structure.metrics.log("Series {} for commodity {} and year {} saved to {}".format(
+                        kind, commodity, year, file_name))
+                    saved_files.append(file_name)
+
+        return saved_files
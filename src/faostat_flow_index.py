@@ -0,0 +1,168 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_flow_index.py
+#
+# This file contains an index of the trade flows sorted by quantity, answering top-k, threshold
+# and percentile queries on the trade matrices.
+
+# Numpy provides handy matrix support.
+import numpy as np
+
+## This class indexes the flows of the trade matrices of a TradeTensor (see faostat_trade_tensor.py),
+# for each (year, commodity) combination:
+#  - the non-zero flows of the matrix, sorted by decreasing quantity, with their exporters and importers;
+#  - for each importer, the exporters sorted by decreasing quantity, and for each exporter, the importers.
+# Once a combination is indexed, top-k queries are a slice of the sorted flows, threshold queries a binary search
+# and percentile queries a lookup, none of them depending on the size of the matrices.
+#
+# Combinations are indexed the first time they are queried, or all at once by build(). When a matrix changes
+# (e.g. when a file adds flows to it), invalidate() drops its entries only, which are rebuilt on the next query.
+# The index does not notice matrices modified directly, which must be invalidated by the caller.
+class FlowIndex:
+
+    # Attributes
+
+    ## The TradeTensor holding the indexed trade matrices.
+    matrices = None
+    ## Dictionary holding, for each indexed (year, commodity) key, a (quantities, exporters, importers) tuple
+    # of Numpy arrays describing the non-zero flows by decreasing quantity (ties in exporter, then importer order).
+    flows = None
+    ## Dictionary holding, for each (year, commodity, axis) key, a 2D Numpy array of region numbers where each
+    # row lists the partners of a region by decreasing quantity: exporters of each importer for axis 0,
+    # importers of each exporter for axis 1.
+    partners = None
+
+    ## The constructor creates an empty index.
+    # @param matrices The TradeTensor holding the trade matrices to index.
+    def __init__(self, matrices):
+        self.matrices = matrices
+        self.flows = dict()
+        self.partners = dict()
+
+    ## Indexes the flows of given combinations ahead of the queries.
+    # @param keys A list of (year, commodity) tuples, or None for all the combinations of the trade matrices.
+    # @return The number of combinations indexed.
+    def build(self, keys = None):
+        if keys is None:
+            keys = self.matrices.keys()
+        for key in keys:
+            self._get_flows(key)
+        return len(keys)
+
+    ## Drops the entries of given combinations, which are rebuilt the next time they are queried.
+    # @param keys A list of (year, commodity) tuples.
+    def invalidate(self, keys):
+        for year, commodity in keys:
+            self.flows.pop((year, commodity), None)
+            for axis in (0, 1):
+                self.partners.pop((year, commodity, axis), None)
+
+    ## Returns the sorted flows of a combination, indexing it if needed.
+    # @param key A (year, commodity) tuple.
+    # @return A (quantities, exporters, importers) tuple (see flows).
+    def _get_flows(self, key):
+        flows = self.flows.get(key)
+        if flows is None:
+            matrix = self.matrices[key]
+            cells = np.flatnonzero(matrix)
+            quantities = matrix.ravel()[cells]
+            # A stable sort on the negated quantities keeps equal flows in cell order
+            order = np.argsort(-quantities, kind = "mergesort")
+            cells = cells[order]
+            flows = (quantities[order], cells // matrix.shape[1], cells % matrix.shape[1])
+            self.flows[key] = flows
+        return flows
+
+    ## Returns the partners of every region for a combination, sorted by decreasing quantity, indexing them if needed.
+    # @param key A (year, commodity) tuple.
+    # @param axis 0 for the exporters of each importer, 1 for the importers of each exporter.
+    # @return A 2D Numpy array of region numbers (see partners).
+    def _get_partners(self, key, axis):
+        partners = self.partners.get(key + (axis,))
+        if partners is None:
+            matrix = self.matrices[key]
+            partners = np.argsort(-(matrix.T if axis == 0 else matrix), axis = 1, kind = "mergesort")
+            self.partners[key + (axis,)] = partners
+        return partners
+
+    ## Returns the largest flows of a combination.
+    # @param year The year, as an integer.
+    # @param commodity The commodity.
+    # @param k The number of flows to return.
+    # @param exporters A list of exporting region numbers to restrict the flows to, or None.
+    # @param importers A list of importing region numbers to restrict the flows to, or None.
+    # @return A list of at most k (exporter, importer, quantity) tuples by decreasing quantity, without zero flows.
+    def get_top_flows(self, year, commodity, k, exporters = None, importers = None):
+        quantities, flow_exporters, flow_importers = self._get_flows((year, commodity))
+        if exporters is None and importers is None:
+            return zip(flow_exporters[:k].tolist(), flow_importers[:k].tolist(), quantities[:k].tolist())
+
+        selected = np.ones(len(quantities), dtype = bool)
+        if exporters is not None:
+            selected &= np.in1d(flow_exporters, exporters)
+        if importers is not None:
+            selected &= np.in1d(flow_importers, importers)
+        selected = np.flatnonzero(selected)[:k]
+        return zip(flow_exporters[selected].tolist(), flow_importers[selected].tolist(), quantities[selected].tolist())
+
+    ## Returns the flows of a combination above a quantity.
+    # @param year The year, as an integer.
+    # @param commodity The commodity.
+    # @param threshold The quantity the flows must exceed.
+    # @return A list of (exporter, importer, quantity) tuples by decreasing quantity.
+    def get_flows_above(self, year, commodity, threshold):
+        quantities, exporters, importers = self._get_flows((year, commodity))
+        # The negated quantities are in increasing order
+        count = np.searchsorted(-quantities, -threshold, side = "left")
+        return zip(exporters[:count].tolist(), importers[:count].tolist(), quantities[:count].tolist())
+
+    ## Returns the quantity below which a given percentage of the non-zero flows of a combination fall,
+    # interpolating linearly between flows (as numpy.percentile does).
+    # @param year The year, as an integer.
+    # @param commodity The commodity.
+    # @param percentile The percentage, between 0 and 100.
+    # @return The quantity, as a float, or None if the matrix holds no flow.
+    def get_percentile(self, year, commodity, percentile):
+        if not 0 <= percentile <= 100:
+            raise ValueError("Percentile out of range: {}".format(percentile))
+        quantities = self._get_flows((year, commodity))[0]
+        if len(quantities) == 0:
+            return None
+        # Quantities are in decreasing order, so the rank is counted from the end
+        rank = (len(quantities) - 1) * (1 - percentile / 100.0)
+        lower = int(np.floor(rank))
+        upper = min(lower + 1, len(quantities) - 1)
+        return float(quantities[lower] + (quantities[upper] - quantities[lower]) * (rank - lower))
+
+    ## Returns the largest partners of a region for a combination.
+    # @param year The year, as an integer.
+    # @param commodity The commodity.
+    # @param region The number of the region.
+    # @param k The number of partners to return.
+    # @param exporters Boolean telling whether to rank the exporters to the region (True)
+    # or the importers from the region (False).
+    # @return A list of at most k (partner, quantity) tuples by decreasing quantity, without zero flows.
+    def get_top_partners(self, year, commodity, region, k, exporters = True):
+        key = (year, commodity)
+        axis = 0 if exporters else 1
+        partners = self._get_partners(key, axis)[region, :k]
+        matrix = self.matrices[key]
+        quantities = matrix[partners, region] if exporters else matrix[region, partners]
+        count = np.count_nonzero(quantities)
+        return zip(partners[:count].tolist(), quantities[:count].tolist())
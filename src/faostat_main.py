@@ -21,37 +21,181 @@
 # This file contains the main program.
 
 from faostat_trade_data import FAOStatTradeData
+from faostat_chord_diagram import ChordDiagram
+from faostat_metrics import Metrics
+from faostat_derived_series import DerivedSeries
+from faostat_pipeline import Pipeline
 import os.path, sys, os
+import argparse
+# Modules needed to run the external renderers.
+import subprocess, shlex
+import multiprocessing
+
+## Commodities converted by the main program.
+commodities = ("Wheat", "Maize", "Soybeans")
+## Years converted by the main program.
+years = range(2000, 2012)
+## Quantity lower bound below which regions are not written (see FAOStatTradeData.save_trade_matrices()).
+threshold = 10
+## XML files loaded for each commodity, in the order in which they are merged.
+data_file_names = ("TradeMatrix_2000-2002.xml", "TradeMatrix_2003-2005.xml",
+                   "TradeMatrix_2006-2008.xml", "TradeMatrix_2009-2011.xml",
+                   "Production_2000-2012.xml")
+
+## Returns the (commodity, file_name) jobs loading the XML files of the given commodities
+# (see FAOStatTradeData.load_data_parallel()).
+# @param data_dir Folder holding one sub-folder of XML files per commodity.
+# @param commodities A list of commodities.
+def get_jobs(data_dir, commodities):
+    return [(commodity, os.path.join(data_dir, commodity, file_name))
+            for commodity in commodities for file_name in data_file_names]
+
+## Runs an external renderer on a tableviewer file (see --render-command). Failures are reported as warnings.
+# @param command The command line of the renderer, to which the path of the file is appended.
+# @param file_name Path to the tableviewer file.
+# @param metrics A Metrics object.
+def render_file(command, file_name, metrics):
+    with metrics.stage("render", file_name):
+        try:
+            subprocess.check_call(shlex.split(command) + [file_name])
+        except (subprocess.CalledProcessError, OSError) as error:
+            metrics.warn("WARNING! Cannot render {}: {}".format(file_name, error), file_name)
+
+## Loads the XML files, writes the tableviewer files and renders the diagrams as a pipeline (see faostat_pipeline.py):
+# the files of each commodity are written as soon as they are loaded, while the next commodity is loaded, and
+# each file is rendered as soon as it is written. The stages run in their own threads, connected by bounded queues.
+# @param data_structure A FAOStatTradeData object with the regions and the country-to-region mapping loaded.
+# @param data_dir Folder holding one sub-folder of XML files per commodity.
+# @param output_dir Folder where the tableviewer files are written.
+# @param svg_dir Folder where SVG diagrams are drawn (see faostat_chord_diagram.py), or None.
+# @param render_command Command line of an external renderer run on each tableviewer file, or None.
+# @param threads The number of threads writing the files and the number of threads rendering them.
+# @param queue_size The maximum number of items waiting for each stage.
+def run_pipeline(data_structure, data_dir, output_dir, svg_dir = None, render_command = None, threads = 1, queue_size = 4):
+    metrics = data_structure.metrics
+    chord_diagram = ChordDiagram(data_structure)
+    # The worker processes are started before the threads of the pipeline, which they do not need
+    pool = multiprocessing.Pool()
+
+    def load(commodity):
+        data_structure.load_data_parallel(get_jobs(data_dir, [commodity]), pool = pool)
+        return [(year, commodity) for year in years]
+
+    def export(job):
+        year, commodity = job
+        file_names = data_structure.save_trade_matrices(output_dir, [year], [commodity], threshold = threshold)
+        return [(year, commodity, with_production, suffix, file_name) for (with_production, suffix), file_name
+            in zip(((True, ""), (False, "_without_productions")), file_names)]
+
+    def render(job):
+        year, commodity, with_production, suffix, file_name = job
+        if render_command is not None:
+            render_file(render_command, file_name, metrics)
+        if svg_dir is not None:
+            chord_diagram._save_diagram(svg_dir, year, commodity, with_production, suffix, threshold,
+                os.path.join("{commodity}", "{commodity}_{year}{suffix}.svg"))
+
+    pipeline = Pipeline(metrics, queue_size)
+    pipeline.add_stage("load", load)
+    pipeline.add_stage("export", export, threads)
+    if svg_dir is not None or render_command is not None:
+        pipeline.add_stage("render", render, threads)
+    try:
+        pipeline.run(commodities)
+    finally:
+        pool.close()
+        pool.join()
 
 if __name__ == "__main__":
 
-    data_dir = sys.argv[1]
-    output_dir = sys.argv[2]
-    commodities = ("Wheat", "Maize", "Soybeans")
-    years = range(2000, 2012)
-
-    data_structure = FAOStatTradeData()
-    data_structure.load_regions(os.path.join(data_dir, "regions.csv"))
-    data_structure.load_country_regions(os.path.join(data_dir, "country_regions.csv"))
-
-    for commodity in commodities:
-        data_file = os.path.join(data_dir, commodity, "TradeMatrix_2000-2002.xml")
-        data_structure.load_trade_data(data_file)
-        data_file = os.path.join(data_dir, commodity, "TradeMatrix_2003-2005.xml")
-        data_structure.load_trade_data(data_file)
-        data_file = os.path.join(data_dir, commodity, "TradeMatrix_2006-2008.xml")
-        data_structure.load_trade_data(data_file)
-        data_file = os.path.join(data_dir, commodity, "TradeMatrix_2009-2011.xml")
-        data_structure.load_trade_data(data_file)
-        data_structure.load_production_data(os.path.join(data_dir, commodity,  "Production_2000-2012.xml"))
-
-    for year in years:
-        for commodity in commodities:
-            target_folder = os.path.join(output_dir, commodity)
-            try:
-                os.mkdir(target_folder)
-            except OSError:
-                pass
-            data_structure.save_trade_matrix(year, commodity, os.path.join(target_folder, "{}_{}.txt".format(commodity, year)), threshold = 10, with_production=True)
-            data_structure.save_trade_matrix(year, commodity, os.path.join(target_folder, "{}_{}_without_productions.txt".format(commodity, year)), threshold = 10, with_production=False)
+    parser = argparse.ArgumentParser(description = "Generates Circos tableviewer files from faostat XML files.")
+    parser.add_argument("data_dir", help = "folder holding the regions, the country-to-region mapping and the XML files")
+    parser.add_argument("output_dir", help = "folder where the tableviewer files are written")
+    parser.add_argument("--cache-dir", help = "folder where parsed XML files are cached (default: <data_dir>/.cache)")
+    parser.add_argument("--no-cache", action = "store_true", help = "always parse the XML files")
+    parser.add_argument("--threads", type = int, help = "number of threads writing the tableviewer files")
+    parser.add_argument("--svg-dir", help = "folder where SVG diagrams are drawn directly, without Circos (see faostat_chord_diagram.py)")
+    parser.add_argument("--bulk", nargs = "+", metavar = "FILE",
+                        help = "load FAOStat bulk CSV files or zip archives (normalized layout) instead of the XML files")
+    parser.add_argument("--save-store", metavar = "DIR",
+                        help = "save the loaded data to a memory-mappable tensor store (see FAOStatTradeData.save_store())")
+    parser.add_argument("--from-store", metavar = "DIR",
+                        help = "memory-map the data from a tensor store instead of loading the data files")
+    parser.add_argument("--pipeline", action = "store_true",
+                        help = "overlap the loading of the XML files, the writing of the tableviewer files and the rendering "
+                               "of the diagrams, and report the occupancy of each stage")
+    parser.add_argument("--queue-size", type = int, default = 4,
+                        help = "maximum number of items waiting for each stage of the pipeline (default: 4)")
+    parser.add_argument("--render-command", metavar = "COMMAND",
+                        help = "command run on each tableviewer file written, e.g. run/generate_diagrams.py")
+    parser.add_argument("--derived", nargs = "+", choices = DerivedSeries.kinds, default = [], metavar = "KIND",
+                        help = "also write series derived from the trade matrices: delta (year-over-year increases and "
+                               "decreases), average (moving averages) or share (shares of the imports of each region)")
+    parser.add_argument("--window", type = int, default = 3, help = "number of years of the moving averages (default: 3)")
+    parser.add_argument("--reconcile", choices = FAOStatTradeData.reconciliation_policies,
+                        help = "fill in the trade matrices with the import tables, combining both under the given policy")
+    parser.add_argument("--cif-fob-factor", type = float, default = 1.1,
+                        help = "ratio between import (CIF) and export (FOB) quantities for the cif-fob policy (default: 1.1)")
+    parser.add_argument("--verbosity", type = int, choices = (Metrics.QUIET, Metrics.PROGRESS, Metrics.DETAILS),
+                        default = Metrics.DETAILS, help = "0: warnings only, 1: progress messages, 2: details (default)")
+    parser.add_argument("-q", "--quiet", dest = "verbosity", action = "store_const", const = Metrics.QUIET,
+                        help = "only print the warnings")
+    parser.add_argument("--metrics-json", help = "file where the measurements of each stage and file are saved")
+    parser.add_argument("--profile", nargs = "+", metavar = "STAGE", default = [],
+                        help = "stages to profile with cProfile (e.g. parse, aggregate, merge, save, render or all)")
+    parser.add_argument("--trace-memory", nargs = "+", metavar = "STAGE", default = [],
+                        help = "stages whose memory allocations are traced (needs tracemalloc)")
+    parser.add_argument("--profile-dir", default = ".", help = "folder where the profiles are saved")
+    args = parser.parse_args()
+    if args.pipeline and (args.from_store is not None or args.bulk is not None or args.reconcile is not None):
+        parser.error("--pipeline cannot be combined with --from-store, --bulk or --reconcile")
+    if args.from_store is not None and args.reconcile is not None:
+        parser.error("--reconcile needs the country-level data of the XML files and cannot be combined with --from-store")
+
+    data_dir = args.data_dir
+    output_dir = args.output_dir
+
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = args.cache_dir or os.path.join(data_dir, ".cache")
+
+    metrics = Metrics(args.verbosity)
+    if args.profile or args.trace_memory:
+        metrics.configure_profiling(args.profile, args.trace_memory, args.profile_dir)
+
+    # The import tables are only needed to reconcile the trade matrices
+    data_structure = FAOStatTradeData(cache_dir, metrics, with_imports = args.reconcile is not None)
+    if args.from_store is not None:
+        data_structure.open_store(args.from_store)
+    else:
+        data_structure.load_regions(os.path.join(data_dir, "regions.csv"))
+        data_structure.load_country_regions(os.path.join(data_dir, "country_regions.csv"))
+
+        if args.pipeline:
+            run_pipeline(data_structure, data_dir, output_dir, args.svg_dir, args.render_command, args.threads or 1, args.queue_size)
+        elif args.bulk is not None:
+            for file_name in args.bulk:
+                data_structure.load_bulk_data(file_name, commodities = commodities, years = years)
+        else:
+            # Files are parsed in parallel and merged in this order
+            data_structure.load_data_parallel(get_jobs(data_dir, commodities))
+        metrics.log("Country name lookups: {hits} hits, {misses} misses".format(**data_structure.tag_lookup_counts))
+
+        if args.save_store is not None:
+            data_structure.save_store(args.save_store)
+    if args.reconcile is not None:
+        data_structure.trade_matrices = data_structure.reconcile(args.reconcile, args.cif_fob_factor)
+
+    if not args.pipeline:
+        saved_files = data_structure.save_trade_matrices(output_dir, years, commodities, threshold = threshold, threads = args.threads)
+        if args.render_command is not None:
+            for file_name in saved_files:
+                render_file(args.render_command, file_name, metrics)
+    for kind in args.derived:
+        data_structure.derived_series.save(output_dir, kind, years, commodities, threshold = threshold, window = args.window)
+    if args.svg_dir is not None and not args.pipeline:
+        ChordDiagram(data_structure).save_diagrams(args.svg_dir, years, commodities, threshold = threshold, threads = args.threads)
 
+    metrics.print_summary()
+    if args.metrics_json is not None:
+        metrics.save_report(args.metrics_json)
@@ -0,0 +1,323 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_metrics.py
+#
+# This file contains the instrumentation of the program: progress messages, timers, counters and profiling hooks.
+
+import os, os.path, sys
+# Modules needed to time the stages and measure the memory usage.
+import time, resource
+# Module needed to profile the stages.
+import cProfile
+import json
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# tracemalloc is only available from Python 3.4, or as the pytracemalloc module on patched Python 2 interpreters.
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+## This class records the wall time, the number of elements processed, the warnings and the peak memory usage
+# of each stage of the program, both in total and for each file, along with named counters.
+# It also prints the progress messages, depending on the verbosity level, and can save all measurements as JSON.
+#
+# Any stage can be profiled with cProfile or, where tracemalloc is available, have its memory allocations traced.
+# Stages are selected with configure_profiling(), or with the FAOSTAT_PROFILE and FAOSTAT_TRACE_MEMORY
+# environment variables (comma-separated stage names, or "all"); profiles are saved to the folder given by
+# FAOSTAT_PROFILE_DIR (the current folder by default), one file per stage run.
+class Metrics:
+
+    # Verbosity levels
+
+    ## Only warnings are printed.
+    QUIET = 0
+    ## Progress messages are printed as well.
+    PROGRESS = 1
+    ## Details (e.g. the number of entries loaded for each region) are printed as well.
+    DETAILS = 2
+
+    # Attributes
+
+    ## Verbosity level.
+    verbosity = None
+    ## Ordered dictionary holding the totals of each stage (calls, seconds, elements, peak_rss_kb).
+    # Elements are the entries read by the loading stages and the bytes written by the saving stages.
+    stages = None
+    ## Ordered dictionary holding, for each file, the measurements of each stage run on the file.
+    files = None
+    ## Ordered dictionary of named counters.
+    counters = None
+    ## Set of the names of the stages to profile with cProfile ("all" profiles every stage).
+    profile_stages = None
+    ## Set of the names of the stages whose memory allocations are traced ("all" traces every stage).
+    trace_memory_stages = None
+    ## Folder where the profiles are saved.
+    profile_dir = None
+
+    ## The constructor.
+    # @param verbosity Verbosity level (QUIET, PROGRESS or DETAILS).
+    def __init__(self, verbosity = DETAILS):
+        self.verbosity = verbosity
+        self.stages = OrderedDict()
+        self.files = OrderedDict()
+        self.counters = OrderedDict()
+        self._lock = threading.Lock()
+        self._profile_count = 0
+        # Whether a profiled stage is running in the current thread (profilers are per thread)
+        self._local = threading.local()
+        # Measurements of the traced stages running, tracemalloc being shared by the whole process
+        self._traced_stages = []
+        self.configure_profiling(self._get_stage_set("FAOSTAT_PROFILE"), self._get_stage_set("FAOSTAT_TRACE_MEMORY"),
+                                 os.environ.get("FAOSTAT_PROFILE_DIR", "."))
+
+    ## Returns a new Metrics object with the same verbosity and profiling settings, e.g. for a worker process.
+    def create_child(self):
+        child = Metrics(self.verbosity)
+        child.profile_stages = set(self.profile_stages)
+        child.trace_memory_stages = set(self.trace_memory_stages)
+        child.profile_dir = self.profile_dir
+        return child
+
+    ## Returns the state to pickle when the object is sent to a worker process (locks and thread-local data cannot
+    # be pickled, and the stages running in this process are not running in the worker).
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        del state["_local"]
+        state["_traced_stages"] = []
+        return state
+
+    ## Restores the state of a pickled object.
+    # @param state The dictionary returned by __getstate__().
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    ## Returns the set of stage names held by an environment variable.
+    # @param variable The name of the environment variable.
+    @staticmethod
+    def _get_stage_set(variable):
+        return set(name.strip() for name in os.environ.get(variable, "").split(",") if name.strip())
+
+    ## Selects the stages to profile.
+    # @param profile_stages Names of the stages to profile with cProfile ("all" for every stage).
+    # @param trace_memory_stages Names of the stages whose memory allocations are traced ("all" for every stage).
+    # @param profile_dir Folder where the profiles are saved.
+    def configure_profiling(self, profile_stages = (), trace_memory_stages = (), profile_dir = "."):
+        self.profile_stages = set(profile_stages)
+        self.trace_memory_stages = set(trace_memory_stages)
+        self.profile_dir = profile_dir
+        if self.trace_memory_stages and tracemalloc is None:
+            self.warn("WARNING! Memory tracing is not available with this Python interpreter")
+            self.trace_memory_stages = set()
+
+    ## Prints a message if the verbosity level is high enough.
+    # @param message The message.
+    # @param level The verbosity level from which the message is printed.
+    def log(self, message, level = PROGRESS):
+        if self.verbosity >= level:
+            with self._lock:
+                self._write(message)
+
+    ## Prints a warning (even in quiet mode) and counts it.
+    # @param message The warning.
+    # @param file_name The file the warning is about, if any.
+    def warn(self, message, file_name = None):
+        with self._lock:
+            self._write(message)
+            self.counters["warnings"] = self.counters.get("warnings", 0) + 1
+            if file_name is not None:
+                record = self.files.setdefault(file_name, OrderedDict())
+                record["warnings"] = record.get("warnings", 0) + 1
+
+    ## Writes a message and its end of line at once, so that the messages of several threads are not interleaved.
+    # The lock must be held by the caller.
+    # @param message The message.
+    @staticmethod
+    def _write(message):
+        sys.stdout.write(message + "\n")
+        sys.stdout.flush()
+
+    ## Adds a value to a named counter.
+    # @param name The name of the counter.
+    # @param value The value to add.
+    def count(self, name, value = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    ## Context manager measuring a stage.
+    # The context value is a dictionary where the stage can store the number of elements it processed
+    # ("elements") and any other value to record for the file.
+    # Stages may be nested (e.g. the merge stages run by reaggregate()): a stage nested in a profiled stage of the
+    # same thread is not profiled on its own, since it is part of the outer profile and a second profiler would
+    # replace the hook of the first one (see also _start_tracing()).
+    # @param name The name of the stage.
+    # @param file_name The file the stage processes, if any.
+    @contextmanager
+    def stage(self, name, file_name = None):
+        values = {"elements": 0}
+        profiler = None
+        if (name in self.profile_stages or "all" in self.profile_stages) and not getattr(self._local, "profiling", False):
+            profiler = cProfile.Profile()
+        traced = None
+        if name in self.trace_memory_stages or "all" in self.trace_memory_stages:
+            traced = self._start_tracing()
+
+        start = time.time()
+        if profiler is not None:
+            self._local.profiling = True
+            profiler.enable()
+        try:
+            yield values
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self._local.profiling = False
+            values["seconds"] = time.time() - start
+            values["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            if traced is not None:
+                values["traced_peak_kb"] = self._stop_tracing(traced) // 1024
+            if profiler is not None:
+                values["profile"] = self._save_profile(profiler, name, file_name)
+            self.record(name, values, file_name)
+
+    ## Starts tracing the memory allocations of a stage.
+    # Tracing is only started by the outermost traced stage and stopped when the last traced stage ends, so that
+    # nested stages do not stop it under the outer ones. The peak of each stage is read whenever a traced stage starts
+    # or ends, the peak of tracemalloc being reset in between where reset_peak() is available (Python 3.9 and later):
+    # elsewhere, the peak of a nested stage is the peak since an enclosing stage started.
+    # @return The measurements of the stage, to pass to _stop_tracing().
+    def _start_tracing(self):
+        with self._lock:
+            if self._traced_stages:
+                self._update_traced_peaks()
+            else:
+                tracemalloc.start()
+            # Allocations made before the stage started are not counted
+            traced = [tracemalloc.get_traced_memory()[0], 0]
+            self._traced_stages.append(traced)
+        return traced
+
+    ## Stops tracing the memory allocations of a stage (see _start_tracing()).
+    # @param traced The measurements returned by _start_tracing().
+    # @return The peak size of the memory allocated during the stage, in bytes.
+    def _stop_tracing(self, traced):
+        with self._lock:
+            self._update_traced_peaks()
+            self._traced_stages = [other for other in self._traced_stages if other is not traced]
+            if not self._traced_stages:
+                tracemalloc.stop()
+        return max(traced[1] - traced[0], 0)
+
+    ## Adds the peak traced since the last call to the peaks of the traced stages running (the lock must be held).
+    def _update_traced_peaks(self):
+        peak = tracemalloc.get_traced_memory()[1]
+        for traced in self._traced_stages:
+            traced[1] = max(traced[1], peak)
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+    ## Records the measurements of a stage run.
+    # @param name The name of the stage.
+    # @param values A dictionary of measurements (see stage()).
+    # @param file_name The file the stage processed, if any.
+    def record(self, name, values, file_name = None):
+        with self._lock:
+            self._add_totals(name, dict(values, calls = 1))
+            if file_name is not None:
+                self.files.setdefault(file_name, OrderedDict())[name] = values
+
+    ## Adds measurements to the totals of a stage (the lock must be held).
+    # @param name The name of the stage.
+    # @param values A dictionary of measurements, holding the number of calls.
+    def _add_totals(self, name, values):
+        totals = self.stages.setdefault(name, OrderedDict([("calls", 0), ("seconds", 0.0), ("elements", 0), ("peak_rss_kb", 0)]))
+        for key in ("calls", "seconds", "elements"):
+            totals[key] += values.get(key, 0)
+        for key in ("peak_rss_kb", "traced_peak_kb"):
+            if key in values:
+                totals[key] = max(totals.get(key, 0), values[key])
+
+    ## Saves the profile of a stage run.
+    # @param profiler The cProfile.Profile object.
+    # @param name The name of the stage.
+    # @param file_name The file the stage processed, if any.
+    # @return The path of the profile.
+    def _save_profile(self, profiler, name, file_name):
+        try:
+            os.makedirs(self.profile_dir)
+        except OSError:
+            pass
+        parts = [name] + ([os.path.basename(file_name)] if file_name is not None else []) + [str(os.getpid())]
+        with self._lock:
+            # Worker processes may receive copies of the same object, so existing profiles are skipped
+            path = None
+            while path is None or os.path.exists(path):
+                self._profile_count += 1
+                path = os.path.join(self.profile_dir, "_".join(parts + [str(self._profile_count)]) + ".prof")
+            profiler.dump_stats(path)
+        return path
+
+    ## Adds the measurements of another Metrics object, e.g. from a worker process.
+    # @param report A dictionary returned by get_report().
+    def merge(self, report):
+        with self._lock:
+            for name, totals in report["stages"].items():
+                self._add_totals(name, totals)
+            for file_name, record in report["files"].items():
+                self.files.setdefault(file_name, OrderedDict()).update(record)
+            for name, value in report["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    ## Returns all measurements as a dictionary which can be saved as JSON.
+    def get_report(self):
+        with self._lock:
+            return {
+                "stages": self.stages,
+                "files": self.files,
+                "counters": self.counters,
+                "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            }
+
+    ## Returns all measurements as get_report() does, and discards them.
+    def pop_report(self):
+        report = self.get_report()
+        with self._lock:
+            self.stages = OrderedDict()
+            self.files = OrderedDict()
+            self.counters = OrderedDict()
+        return report
+
+    ## Saves all measurements as a JSON file.
+    # @param file_name Path to the file.
+    def save_report(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump(self.get_report(), f, indent = 1)
+
+    ## Prints the totals of each stage.
+    def print_summary(self):
+        for name, totals in self.stages.items():
+            self.log("{:>24}: {:4d} calls, {:8.3f} s, {:10d} elements, peak RSS {} KB".format(
+                name, totals["calls"], totals["seconds"], totals["elements"], totals["peak_rss_kb"]))
+        for name, value in self.counters.items():
+            self.log("{:>24}: {}".format(name, value))
@@ -0,0 +1,195 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_name_codec.py
+#
+# This file contains the codec used to turn country and region names into Circos-compatible names and back.
+
+# Module needed for advanced text pattern matching and replacement.
+import re
+# Dictionary preserving the insertion order of its keys, used as a LRU memo.
+from collections import OrderedDict
+# Module needed to share the memo between threads.
+import threading
+
+## This class encodes names by replacing all characters that are not pure ASCII alphanumeric
+# (apart from underscores) by _x####_, where #### is the corresponding unicode hex number,
+# and decodes them back. The most recently used names are memoized.
+#
+# Decoding is done in a single pass over the text. The original algorithm replaced the codes
+# found in the text one after the other, each time over the whole text, which gives a different
+# result in a few corner cases (overlapping codes, or decoded characters creating a new code).
+# Texts where this may happen are decoded with the original algorithm, so that the output is
+# always the same.
+class NameCodec:
+
+    # Attributes
+
+    ## Pattern corresponding to a character code
+    code_pattern = re.compile("_x([0-9a-fA-F]{4})_")
+    ## Pattern matching all character codes, including overlapping ones
+    overlapping_code_pattern = re.compile("(?=_x[0-9a-fA-F]{4}_)")
+    ## Characters which, once decoded, may form a code with the surrounding text
+    unsafe_characters = frozenset(u"_x0123456789abcdefABCDEF\\")
+    ## Pattern corresponding to a character to encode
+    encode_pattern = re.compile(u"[^0-9A-Za-z_]")
+    ## Maximum number of names memoized for each direction
+    max_size = None
+    ## Number of names found in the memos since they were last cleared
+    hits = 0
+    ## Number of names not found in the memos since they were last cleared
+    misses = 0
+
+    ## The constructor initializes empty memos.
+    # @param max_size Maximum number of names memoized for each direction.
+    def __init__(self, max_size = 4096):
+        self.max_size = max_size
+        self._encoded = OrderedDict()
+        self._decoded = OrderedDict()
+        self._lock = threading.Lock()
+
+    ## Empties the memos and resets the hit and miss counters.
+    def clear(self):
+        with self._lock:
+            self._encoded.clear()
+            self._decoded.clear()
+            self.hits = 0
+            self.misses = 0
+
+    ## Returns a copy of the input string as a Unicode object with all
+    # unicode characters, spaces, parentheses, commas and apostrophes replaced
+    # by _x####_ where ### is the correpsonding unicode hex number.
+    # @param name The text to encode, assumed to be a Unicode object, or an ASCII text string.
+    def encode(self, name):
+        encoded = self._lookup(self._encoded, name)
+        if encoded is None:
+            encoded = self.encode_pattern.sub(self._encode_character, unicode(name).strip())
+            self._store(self._encoded, name, encoded)
+        return encoded
+
+    ## Returns a Unicode object corresponding to the input string
+    # with all codes translated back to their corresponding character.
+    # @param name The text to decode (an ASCII text string with only alphanumeric characters or underscores).
+    def decode(self, name):
+        # ASCII text strings and equal Unicode objects are memoized separately, since a text
+        # string without codes is returned unchanged.
+        key = (type(name), name)
+        decoded = self._lookup(self._decoded, key)
+        if decoded is None:
+            decoded = self.decode_text(name)
+            self._store(self._decoded, key, decoded)
+        return decoded
+
+    ## Decodes a whole file, without memoizing the text.
+    # Lines are decoded by blocks: since codes cannot span several lines, a block can be decoded
+    # at once unless it needs the original algorithm, in which case its lines are decoded one by one.
+    # @param in_file A file object to read the text from.
+    # @param out_file A file object to write the UTF-8 encoded text to.
+    # @param block_size The approximate number of bytes decoded at once.
+    def decode_stream(self, in_file, out_file, block_size = 1 << 20):
+        while True:
+            lines = in_file.readlines(block_size)
+            if not lines:
+                break
+            try:
+                decoded = self._decode_single_pass(''.join(lines))
+            except UnicodeDecodeError:
+                decoded = None
+            if decoded is None:
+                decoded = ''.join(self._encode_utf8(self.decode_text(line)) for line in lines)
+            out_file.write(self._encode_utf8(decoded))
+
+    ## Decodes a text without looking it up in the memo (see decode()).
+    # @param text The text to decode.
+    def decode_text(self, text):
+        decoded = self._decode_single_pass(text)
+        if decoded is None:
+            return self._decode_iteratively(text)
+        return decoded
+
+    ## Decodes a text in a single pass.
+    # @param text The text to decode.
+    # @return The decoded text, or None if the original algorithm may give a different result, i.e. when
+    # codes overlap or when a decoded character may be part of a new code (or of a replacement escape).
+    def _decode_single_pass(self, text):
+        if "_x" not in text:
+            return text
+
+        decoded_characters = []
+        def decode_character(match):
+            character = unichr(int(match.group(1), 16))
+            decoded_characters.append(character)
+            return character
+
+        decoded = self.code_pattern.sub(decode_character, text)
+
+        # Every code starts with "_x", so codes can only overlap if there are more "_x" than codes.
+        if (text.count("_x") != len(decoded_characters)
+                and len(self.overlapping_code_pattern.findall(text)) != len(decoded_characters)):
+            return None
+        if not self.unsafe_characters.isdisjoint(decoded_characters):
+            return None
+
+        return decoded
+
+    ## Original decoding algorithm, replacing each code found in the text over the whole text.
+    # @param name The text to decode.
+    def _decode_iteratively(self, name):
+        fixed_string = name
+        for match in self.code_pattern.finditer(name):
+            code = match.groups()[0]
+            fixed_string = re.sub("_x" + code + "_", unichr(int(code, 16)), fixed_string)
+        return fixed_string
+
+    ## Returns a text as a UTF-8 encoded text string.
+    # @param text A Unicode object or an ASCII text string.
+    @staticmethod
+    def _encode_utf8(text):
+        if isinstance(text, unicode):
+            return text.encode('utf-8')
+        return text
+
+    ## Returns the code of the character matched by encode_pattern.
+    # @param match The match object.
+    @staticmethod
+    def _encode_character(match):
+        return u'_x{:04X}_'.format(ord(match.group()))
+
+    ## Looks up a name in a memo, marking it as the most recently used one.
+    # @param memo The memo (an ordered dictionary).
+    # @param key The key of the name to look up.
+    # @return The memoized value, or None.
+    def _lookup(self, memo, key):
+        with self._lock:
+            value = memo.pop(key, None)
+            if value is not None:
+                memo[key] = value
+                self.hits += 1
+            else:
+                self.misses += 1
+        return value
+
+    ## Adds a name to a memo, dropping the least recently used name if the memo is full.
+    # @param memo The memo (an ordered dictionary).
+    # @param key The key of the name.
+    # @param value The value to memoize.
+    def _store(self, memo, key, value):
+        with self._lock:
+            memo[key] = value
+            if len(memo) > self.max_size:
+                memo.popitem(last = False)
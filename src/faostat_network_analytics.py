@@ -0,0 +1,149 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_network_analytics.py
+#
+# This file contains dependency metrics of the trade networks (strengths, import concentration, centrality
+# and two-hop exposure), computed over all the trade matrices at once.
+
+# Numpy provides handy matrix support.
+import numpy as np
+
+## This class computes metrics of the trade networks formed by the regions of a FAOStatTradeData object,
+# where each flow is an edge from the exporter to the importer weighted by its quantity.
+# All the trade matrices are stacked into a single array indexed by [commodity, year, exporter, importer]
+# (see DerivedSeries.get_trade_array()), and each metric is computed for all commodities and years at once.
+#
+# Every method returns a (commodities, years, array) tuple, where years is in chronological order and array
+# a float Numpy array indexed by [commodity, year] followed by one or two region axes, lined up with the region
+# numbers of the data structure. Combinations which have not been loaded hold NaN.
+# Trade within a region (the diagonal of the matrices) is left out unless stated otherwise.
+class NetworkAnalytics:
+
+    # Attributes
+
+    ## The FAOStatTradeData object holding the trade matrices.
+    data_structure = None
+    ## Damping factor of the PageRank centrality (probability of following a flow rather than jumping to any region).
+    damping = 0.85
+    ## Convergence tolerance of the power iteration (largest change of a score between two iterations).
+    tolerance = 1e-10
+    ## Maximum number of iterations of the power iteration.
+    max_iterations = 1000
+
+    ## The constructor.
+    # @param data_structure A FAOStatTradeData object with the trade matrices (and productions) loaded.
+    def __init__(self, data_structure):
+        self.data_structure = data_structure
+
+    ## Returns the stacked trade matrices as floats.
+    # @param include_internal Boolean indicating whether to keep the trade within each region.
+    # @return A (commodities, years, array, present) tuple (see DerivedSeries.get_trade_array()).
+    def _get_flows(self, include_internal = False):
+        commodities, years, array, present = self.data_structure.derived_series.get_trade_array()
+        flows = array.astype(np.float64)
+        if not include_internal:
+            regions = np.arange(flows.shape[-1])
+            flows[..., regions, regions] = 0
+        return commodities, years, flows, present
+
+    ## Sets the combinations which have not been loaded to NaN.
+    # @param array A float Numpy array indexed by [commodity, year, ...].
+    # @param present A boolean Numpy array indexed by [commodity, year].
+    @staticmethod
+    def _mask_missing(array, present):
+        array[~present] = np.nan
+        return array
+
+    ## Divides an array by another, with NaN where the divisor is 0.
+    @staticmethod
+    def _divide(numerator, denominator):
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            return np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1), np.nan)
+
+    ## Computes the out-strength (total exports) and in-strength (total imports) of every region.
+    # @param include_internal Boolean indicating whether to count the trade within each region.
+    # @return A (commodities, years, out_strengths, in_strengths) tuple, both arrays being indexed by
+    # [commodity, year, region].
+    def get_strengths(self, include_internal = False):
+        commodities, years, flows, present = self._get_flows(include_internal)
+        return (commodities, years, self._mask_missing(flows.sum(axis = 3), present),
+                self._mask_missing(flows.sum(axis = 2), present))
+
+    ## Computes the import concentration of every region as a Herfindahl-Hirschman index: the sum of the squared
+    # shares of its imports coming from each exporter, from 1 / (number of regions) (evenly spread) to 1 (single supplier).
+    # @return A (commodities, years, hhi) tuple, hhi being indexed by [commodity, year, importer]
+    # and holding NaN for the regions without imports.
+    def get_import_concentration(self):
+        commodities, years, flows, present = self._get_flows()
+        imports = flows.sum(axis = 2)
+        shares = self._divide(flows, imports[:, :, np.newaxis, :])
+        return commodities, years, self._mask_missing((shares ** 2).sum(axis = 2), present)
+
+    ## Computes the PageRank centrality of every region in the weighted trade network, by power iteration
+    # over all the matrices at once. A random walk follows each flow with a probability proportional to its quantity,
+    # or jumps to any region with probability 1 - damping (or always, from regions without exports).
+    # Central regions are thus the ones receiving large flows from central regions.
+    # @param reverse Boolean indicating whether to walk the flows backwards, so that central regions are the ones
+    # supplying central regions.
+    # @return A (commodities, years, scores) tuple, scores being indexed by [commodity, year, region]
+    # and adding up to 1 for each combination.
+    def get_pagerank(self, reverse = False):
+        commodities, years, flows, present = self._get_flows()
+        if reverse:
+            flows = flows.swapaxes(2, 3)
+        num_regions = flows.shape[-1]
+        exports = flows.sum(axis = 3)
+        transitions = np.nan_to_num(self._divide(flows, exports[..., np.newaxis]))
+        dangling = exports == 0
+
+        scores = np.full(flows.shape[:3], 1.0 / max(num_regions, 1))
+        for iteration in range(self.max_iterations):
+            # Batched row vector-matrix products over all the combinations
+            walked = np.matmul(scores[..., np.newaxis, :], transitions)[..., 0, :]
+            jumping = (1 - self.damping) + self.damping * (scores * dangling).sum(axis = 2)
+            new_scores = self.damping * walked + jumping[..., np.newaxis] / num_regions
+            change = np.abs(new_scores - scores).max() if new_scores.size else 0
+            scores = new_scores
+            if change < self.tolerance:
+                break
+        return commodities, years, self._mask_missing(scores, present)
+
+    ## Computes the two-hop exposure of every importer to every origin: the share of the imports of the importer
+    # coming from the origin through one intermediary region, assuming that each intermediary re-exports its
+    # supply (imports + production) in proportion to where it comes from.
+    # The exposure of importer i to origin o is the sum over the intermediaries k of (share of the supply of k
+    # coming from o) x (share of the imports of i coming from k), computed as a batched matrix product.
+    # @param with_production Boolean indicating whether the supply of the intermediaries includes their production,
+    # which dilutes what they re-export (otherwise they only re-export imports).
+    # @return A (commodities, years, exposures) tuple, exposures being indexed by [commodity, year, origin, importer]
+    # and holding NaN for the importers without imports.
+    def get_two_hop_exposure(self, with_production = True):
+        commodities, years, flows, present = self._get_flows()
+        imports = flows.sum(axis = 2)
+        supplies = imports
+        if with_production:
+            supplies = imports + self.data_structure.productions.get_aligned_array(commodities, years)
+        supply_shares = np.nan_to_num(self._divide(flows, supplies[:, :, np.newaxis, :]))
+        import_shares = np.nan_to_num(self._divide(flows, imports[:, :, np.newaxis, :]))
+        exposures = np.matmul(supply_shares, import_shares)
+        # Goods coming back to their origin are not an exposure
+        regions = np.arange(flows.shape[-1])
+        exposures[..., regions, regions] = 0
+        exposures = np.where(imports[:, :, np.newaxis, :] > 0, exposures, np.nan)
+        return commodities, years, self._mask_missing(exposures, present)
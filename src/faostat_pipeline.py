@@ -0,0 +1,199 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_pipeline.py
+#
+# This file contains a pipeline of stages connected by bounded queues, used by the main program to overlap
+# the parsing of the XML files, the writing of the tableviewer files and the rendering of the diagrams.
+
+# Modules needed to run the stages from their own threads.
+import threading, Queue
+import time, sys
+
+## Marker put into a queue after the last item.
+_end = object()
+
+## This class holds a stage of a pipeline and its measurements.
+class PipelineStage:
+
+    # Attributes
+
+    ## The name of the stage.
+    name = None
+    ## The function processing an item, returning or yielding the items passed to the next stage.
+    function = None
+    ## The number of threads running the stage.
+    workers = None
+    ## The bounded queue of the items waiting for the stage.
+    queue = None
+    ## The number of items processed.
+    items = 0
+    ## The total time spent processing items, over all threads.
+    busy_seconds = 0.0
+    ## The total time spent waiting for items, over all threads.
+    starved_seconds = 0.0
+    ## The total time spent waiting for room in the queue of the next stage, over all threads.
+    blocked_seconds = 0.0
+    ## The sum of the lengths of the queue, sampled whenever an item is taken from it.
+    queue_length_sum = 0
+    ## The number of threads which have finished.
+    finished_workers = 0
+
+    ## The constructor.
+    # @param name The name of the stage.
+    # @param function The function processing an item.
+    # @param workers The number of threads running the stage.
+    # @param queue_size The maximum number of items waiting for the stage.
+    def __init__(self, name, function, workers, queue_size):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue = Queue.Queue(queue_size)
+
+## This class runs stages in a producer/consumer fashion: each stage runs in its own threads and takes its items
+# from a bounded queue, which the previous stage fills with the items it returns. A stage blocks when the queue of
+# the next stage is full, so that a slow stage holds back the previous ones (back-pressure) and the number of items
+# in flight never exceeds the sizes of the queues.
+#
+# When the pipeline has run, the occupancy of each stage is reported: the fraction of the time its threads were busy,
+# starved (waiting for items, i.e. held back by the previous stages) or blocked (waiting for the next stage),
+# and the mean length of its queue. The bottleneck is the stage whose threads are busy most of the time, with a
+# full queue in front of it.
+class Pipeline:
+
+    # Attributes
+
+    ## Metrics object printing the report and recording the measurements (see faostat_metrics.py).
+    metrics = None
+    ## The maximum number of items waiting for each stage.
+    queue_size = None
+    ## The list of stages, in order.
+    stages = None
+
+    ## The constructor creates an empty pipeline.
+    # @param metrics A Metrics object.
+    # @param queue_size The maximum number of items waiting for each stage.
+    def __init__(self, metrics, queue_size = 4):
+        self.metrics = metrics
+        self.queue_size = queue_size
+        self.stages = []
+        self._lock = threading.Lock()
+        self._error = None
+
+    ## Adds a stage at the end of the pipeline.
+    # @param name The name of the stage.
+    # @param function The function processing an item. It returns or yields the items to pass to the next stage
+    # (or to return from run() for the last stage), possibly none.
+    # @param workers The number of threads running the stage. Items may leave a stage with several threads
+    # in a different order than they entered it.
+    def add_stage(self, name, function, workers = 1):
+        self.stages.append(PipelineStage(name, function, workers, self.queue_size))
+
+    ## Runs the pipeline until all the items have gone through all the stages.
+    # If a stage raises an exception, the remaining items are discarded and the exception is raised again.
+    # @param items The items to pass to the first stage.
+    # @return The list of the items returned by the last stage.
+    def run(self, items):
+        results = []
+        threads = [threading.Thread(target = self._feed, args = (items,))]
+        for i, stage in enumerate(self.stages):
+            next_stage = self.stages[i + 1] if i + 1 < len(self.stages) else None
+            threads += [threading.Thread(target = self._work, args = (stage, next_stage, results)) for worker in range(stage.workers)]
+
+        start = time.time()
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            # Joining with a timeout lets KeyboardInterrupt through
+            while thread.is_alive():
+                thread.join(0.1)
+        self._report(time.time() - start)
+
+        if self._error is not None:
+            raise self._error[0], self._error[1], self._error[2]
+        return results
+
+    ## Puts the items into the queue of the first stage.
+    # @param items The items.
+    def _feed(self, items):
+        first_stage = self.stages[0]
+        for item in items:
+            first_stage.queue.put(item)
+        for worker in range(first_stage.workers):
+            first_stage.queue.put(_end)
+
+    ## Runs a stage until the end of its items.
+    # @param stage The stage.
+    # @param next_stage The next stage, or None for the last stage.
+    # @param results The list where the items returned by the last stage are appended.
+    def _work(self, stage, next_stage, results):
+        while True:
+            start = time.time()
+            item = stage.queue.get()
+            waited = time.time() - start
+            if item is _end:
+                break
+
+            busy = blocked = 0.0
+            # Once a stage has failed, the remaining items are only taken out of the queues
+            if self._error is None:
+                try:
+                    start = time.time()
+                    outputs = stage.function(item)
+                    for output in outputs if outputs is not None else ():
+                        busy += time.time() - start
+                        start = time.time()
+                        if next_stage is not None:
+                            next_stage.queue.put(output)
+                        else:
+                            results.append(output)
+                        blocked += time.time() - start
+                        start = time.time()
+                    busy += time.time() - start
+                except BaseException:
+                    with self._lock:
+                        if self._error is None:
+                            self._error = sys.exc_info()
+
+            with self._lock:
+                stage.items += 1
+                stage.busy_seconds += busy
+                stage.starved_seconds += waited
+                stage.blocked_seconds += blocked
+                stage.queue_length_sum += stage.queue.qsize()
+
+        with self._lock:
+            stage.finished_workers += 1
+            last_worker = stage.finished_workers == stage.workers
+        if last_worker and next_stage is not None:
+            for worker in range(next_stage.workers):
+                next_stage.queue.put(_end)
+
+    ## Prints and records the occupancy of each stage.
+    # @param seconds The wall time of the pipeline.
+    def _report(self, seconds):
+        self.metrics.log("Pipeline ran for {:.3f} s:".format(seconds))
+        for stage in self.stages:
+            total = max(seconds * stage.workers, 1e-9)
+            mean_length = float(stage.queue_length_sum) / max(stage.items, 1)
+            self.metrics.log(" - {}: {} items, {} threads, {:5.1f}% busy, {:5.1f}% starved, {:5.1f}% blocked, "
+                "queue {:.1f}/{}".format(stage.name, stage.items, stage.workers, 100 * stage.busy_seconds / total,
+                100 * stage.starved_seconds / total, 100 * stage.blocked_seconds / total, mean_length, self.queue_size))
+            for name in ("items", "busy_seconds", "starved_seconds", "blocked_seconds"):
+                self.metrics.count("pipeline_{}_{}".format(stage.name, name), getattr(stage, name))
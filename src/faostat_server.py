@@ -0,0 +1,263 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_server.py
+#
+# This file contains a server loading the trade data once and answering requests for trade matrices,
+# production quantities, slices and tableviewer files over a Unix-domain socket (see faostat_client.py
+# for the client and the message format).
+
+from faostat_trade_data import FAOStatTradeData
+from faostat_metrics import Metrics
+from faostat_main import commodities, get_jobs
+from faostat_client import write_message, read_message
+# Numpy is used to send the arrays.
+import numpy as np
+# Modules needed to serve the clients, each from its own thread.
+import SocketServer, threading, time
+import os, os.path, sys
+import argparse
+
+## This class holds the trade data served by the server, and reloads the data files when they change.
+# Reloading builds a new FAOStatTradeData object from the country-level data of the unchanged files and the
+# new data of the changed ones, which then replaces the current one at once: requests being answered keep
+# using the previous object, so that they never see partially reloaded data.
+class TradeDataService:
+
+    # Attributes
+
+    ## The FAOStatTradeData object holding the data being served.
+    data_structure = None
+    ## Folder holding the regions, the country-to-region mapping and the XML files (see faostat_main.py).
+    data_dir = None
+    ## The (commodity, file_name) jobs loading the XML files (see FAOStatTradeData.load_data_parallel()).
+    jobs = None
+    ## Directory holding the cache of parsed XML files (None to disable the cache).
+    cache_dir = None
+    ## Metrics object printing the progress messages.
+    metrics = None
+    ## Dictionary holding the (size, modification time) of each file loaded, by path.
+    signatures = None
+
+    ## The constructor loads the data.
+    # @param data_dir Folder holding the regions, the country-to-region mapping and the XML files.
+    # @param commodities A list of commodities, each with a sub-folder of XML files in data_dir.
+    # @param cache_dir Directory where to cache the parsed XML files, or None.
+    # @param metrics A Metrics object.
+    def __init__(self, data_dir, commodities, cache_dir, metrics):
+        self.data_dir = data_dir
+        self.jobs = get_jobs(data_dir, commodities)
+        self.cache_dir = cache_dir
+        self.metrics = metrics
+        self._reload_lock = threading.Lock()
+
+        self.signatures = self._get_signatures()
+        data_structure = self._create_data_structure()
+        data_structure.load_data_parallel(self.jobs)
+        self.data_structure = data_structure
+
+    ## Returns the paths of the files the data is loaded from.
+    def _get_files(self):
+        return [os.path.join(self.data_dir, "regions.csv"), os.path.join(self.data_dir, "country_regions.csv")] + \
+            [file_name for commodity, file_name in self.jobs]
+
+    ## Returns the (size, modification time) of each file the data is loaded from (None for missing files).
+    def _get_signatures(self):
+        signatures = dict()
+        for file_name in self._get_files():
+            try:
+                stat = os.stat(file_name)
+                signatures[file_name] = (stat.st_size, stat.st_mtime)
+            except OSError:
+                signatures[file_name] = None
+        return signatures
+
+    ## Returns a new FAOStatTradeData object with the regions and the country-to-region mapping loaded.
+    def _create_data_structure(self):
+        data_structure = FAOStatTradeData(self.cache_dir, self.metrics)
+        data_structure.load_regions(os.path.join(self.data_dir, "regions.csv"))
+        data_structure.load_country_regions(os.path.join(self.data_dir, "country_regions.csv"))
+        return data_structure
+
+    ## Reads again the files which have changed since they were loaded. The other XML files are not parsed again,
+    # but their data is aggregated again if the regions or the country-to-region mapping have changed.
+    # If a file cannot be read, the current data is kept and a ValueError is raised.
+    # @return The list of files which have changed.
+    def reload(self):
+        with self._reload_lock:
+            signatures = self._get_signatures()
+            changed = [file_name for file_name in self._get_files() if signatures[file_name] != self.signatures[file_name]]
+            if not changed:
+                return []
+
+            self.metrics.log("Reloading {} changed files".format(len(changed)))
+            try:
+                data_structure = self._create_data_structure()
+                data_structure.country_records = list(self.data_structure.country_records)
+                data_structure.reload_files(changed)
+            except (SystemExit, EnvironmentError) as error:
+                raise ValueError("Cannot reload the data files: {}".format(error))
+            self.data_structure = data_structure
+            self.signatures = signatures
+            return changed
+
+## This class answers the requests of a client, until the client closes the connection.
+# Each request is answered by a method named after its command (see commands), which takes the FAOStatTradeData
+# object to use and the header of the request, and returns a (header, payload) tuple for the response.
+class FAOStatRequestHandler(SocketServer.StreamRequestHandler):
+
+    # Attributes
+
+    ## Commands answered by the handler.
+    commands = ("regions", "keys", "matrix", "production", "slice", "tableviewer", "reload")
+
+    ## Answers the requests of the client.
+    def handle(self):
+        while True:
+            try:
+                message = read_message(self.rfile)
+            except (EOFError, ValueError):
+                return
+            if message is None:
+                return
+
+            request = message[0]
+            command = request.get("command")
+            # The data structure may be replaced by a reload while the request is answered
+            data_structure = self.server.service.data_structure
+            try:
+                if command not in self.commands:
+                    raise ValueError("Unknown command: {}".format(command))
+                header, payload = getattr(self, "_handle_" + command)(data_structure, request)
+                header["status"] = "ok"
+            except KeyError as error:
+                header, payload = {"status": "error", "message": "No data for {}".format(error.args[0])}, b""
+            except (ValueError, TypeError) as error:
+                header, payload = {"status": "error", "message": str(error)}, b""
+            self.server.service.metrics.count("requests")
+            write_message(self.wfile, header, payload)
+
+    ## Returns the header and payload of a response holding an array.
+    # @param array A Numpy array.
+    @staticmethod
+    def _get_array_response(array):
+        array = np.ascontiguousarray(array)
+        return {"type": "array", "dtype": array.dtype.str, "shape": array.shape}, array.tostring()
+
+    ## Returns the header of a response holding a JSON result.
+    # @param result A value which can be saved as JSON.
+    @staticmethod
+    def _get_json_response(result):
+        return {"type": "json", "result": result}, b""
+
+    def _handle_regions(self, data_structure, request):
+        return self._get_json_response([data_structure.region_numbers_reverse[i] for i in range(len(data_structure.region_numbers))])
+
+    def _handle_keys(self, data_structure, request):
+        return self._get_json_response(sorted(data_structure.trade_matrices.keys()))
+
+    def _handle_matrix(self, data_structure, request):
+        return self._get_array_response(data_structure.trade_matrices[(int(request["year"]), request["commodity"])])
+
+    def _handle_production(self, data_structure, request):
+        return self._get_array_response(data_structure.productions[(int(request["year"]), request["commodity"])])
+
+    def _handle_slice(self, data_structure, request):
+        regions = dict()
+        for name in ("exporters", "importers"):
+            if request.get(name) is not None:
+                regions[name] = [data_structure.region_numbers[region] for region in request[name]]
+        years = request.get("years")
+        if years is not None:
+            years = [int(year) for year in years]
+        return self._get_array_response(data_structure.trade_matrices.get_slice(request.get("commodities"), years, **regions))
+
+    def _handle_tableviewer(self, data_structure, request):
+        year = int(request["year"])
+        sizes, regions_to_write = data_structure._get_region_sizes(year, request["commodity"], request.get("threshold", 0))
+        contents = data_structure._format_trade_matrix(year, request["commodity"], sizes, regions_to_write,
+                                                       request.get("with_production", False))
+        return {"type": "text"}, contents.encode('utf-8')
+
+    def _handle_reload(self, data_structure, request):
+        return self._get_json_response(self.server.service.reload())
+
+## This class serves the trade data over a Unix-domain socket, answering each client from its own thread.
+class FAOStatServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+
+    # Attributes
+
+    ## The threads answering the clients do not keep the server from exiting.
+    daemon_threads = True
+    ## The TradeDataService object holding the data.
+    service = None
+
+    ## The constructor binds the socket, replacing any socket left by a previous server.
+    # @param socket_path Path to the socket.
+    # @param service A TradeDataService object.
+    def __init__(self, socket_path, service):
+        self.service = service
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        SocketServer.UnixStreamServer.__init__(self, socket_path, FAOStatRequestHandler)
+
+## Checks the data files for changes at regular intervals, reloading the ones which have changed.
+# @param service A TradeDataService object.
+# @param interval The interval, in seconds.
+def _watch_files(service, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            service.reload()
+        except ValueError as error:
+            service.metrics.warn("WARNING! {}".format(error))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Loads faostat XML files once and serves the trade data over a Unix-domain socket.")
+    parser.add_argument("data_dir", help = "folder holding the regions, the country-to-region mapping and the XML files")
+    parser.add_argument("socket", help = "path of the socket to create")
+    parser.add_argument("--commodities", nargs = "+", default = commodities, help = "commodities to load (default: the ones of faostat_main.py)")
+    parser.add_argument("--cache-dir", help = "folder where parsed XML files are cached (default: <data_dir>/.cache)")
+    parser.add_argument("--no-cache", action = "store_true", help = "always parse the XML files")
+    parser.add_argument("--reload-interval", type = float, default = 0,
+                        help = "seconds between checks for changed data files (default: 0, only on reload requests)")
+    parser.add_argument("--verbosity", type = int, choices = (Metrics.QUIET, Metrics.PROGRESS, Metrics.DETAILS),
+                        default = Metrics.PROGRESS, help = "0: warnings only, 1: progress messages (default), 2: details")
+    args = parser.parse_args()
+
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = args.cache_dir or os.path.join(args.data_dir, ".cache")
+
+    metrics = Metrics(args.verbosity)
+    service = TradeDataService(args.data_dir, args.commodities, cache_dir, metrics)
+    server = FAOStatServer(args.socket, service)
+    if args.reload_interval > 0:
+        watcher = threading.Thread(target = _watch_files, args = (service, args.reload_interval))
+        watcher.daemon = True
+        watcher.start()
+
+    metrics.log("Serving {} trade matrices on {}".format(len(service.data_structure.trade_matrices), args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_synthetic_data.py
+#
+# This file contains a generator of synthetic data files shaped like the ones retrieved from the FAOStat website,
+# used to benchmark the program at scales not covered by the data/ folder (see faostat_benchmark.py).
+
+from faostat_name_codec import NameCodec
+# Numpy is used to draw the random quantities.
+import numpy as np
+import os, os.path
+import argparse
+# Module needed to save the description of the generated files.
+import json
+
+## This class writes a data folder laid out like data/: a regions file, a country-to-region mapping and,
+# for each commodity, UTF-16 encoded trade matrix XML files covering three years each and a production XML file.
+# Country names contain spaces, parentheses and non-ASCII characters, so that tags need to be decoded as in the
+# real files. Each production table is followed by a yield table, which the program is expected to ignore.
+# Trade matrix files may also hold import tables, reporting the flows as seen by the importers.
+class SyntheticDataGenerator:
+
+    # Attributes
+
+    ## Number of countries.
+    num_countries = None
+    ## Number of regions.
+    num_regions = None
+    ## List of years.
+    years = None
+    ## Number of commodities.
+    num_commodities = None
+    ## Fraction of the partner entries of a trade table holding a quantity (the other ones are empty tags).
+    density = None
+    ## Fraction of the partner entries of an import table holding a quantity (0 for no import tables).
+    import_density = None
+    ## Seed of the random number generator.
+    seed = None
+    ## Number of years in each trade matrix file.
+    years_per_file = 3
+
+    ## The constructor.
+    # @param num_countries Number of countries.
+    # @param num_regions Number of regions (at most the number of countries).
+    # @param years List of years.
+    # @param num_commodities Number of commodities.
+    # @param density Fraction of the partner entries of a trade table holding a quantity.
+    # @param seed Seed of the random number generator.
+    # @param import_density Fraction of the partner entries of an import table holding a quantity (0 for no import tables).
+    def __init__(self, num_countries = 250, num_regions = 40, years = range(2000, 2012), num_commodities = 3,
+                 density = 0.2, seed = 0, import_density = 0):
+        self.num_countries = num_countries
+        self.num_regions = min(num_regions, num_countries)
+        self.years = list(years)
+        self.num_commodities = num_commodities
+        self.density = density
+        self.import_density = import_density
+        self.seed = seed
+        self._codec = NameCodec()
+
+    ## Returns the name of a country.
+    # @param number The number of the country.
+    @staticmethod
+    def get_country_name(number):
+        if number % 3 == 0:
+            return u"C\u00f4te {:04d} (Rep. of)".format(number)
+        return u"Country {:04d}".format(number)
+
+    ## Returns the name of a region.
+    # @param number The number of the region.
+    @staticmethod
+    def get_region_name(number):
+        return u"Region {:03d}".format(number)
+
+    ## Returns the name of a commodity.
+    # @param number The number of the commodity.
+    @staticmethod
+    def get_commodity_name(number):
+        return u"Commodity{:02d}".format(number)
+
+    ## Writes the data folder.
+    # @param data_dir Path to the folder, created if needed.
+    # @return A dictionary describing the generated files (also saved to synthetic.json in the folder).
+    def generate(self, data_dir):
+        random = np.random.RandomState(self.seed)
+        try:
+            os.makedirs(data_dir)
+        except OSError:
+            pass
+
+        countries = [self.get_country_name(i) for i in range(self.num_countries)]
+        regions = [self.get_region_name(i) for i in range(self.num_regions)]
+        with open(os.path.join(data_dir, "regions.csv"), 'w') as f:
+            for number, region in enumerate(regions):
+                f.write(u"{}\t{}\n".format(region, 10 * number).encode('utf-8'))
+        with open(os.path.join(data_dir, "country_regions.csv"), 'w') as f:
+            for number, country in enumerate(countries):
+                f.write(u"{}\t{}\n".format(country, regions[number % self.num_regions]).encode('utf-8'))
+
+        description = {
+            "parameters": self.get_parameters(),
+            "regions_file": "regions.csv",
+            "country_regions_file": "country_regions.csv",
+            "commodities": [],
+            "trade_files": [],
+            "production_files": [],
+            "trade_entries": 0,
+            "trade_quantities": 0,
+            "production_entries": 0,
+        }
+
+        for commodity_number in range(self.num_commodities):
+            commodity = self.get_commodity_name(commodity_number)
+            description["commodities"].append(commodity)
+            commodity_dir = os.path.join(data_dir, commodity)
+            try:
+                os.makedirs(commodity_dir)
+            except OSError:
+                pass
+
+            for start in range(0, len(self.years), self.years_per_file):
+                years = self.years[start:start + self.years_per_file]
+                file_name = os.path.join(commodity, "TradeMatrix_{}-{}.xml".format(years[0], years[-1]))
+                entries, quantities = self._write_trade_file(os.path.join(data_dir, file_name), commodity, years, countries, random)
+                description["trade_files"].append([commodity, file_name])
+                description["trade_entries"] += entries
+                description["trade_quantities"] += quantities
+
+            file_name = os.path.join(commodity, "Production_{}-{}.xml".format(self.years[0], self.years[-1]))
+            description["production_entries"] += self._write_production_file(
+                os.path.join(data_dir, file_name), commodity, commodity_number, countries, random)
+            description["production_files"].append([commodity, file_name])
+
+        with open(os.path.join(data_dir, "synthetic.json"), 'w') as f:
+            json.dump(description, f, indent = 1, sort_keys = True)
+        return description
+
+    ## Returns the parameters of the generator, as a dictionary.
+    def get_parameters(self):
+        return {
+            "countries": self.num_countries,
+            "regions": self.num_regions,
+            "years": self.years,
+            "commodities": self.num_commodities,
+            "density": self.density,
+            "import_density": self.import_density,
+            "seed": self.seed,
+        }
+
+    ## Writes a trade matrix file holding the export tables (and the import tables if import_density is not 0)
+    # of every country for a set of years. Imports mirror the exports of the partners with a CIF/FOB-like
+    # markup of 0 to 20%, and also hold flows missing from the exports.
+    # @param file_name Path to the file.
+    # @param commodity The commodity.
+    # @param years The years covered by the file.
+    # @param countries The list of country names.
+    # @param random The random number generator.
+    # @return A (entries, quantities) tuple giving the number of partner entries of the export tables and the number
+    # of them holding a quantity.
+    def _write_trade_file(self, file_name, commodity, years, countries, random):
+        tags = [self._codec.encode(country) for country in countries]
+        lines = [u"<DocumentElement>"]
+        entries = quantities = 0
+
+        for year in years:
+            exports = []
+            for reporter in countries:
+                present = random.random_sample(len(tags)) < self.density
+                values = random.randint(1, 1000000, len(tags))
+                lines += self._format_trade_table(reporter, u"Export", year, commodity, tags, present, values)
+                exports.append(np.where(present, values, 0))
+                entries += len(tags)
+                quantities += int(present.sum())
+
+            if self.import_density > 0:
+                # Row i of the transposed matrix holds the exports to country i
+                imports = np.array(exports).T
+                for reporter, mirror in zip(countries, imports):
+                    present = random.random_sample(len(tags)) < self.import_density
+                    values = np.where(mirror > 0, mirror * (1 + 0.2 * random.random_sample(len(tags))),
+                                      random.randint(1, 1000000, len(tags))).astype(np.int)
+                    lines += self._format_trade_table(reporter, u"Import", year, commodity, tags, present, values)
+
+        lines.append(u"</DocumentElement>")
+        self._write_utf16(file_name, lines)
+        return entries, quantities
+
+    ## Returns the lines of a trade table.
+    # @param reporter The reporter country.
+    # @param element Either u"Export" or u"Import".
+    # @param year The year.
+    # @param commodity The commodity.
+    # @param tags The encoded names of the partner countries.
+    # @param present A boolean Numpy array telling which partner entries hold a quantity.
+    # @param values A Numpy array holding the quantity of each partner entry.
+    @staticmethod
+    def _format_trade_table(reporter, element, year, commodity, tags, present, values):
+        lines = [u"  <Table1>", u"    <reporter>{}</reporter>".format(reporter), u"    <element>{}</element>".format(element),
+                 u"    <years>{}</years>".format(year), u"    <items>{}</items>".format(commodity)]
+        for tag, is_present, value in zip(tags, present.tolist(), values.tolist()):
+            if is_present:
+                lines.append(u"    <{0}>{1}</{0}>".format(tag, value))
+            else:
+                lines.append(u"    <{} />".format(tag))
+        lines.append(u"  </Table1>")
+        return lines
+
+    ## Writes a production file holding the production and yield tables of every country.
+    # @param file_name Path to the file.
+    # @param commodity The commodity.
+    # @param commodity_number The number of the commodity.
+    # @param countries The list of country names.
+    # @param random The random number generator.
+    # @return The number of production entries.
+    def _write_production_file(self, file_name, commodity, commodity_number, countries, random):
+        # Tags cannot start with a digit, so the first digit of each year is encoded, as in the real files
+        year_tags = [u"_x{:04X}_{}".format(ord(unicode(year)[0]), unicode(year)[1:]) for year in self.years]
+        lines = [u"<DocumentElement>"]
+        entries = 0
+
+        for country_number, country in enumerate(countries):
+            for element, element_code, low, high in ((u"Production (tonnes)", 5510, 0, 10000000),
+                                                     (u"Yield (Hg/Ha)", 5419, 1000, 100000)):
+                lines += [u"  <Table1>", u"    <countries>{}</countries>".format(country),
+                          u"    <country_x0020_codes>{}</country_x0020_codes>".format(country_number),
+                          u"    <item>{}</item>".format(commodity),
+                          u"    <item_x0020_codes>{}</item_x0020_codes>".format(commodity_number),
+                          u"    <element>{}</element>".format(element),
+                          u"    <element_x0020_codes>{}</element_x0020_codes>".format(element_code)]
+                values = random.randint(low, high, len(year_tags))
+                for tag, value in zip(year_tags, values.tolist()):
+                    lines.append(u"    <{0}>{1}</{0}>".format(tag, value))
+                lines.append(u"  </Table1>")
+            entries += len(year_tags)
+
+        lines.append(u"</DocumentElement>")
+        self._write_utf16(file_name, lines)
+        return entries
+
+    ## Writes lines to a UTF-16 encoded file with a byte order mark and Windows line endings, like the real files.
+    # @param file_name Path to the file.
+    # @param lines A list of Unicode objects.
+    @staticmethod
+    def _write_utf16(file_name, lines):
+        with open(file_name, 'wb') as f:
+            f.write(u"\r\n".join(lines).encode('utf-16'))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Generates synthetic faostat XML files.")
+    parser.add_argument("data_dir", help = "folder where the files are written")
+    parser.add_argument("--countries", type = int, default = 250, help = "number of countries")
+    parser.add_argument("--regions", type = int, default = 40, help = "number of regions")
+    parser.add_argument("--first-year", type = int, default = 2000, help = "first year")
+    parser.add_argument("--years", type = int, default = 12, help = "number of years")
+    parser.add_argument("--commodities", type = int, default = 3, help = "number of commodities")
+    parser.add_argument("--density", type = float, default = 0.2, help = "fraction of partner entries holding a quantity")
+    parser.add_argument("--seed", type = int, default = 0, help = "seed of the random number generator")
+    parser.add_argument("--import-density", type = float, default = 0,
+                        help = "fraction of partner entries of the import tables holding a quantity (default: no import tables)")
+    args = parser.parse_args()
+
+    generator = SyntheticDataGenerator(args.countries, args.regions, range(args.first_year, args.first_year + args.years),
+                                       args.commodities, args.density, args.seed, args.import_density)
+    description = generator.generate(args.data_dir)
+    print("Generated {} trade entries and {} production entries in {}".format(
+        description["trade_entries"], description["production_entries"], args.data_dir))
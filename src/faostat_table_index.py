@@ -0,0 +1,204 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_table_index.py
+#
+# This file contains an index of the <Table1> elements of faostat XML trade matrices,
+# used to parse only the tables of given years and commodities.
+
+# Module required to parse the indexed tables.
+import xml.etree.ElementTree as etree
+# Module needed to unescape the fields of the tables.
+from xml.sax.saxutils import unescape
+# Modules needed to handle files and paths.
+import os, os.path
+# Module needed to scan the XML files without reading them into memory.
+import mmap
+# Module needed to read and write the index files.
+import json
+import re
+import argparse
+
+## This class records where each <Table1> element of a faostat XML trade matrix starts and ends,
+# as byte offsets into the file, together with its reporter, element, year and item.
+# The index is built by a single pass over the raw bytes of the file, without parsing it, and is saved next
+# to the file (with an ".index.json" suffix). It is rebuilt whenever the size or modification time of the file
+# no longer match the ones recorded in the index.
+#
+# The tables of given years and commodities can then be read and parsed on their own (see iter_tables()),
+# e.g. to load a single year of a file holding three.
+class TableIndex:
+
+    # Attributes
+
+    ## Version of the index format, to be increased whenever its layout changes.
+    version = 1
+    ## Fields of the tables recorded in the index, in the order of the entries of tables.
+    fields = ("reporter", "element", "years", "items")
+    ## Path to the XML file.
+    file_name = None
+    ## Encoding of the XML file, as detected from its byte order mark.
+    encoding = None
+    ## List of [start, end, reporter, element, year, item] entries, one per table in file order,
+    # where start and end are the byte offsets of the table (end excluded).
+    tables = None
+
+    ## The constructor loads the index of a file, building and saving it if needed.
+    # @param file_name Path to the XML file.
+    # @param save Boolean indicating whether to save a newly built index next to the file.
+    def __init__(self, file_name, save = True):
+        self.file_name = file_name
+        if not self._load():
+            self._build()
+            if save:
+                self._save()
+
+    ## Returns the path of the index of an XML file.
+    # @param file_name Path to the XML file.
+    @staticmethod
+    def get_index_path(file_name):
+        return file_name + ".index.json"
+
+    ## Loads the index saved next to the file, if it is up to date.
+    # @return Boolean indicating whether the index could be loaded.
+    def _load(self):
+        try:
+            with open(self.get_index_path(self.file_name), 'r') as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            return False
+
+        stat = os.stat(self.file_name)
+        if index.get("version") != self.version or index["size"] != stat.st_size or index["mtime"] != stat.st_mtime:
+            return False
+        self.encoding = index["encoding"]
+        self.tables = index["tables"]
+        return True
+
+    ## Saves the index next to the file. Failures (e.g. read-only folders) are ignored, the index being rebuilt next time.
+    def _save(self):
+        stat = os.stat(self.file_name)
+        index = {
+            "version": self.version,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "encoding": self.encoding,
+            "tables": self.tables,
+        }
+        path = self.get_index_path(self.file_name)
+        try:
+            with open(path + ".tmp", 'w') as f:
+                json.dump(index, f)
+            os.rename(path + ".tmp", path)
+        except (IOError, OSError):
+            pass
+
+    ## Scans the raw bytes of the file for the <Table1> elements.
+    def _build(self):
+        self.tables = []
+        with open(self.file_name, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                self.encoding = "utf-8"
+                return
+            data = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            try:
+                self.encoding, alignment = self._detect_encoding(data[:4])
+                start_tag = u"<Table1>".encode(self.encoding)
+                end_tag = u"</Table1>".encode(self.encoding)
+
+                start = data.find(start_tag)
+                while start >= 0:
+                    # Matches across two characters of a UTF-16 file are skipped
+                    if start % alignment != 0:
+                        start = data.find(start_tag, start + 1)
+                        continue
+                    end = data.find(end_tag, start)
+                    while end >= 0 and end % alignment != 0:
+                        end = data.find(end_tag, end + 1)
+                    if end < 0:
+                        break
+                    end += len(end_tag)
+                    self.tables.append([start, end] + self._get_fields(data[start:end]))
+                    start = data.find(start_tag, end)
+            finally:
+                data.close()
+
+    ## Detects the encoding of an XML file from its byte order mark.
+    # @param head The first bytes of the file.
+    # @return An (encoding, alignment) tuple, where alignment is the size of the code units of the encoding.
+    @staticmethod
+    def _detect_encoding(head):
+        if head.startswith(b"\xff\xfe"):
+            return "utf-16-le", 2
+        if head.startswith(b"\xfe\xff"):
+            return "utf-16-be", 2
+        return "utf-8", 1
+
+    ## Extracts the indexed fields of a table, which come before the partner entries.
+    # @param block The raw bytes of the table.
+    # @return A [reporter, element, year, item] list, holding None for missing fields (the year being an integer).
+    def _get_fields(self, block):
+        # Only the beginning of the table needs to be decoded, unless its fields are unusually long
+        for size in (1024, len(block)):
+            text = block[:size - size % 2].decode(self.encoding, "ignore")
+            values = [re.search(u"<{0}>(.*?)</{0}>".format(field), text, re.DOTALL) for field in self.fields]
+            if all(values) or size >= len(block):
+                break
+        values = [unescape(value.group(1).strip()) if value else None for value in values]
+        if values[2] is not None:
+            values[2] = int(values[2])
+        return values
+
+    ## Returns the entries of the tables matching given years and commodities.
+    # @param years A list of years, or None for all years.
+    # @param commodities A list of commodities, or None for all commodities.
+    # @param elements A list of elements (e.g. "Export"), or None for all elements.
+    # @return A list of [start, end, reporter, element, year, item] entries, in file order.
+    def select(self, years = None, commodities = None, elements = None):
+        return [table for table in self.tables
+                if (years is None or table[4] in years)
+                and (commodities is None or table[5] in commodities)
+                and (elements is None or table[3] in elements)]
+
+    ## Iterates over the <Table1> elements matching given years and commodities, reading only their bytes.
+    # @param years A list of years, or None for all years.
+    # @param commodities A list of commodities, or None for all commodities.
+    # @param elements A list of elements (e.g. "Export"), or None for all elements.
+    def iter_tables(self, years = None, commodities = None, elements = None):
+        with open(self.file_name, 'rb') as f:
+            for start, end, reporter, element, year, item in self.select(years, commodities, elements):
+                f.seek(start)
+                yield etree.fromstring(f.read(end - start).decode(self.encoding).encode('utf-8'))
+
+    ## Returns the years, commodities and elements found in the file.
+    # @return A (years, commodities, elements) tuple of sorted lists.
+    def get_contents(self):
+        return tuple(sorted(set(table[column] for table in self.tables)) for column in (4, 5, 3))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description = "Builds the <Table1> index of faostat XML trade matrices.")
+    parser.add_argument("files", nargs = "+", help = "faostat XML trade matrices")
+    args = parser.parse_args()
+
+    for file_name in args.files:
+        index = TableIndex(file_name)
+        years, commodities, elements = index.get_contents()
+        print("{}: {} tables, years {}, commodities {}, elements {}".format(
+            file_name, len(index.tables), ", ".join(str(year) for year in years),
+            ", ".join(commodities), ", ".join(elements)))
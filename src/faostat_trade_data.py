@@ -26,10 +26,41 @@ import xml.etree.ElementTree as etree
 import sys
 # Numpy provides handy matrix support.
 import numpy as np
-# Module needed for advanced text pattern matching and replacement.
-import re
+# Codec turning names into Circos-compatible names and back.
+from faostat_name_codec import NameCodec
 # Module needed for CSV file parsing
 import csv
+# Module needed to parse several files at once
+import multiprocessing
+# Pool of threads used to write several files at once
+from multiprocessing.pool import ThreadPool
+# Module needed to build file paths and create folders
+import os, os.path
+# Module needed to read and write the header of tensor stores
+import json
+# Modules needed to spill the records of bulk files to a temporary folder, removed on exit
+import tempfile, shutil, atexit
+# Module needed to read the spilled records back when they are needed
+import functools
+# Dictionary preserving the insertion order of its keys
+from collections import OrderedDict
+# On-disk cache of parsed XML files
+from faostat_cache import ParsedFileCache
+# Reader of the bulk CSV files of FAOStat
+from faostat_bulk_csv import BulkCSVReader
+# Index of the tables of XML files, used to load parts of them
+from faostat_table_index import TableIndex
+# Dense storage of the trade matrices and production quantities
+from faostat_trade_tensor import TradeTensor, ProductionTensor
+# Module needed to query the largest flows
+from faostat_flow_index import FlowIndex
+# Module needed to compute the deltas, moving averages and shares of the trade matrices
+from faostat_derived_series import DerivedSeries
+# Progress messages, timers and counters
+from faostat_metrics import Metrics
+
+## Codec shared by FAOStatTradeData.name_encode() and FAOStatTradeData.name_decode().
+name_codec = NameCodec()
 
 ## This class holds trade matrices and production quantities.
 # Data is loaded from XML files retrieved from the faostat website
@@ -39,102 +70,232 @@ class FAOStatTradeData:
 
     # Attributes
 
-    ## Dictionary of trade matrices (stored as square 2D Numpy arrays) indexed by (year, comodity) tuples.
+    ## Trade matrices (square 2D Numpy arrays) indexed by (year, comodity) tuples.
+    # They are views onto a single 4D array (see faostat_trade_tensor.py).
     trade_matrices = None
-    ## Dictionary indexed by (year, comodity) holding dictionaries of production quantities indexed by region name
+    ## Boolean indicating whether the import tables of the trade matrix files are kept in the country-level records,
+    # for reconcile(). They are left out otherwise, so that loads which do not reconcile neither parse nor keep them.
+    with_imports = None
+    ## Index of the flows of trade_matrices sorted by quantity (see faostat_flow_index.py and get_top_flows()).
+    # It is updated when files are loaded, and replaced along with trade_matrices.
+    flow_index = None
+    ## Series derived from the trade matrices, computed for all years and commodities at once and cached
+    # (see faostat_derived_series.py). The cache is cleared when files are loaded.
+    derived_series = None
+    ## Production quantities (1D Numpy arrays indexed by region number) indexed by (year, comodity) tuples.
+    # They are views onto a single 3D array lined up with the trade matrices (see faostat_trade_tensor.py).
     productions = None
+    ## Version of the layout of tensor stores (see save_store()), to be increased whenever it changes.
+    store_version = 2
+    ## Policies combining the quantities reported by the exporters and by the importers (see reconcile()).
+    reconciliation_policies = ("max", "exporter-first", "mean", "cif-fob")
     ## Dictionary holding the country-to-region mapping
     country_regions = None
     ## Dictionary holding the region-to-number mapping
     region_numbers = None
     ## Dictionary holding the number-to-region mapping
     region_numbers_reverse = None
+    ## Directory holding the cache of parsed XML files (None to disable the cache)
+    cache_dir = None
+    ## List of (file_name, file_type, records, threshold) tuples holding the country-level data of every loaded file,
+    # from which the region data can be rebuilt (see reaggregate()). The records of bulk files may have been spilled
+    # to disk, records then being a function reading them back (see _get_records()).
+    country_records = None
+    ## Folder where the records of bulk files are spilled when there is no cache directory (created when first needed).
+    spill_dir = None
+    ## Dictionary holding the region number of country names, both in raw and encoded form
+    # (-1 for unknown countries). It is built by load_country_regions() and completed when unknown names are met.
+    tag_regions = None
+    ## Dictionary counting the lookups in tag_regions: "hits" (names found) and "misses" (names added).
+    tag_lookup_counts = None
+    ## Metrics object printing the progress messages and measuring each stage (see faostat_metrics.py).
+    metrics = None
 
     ## The constructor initiliazes the country list and indices (alphabetically for now).
-    def __init__(self):
-        self.trade_matrices = dict()
-        self.productions = dict()
+    # @param cache_dir Directory where to cache the data parsed from XML files (see faostat_cache.py), or None.
+    # @param metrics A Metrics object, or None to create one printing all messages.
+    # @param with_imports Boolean indicating whether to keep the import tables as well (see reconcile()).
+    def __init__(self, cache_dir = None, metrics = None, with_imports = False):
+        self.cache_dir = cache_dir
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.with_imports = with_imports
+        self.trade_matrices = TradeTensor(0)
+        self.productions = ProductionTensor(0)
+        self.flow_index = FlowIndex(self.trade_matrices)
+        self.derived_series = DerivedSeries(self)
         self.region_numbers = dict()
         self.region_numbers_reverse = dict()
         self.country_regions = dict()
-        self.productions = dict()
+        self.country_records = []
+        self.tag_regions = dict()
+        self.tag_lookup_counts = {"hits": 0, "misses": 0}
 
     ## This function loads the countries from a CSV file
     # @param file_name A simple two-column, tab-delmited CSV file containing a list of countries with their corresponding region (the region names must match the names given to load_regions().
     def load_country_regions(self, file_name):
-        print("Loading countries to regions mapping from file: {}".format(file_name))
+        self.metrics.log("Loading countries to regions mapping from file: {}".format(file_name))
 
-        with open(file_name, 'rb') as f:
-            reader = csv.reader(f, delimiter='\t')
-            count = 0
-            for row in reader:
-                country_name = self._fix_name(row[0].decode('utf-8'))
-                region_name = self._fix_name(row[1])
-                if region_name not in self.region_numbers.keys():
-                    sys.exit("ERROR: Country {} assigned to region {} which hasn't been loaded"
-                        .format(country_name, region_name))
-                self.country_regions[country_name] = region_name
-                count = count + 1
+        with self.metrics.stage("load_country_regions", file_name) as stage:
+            with open(file_name, 'rb') as f:
+                reader = csv.reader(f, delimiter='\t')
+                count = 0
+                for row in reader:
+                    country_name = self._fix_name(row[0].decode('utf-8'))
+                    region_name = self._fix_name(row[1])
+                    if region_name not in self.region_numbers.keys():
+                        sys.exit("ERROR: Country {} assigned to region {} which hasn't been loaded"
+                            .format(country_name, region_name))
+                    self.country_regions[country_name] = region_name
+                    count = count + 1
+
+            self._build_tag_regions()
+            stage["elements"] = count
+        self.metrics.log(" - Loaded {} countries!".format(count))
 
-        print(" - Loaded {} countries!".format(count))
+    ## Builds the table giving the region number of each country name found in the XML files,
+    # either in raw form (e.g. reporter names) or encoded form (e.g. partner tags).
+    def _build_tag_regions(self):
+        self.tag_regions = dict()
+        for country_name, region_name in self.country_regions.items():
+            region_number = self.region_numbers[region_name]
+            self.tag_regions[country_name] = region_number
+            self.tag_regions[self.name_decode(country_name)] = region_number
 
     ## This function loads the regions (visible on the diagram) from a CSV file
     # @param file_name A simple two-column, tab-delmited CSV file containing a list of regions and numbers used for ordering (floats ok)
     def load_regions(self, file_name):
-        print("Loading regions from file: {}".format(file_name))
+        self.metrics.log("Loading regions from file: {}".format(file_name))
+
+        with self.metrics.stage("load_regions", file_name) as stage:
+            region_numbers = dict()
+            count = 0
 
-        region_numbers = dict()
-        count = 0
+            with open(file_name, 'rb') as f:
+                reader = csv.reader(f, delimiter='\t')
+                for row in reader:
+                    region_name = self._fix_name(row[0])
+                    region_number = float(row[1])
+                    if region_name in region_numbers.keys():
+                        sys.exit("ERROR: Region {} cannot be loaded a second time!".format(region_name))
+                    region_numbers[region_name] = region_number
+                    count = count + 1
 
-        with open(file_name, 'rb') as f:
-            reader = csv.reader(f, delimiter='\t')
-            for row in reader:
-                region_name = self._fix_name(row[0])
-                region_number = float(row[1])
-                if region_name in region_numbers.keys():
-                    sys.exit("ERROR: Region {} cannot be loaded a second time!".format(region_name))
-                region_numbers[region_name] = region_number
-                count = count + 1
+            region_list = sorted(region_numbers.keys(), key = region_numbers.get)
+            self.region_numbers = dict(zip(region_list, range(count)))
+            self.region_numbers_reverse = dict(zip(range(count), region_list))
+            self.trade_matrices = TradeTensor(count)
+            self.productions = ProductionTensor(count)
+            self._build_tag_regions()
+            stage["elements"] = count
 
-        region_list = sorted(region_numbers.keys(), key = region_numbers.get)
-        self.region_numbers = dict(zip(region_list, range(count)))
-        self.region_numbers_reverse = dict(zip(range(count), region_list))
+        self.metrics.log(" - Loaded {} regions!".format(count))
 
-        print(" - Loaded {} regions!".format(count))
+    ## Iterates over the <Table1> elements of a faostat XML file.
+    # In streaming mode, the file is parsed incrementally: each <Table1> element is
+    # yielded as soon as its closing tag has been read and is freed once the caller
+    # is done with it, so that memory usage does not grow with the size of the file.
+    # @param file_name A faostat XML file.
+    # @param streaming Boolean indicating whether to parse the file incrementally instead of loading the whole tree.
+    @staticmethod
+    def _iter_tables(file_name, streaming = True):
+        if not streaming:
+            for table in etree.parse(file_name).getroot():
+                yield table
+            return
+
+        root = None
+        depth = 0
+        for event, element in etree.iterparse(file_name, events = ("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+                depth += 1
+                continue
+
+            depth -= 1
+            # Only the direct children of the <DocumentElement> root are tables
+            if depth == 1:
+                yield element
+                # Drop the table (and any whitespace) we just handled
+                root.clear()
 
     ## Loads trade data from a faostat XML file into the class.
     # Years and commodities are automatically detected and added.
     # @param file_name A faostat XML file holding a trade matrix.
     # @param threshold A lower bound value below which trade quantities are ignored
-    def load_trade_data(self, file_name, threshold = 0):
-        print("Loading trade data from file: {}".format(file_name))
-        data_set = etree.parse(file_name).getroot()
-        num_regions = len(self.region_numbers)
-        count = dict(zip(self.region_numbers.keys(), [0] * num_regions))
-        total_count = 0
+    # @param streaming Boolean indicating whether to parse the file incrementally (see _iter_tables()).
+    def load_trade_data(self, file_name, threshold = 0, streaming = True):
+        self.metrics.log("Loading trade data from file: {}".format(file_name))
+        file_type, records = self._read_records(file_name, "trade", streaming)
+        self.country_records.append((file_name, file_type, records, threshold))
+        with self.metrics.stage("aggregate", file_name) as stage:
+            parsed = self._aggregate_trade_records(records, threshold)
+            stage["elements"] = len(records["flow_quantity"])
+        self._merge_trade_data(parsed, file_name = file_name)
+
+    ## Loads the trade data of given years and commodities from a faostat XML file into the class.
+    # Only the export tables of these years and commodities (and their import tables if with_imports is True)
+    # are read and parsed, using an index of the tables of the file, which is built on the first call
+    # and saved next to the file (see faostat_table_index.py).
+    # The parsed-file cache is not used, since it holds whole files.
+    # @param file_name A faostat XML file holding a trade matrix.
+    # @param years A list of years, or None for all years.
+    # @param commodities A list of commodities, or None for all commodities.
+    # @param threshold A lower bound value below which trade quantities are ignored
+    def load_trade_data_lazy(self, file_name, years = None, commodities = None, threshold = 0):
+        self.metrics.log("Loading trade data from file: {}".format(file_name))
+        with self.metrics.stage("parse", file_name) as stage:
+            index = TableIndex(file_name)
+            elements = ("Export", "Import") if self.with_imports else ("Export",)
+            records = self._get_trade_records(index.iter_tables(years, commodities, elements))
+            stage["elements"] = len(records["flow_quantity"])
+            stage["tables"] = len(records["table_year"])
+        self.country_records.append((file_name, "trade", records, threshold))
+        with self.metrics.stage("aggregate", file_name) as stage:
+            parsed = self._aggregate_trade_records(records, threshold)
+            stage["elements"] = len(records["flow_quantity"])
+        self._merge_trade_data(parsed, file_name = file_name)
+
+    ## Reads the country-level export quantities of a faostat XML trade matrix.
+    # The records do not depend on the regions, so that they can be cached (see faostat_cache.py).
+    # @param file_name A faostat XML file holding a trade matrix.
+    # @param streaming Boolean indicating whether to parse the file incrementally (see _iter_tables()).
+    # @return A dictionary of Numpy arrays (see _get_trade_records()).
+    def _read_trade_records(self, file_name, streaming = True):
+        return self._get_trade_records(self._iter_tables(file_name, streaming))
+
+    ## Reads the country-level export quantities of <Table1> elements of a faostat XML trade matrix,
+    # along with the import quantities if with_imports is True.
+    # @param tables_to_read An iterable over the <Table1> elements.
+    # @return A dictionary of Numpy arrays: "names" (encoded country names), "name_occurrences" (number of
+    # partner entries per name), "commodities", one "table_*" entry per table (reporter, year, commodity and
+    # whether it is an import table) and one "flow_*" entry per non-empty partner entry (table, partner and quantity).
+    def _get_trade_records(self, tables_to_read):
+        names = OrderedDict()
+        occurrences = []
+        commodities = OrderedDict()
+        tables = ([], [], [], [])
+        flows = ([], [], [])
+        # Name number of each partner tag, so that each tag is only encoded once
+        tag_numbers = dict()
 
         # Loop over all <Table1> elements in the tree.
         # Each of these elements represents one country.
-        for table in data_set:
-            # We only look at exports, so ignore imports...
-            trade_type = table.find("element").text
-            if trade_type == "Import":
+        for table in tables_to_read:
+            # Import tables are kept apart, as they are only used to reconcile the trade matrices (see reconcile())
+            is_import = table.find("element").text == "Import"
+            if is_import and not self.with_imports:
                 continue
 
             # See what this table deals with
             country_name = self._fix_name(table.find("reporter").text.strip())
             year = int(table.find("years").text)
             commodity = table.find("items").text
-            region = self.country_regions[country_name]
-            region_number = self.region_numbers[region]
-
-            # We look if there's already a matrix for that commodity/year combination
-            if (year, commodity) not in self.trade_matrices.keys():
-                print(" - Creating an empty matrix for commodity {} for year {}!".format(commodity, year))
-                matrix = np.zeros([num_regions, num_regions], dtype = np.int)
-                self.trade_matrices[(year,commodity)] = matrix
-
-            matrix = self.trade_matrices[(year,commodity)]
+            table_number = len(tables[0])
+            tables[0].append(self._intern_name(names, occurrences, country_name, 0))
+            tables[1].append(year)
+            tables[2].append(commodities.setdefault(commodity, len(commodities)))
+            tables[3].append(is_import)
 
             # Loop over all partner countries in the <Table1> element
             for entry in table:
@@ -142,36 +303,340 @@ class FAOStatTradeData:
                 if entry.tag in ("reporter", "years", "items", "element"):
                     continue
 
-                partner_country_name = self._fix_name(entry.tag)
-                try:
-                    partner_region = self.country_regions[partner_country_name]
-                except KeyError:
-                    print("WARNING! Unknown country: {}".format(self.name_decode(partner_country_name)))
-                    continue
-
-                partner_region_number = self.region_numbers[partner_region]
+                partner_number = tag_numbers.get(entry.tag)
+                if partner_number is None:
+                    partner_number = self._intern_name(names, occurrences, self._fix_name(entry.tag), 0)
+                    tag_numbers[entry.tag] = partner_number
+                occurrences[partner_number] += 1
                 quantity = entry.text
 
-                if quantity is not None and region != partner_region and int(quantity) > threshold:
-                    matrix[region_number, partner_region_number] += int(quantity)
-                    count[region] += 1
-                    total_count += 1
+                if quantity is not None:
+                    flows[0].append(table_number)
+                    flows[1].append(partner_number)
+                    flows[2].append(int(quantity))
+
+        return {
+            "names": np.array(list(names), dtype = unicode),
+            "name_occurrences": np.array(occurrences, dtype = np.int),
+            "commodities": np.array(list(commodities), dtype = unicode),
+            "table_reporter": np.array(tables[0], dtype = np.int),
+            "table_year": np.array(tables[1], dtype = np.int),
+            "table_commodity": np.array(tables[2], dtype = np.int),
+            "table_import": np.array(tables[3], dtype = bool),
+            "flow_table": np.array(flows[0], dtype = np.int),
+            "flow_partner": np.array(flows[1], dtype = np.int),
+            "flow_quantity": np.array(flows[2], dtype = np.int),
+        }
+
+    ## Aggregates country-level export quantities into region trade matrices.
+    # For each commodity/year combination, the country-level flows form a sparse matrix F and the
+    # region matrix is A.T * F * A, where A is the country-to-region aggregation matrix
+    # (see _get_name_regions()). Flows between countries of the same region, flows involving
+    # unknown partner countries and quantities not above the threshold are left out.
+    # Import tables are left out: they are only used by reconcile().
+    # @param records A dictionary of arrays returned by _read_trade_records().
+    # @param threshold A lower bound value below which trade quantities are ignored
+    # @return A (matrices, count, total_count, warnings) tuple, where matrices is an ordered dictionary
+    # of trade matrices indexed by (year, commodity) in the order they were found in the file.
+    def _aggregate_trade_records(self, records, threshold = 0):
+        num_regions = len(self.region_numbers)
+        names = records["names"]
+        warnings = []
+
+        # Aggregation matrix A, stored as the region number of each name (-1 for unknown countries)
+        name_regions = self._get_name_regions(names)
+        occurrences = records["name_occurrences"]
+        for i in np.flatnonzero((name_regions < 0) & (occurrences > 0)):
+            warnings.append("WARNING! Unknown country: {} ({} entries ignored)".format(self.name_decode(names[i]), occurrences[i]))
+
+        # Reporters must be known
+        table_regions = name_regions[records["table_reporter"]]
+        if np.any(table_regions < 0):
+            sys.exit("ERROR: Unknown reporter country {}".format(
+                self.name_decode(names[records["table_reporter"][table_regions < 0][0]])))
+
+        # Non-zero entries of F, along with the non-zero column of the rows of A they are multiplied with
+        flow_table = records["flow_table"]
+        reporters = table_regions[flow_table]
+        partners = name_regions[records["flow_partner"]]
+        is_import = records["table_import"]
+
+        matrices, selected = self._aggregate_trade_flows(records, ~is_import, reporters, partners, threshold)
+        region_counts = np.bincount(reporters[selected], minlength = num_regions)
+        count = dict((region, int(region_counts[i])) for region, i in self.region_numbers.items())
+
+        return matrices, count, int(selected.sum()), warnings
+
+    ## Aggregates the flows of some of the tables of the country-level records into region trade matrices
+    # (see _aggregate_trade_records()).
+    # @param records A dictionary of arrays returned by _read_trade_records().
+    # @param table_mask A boolean Numpy array telling which tables to aggregate.
+    # @param exporters The region number of the exporter of each flow (-1 for unknown countries).
+    # @param importers The region number of the importer of each flow (-1 for unknown countries).
+    # @param threshold A lower bound value below which trade quantities are ignored
+    # @return A (matrices, selected) tuple, where matrices is an ordered dictionary of trade matrices indexed by
+    # (year, commodity) and selected a boolean Numpy array telling which flows were added to the matrices.
+    def _aggregate_trade_flows(self, records, table_mask, exporters, importers, threshold):
+        num_regions = len(self.region_numbers)
+        commodities = records["commodities"]
+
+        # Number the commodity/year combinations in the order in which they appear in the file
+        keys = OrderedDict()
+        table_keys = np.full(len(table_mask), -1, dtype = np.int)
+        table_keys[table_mask] = [keys.setdefault((int(year), commodities[commodity]), len(keys))
+            for year, commodity in zip(records["table_year"][table_mask], records["table_commodity"][table_mask])]
+
+        flow_table = records["flow_table"]
+        quantities = records["flow_quantity"]
+        selected = table_mask[flow_table] & (exporters >= 0) & (importers >= 0) & (quantities > threshold)
+
+        # Since each row of A holds a single 1, each entry of F ends up in one cell of A.T * F * A.
+        # Flows within a region all end up on the diagonal, which is dropped.
+        selected &= exporters != importers
+        stack = np.zeros([len(keys), num_regions, num_regions], dtype = np.int)
+        np.add.at(stack, (table_keys[flow_table][selected], exporters[selected], importers[selected]), quantities[selected])
+        return OrderedDict((key, stack[i]) for key, i in keys.items()), selected
+
+    ## Adds the result of _aggregate_trade_records() to the trade matrices of the class.
+    # @param parsed A (matrices, count, total_count, warnings) tuple returned by _aggregate_trade_records().
+    # @param verbose Boolean indicating whether to print the warnings and the number of exports per region.
+    # @param file_name The file the data comes from, if any, to which the warnings and measurements are attributed.
+    def _merge_trade_data(self, parsed, verbose = True, file_name = None):
+        matrices, count, total_count, warnings = parsed
+
+        if verbose:
+            for warning in warnings:
+                self.metrics.warn(warning, file_name)
+
+        with self.metrics.stage("merge", file_name) as stage:
+            for key, matrix in matrices.items():
+                # We look if there's already a matrix for that commodity/year combination
+                if key not in self.trade_matrices:
+                    if verbose:
+                        self.metrics.log(" - Creating an empty matrix for commodity {} for year {}!".format(key[1], key[0]), Metrics.DETAILS)
+                    self.trade_matrices[key] = matrix
+                else:
+                    self.trade_matrices[key] += matrix
+            self.flow_index.invalidate(matrices.keys())
+            self.derived_series.clear()
+            stage["elements"] = total_count
 
-        print(" - Loaded {} export quantities:".format(total_count))
-        for key in sorted(count.keys()):
-            print ("   - {}: {} exports".format(self.name_decode(key), count[key]))
+        if verbose:
+            self.metrics.log(" - Loaded {} export quantities:".format(total_count))
+            for key in sorted(count.keys()):
+                self.metrics.log("   - {}: {} exports".format(self.name_decode(key), count[key]), Metrics.DETAILS)
+
+    ## Loads trade and production data from a FAOStat bulk CSV file (normalized layout) into the class.
+    # The file, or each CSV file of a zip archive, is read chunk by chunk without being extracted (see faostat_bulk_csv.py),
+    # and each chunk is turned into country-level records and aggregated like the records of XML files
+    # (see _aggregate_trade_records() and _aggregate_production_records()), so that the whole file is never held in memory.
+    # Trade files provide the "Export Quantity" rows (and the "Import Quantity" rows if with_imports is True),
+    # production files the "Production" rows. Rows of the FAOStat aggregates (area codes from 5000) are skipped.
+    # The country-level records of each chunk are kept like the ones of XML files, for reaggregate() and reconcile():
+    # in memory if with_imports is True, since reconcile() reads them all, and otherwise spilled to the cache directory
+    # (or to spill_dir), from which they are only read back when needed.
+    # @param file_name Path to a zip archive holding CSV files, or to a CSV file.
+    # @param threshold A lower bound value below which trade quantities are ignored
+    # @param commodities A list of commodities (items) to load, or None for all commodities.
+    # @param years A list of years to load, or None for all years.
+    # @param chunk_size Number of rows per chunk.
+    # @param encoding Encoding of the file, or None to detect it.
+    def load_bulk_data(self, file_name, threshold = 0, commodities = None, years = None, chunk_size = 20000, encoding = None):
+        self.metrics.log("Loading bulk data from file: {}".format(file_name))
+        matrices, productions = OrderedDict(), OrderedDict()
+        trade_counts, production_counts = dict(), dict()
+        trade_total = production_total = 0
+        # Number of partner entries of the unknown countries, reported once for the whole file
+        unknown_names = OrderedDict()
+        # Encoded form of the country names, so that each name is only encoded once
+        encoded_names = dict()
+        spill_cache = None if self.with_imports else ParsedFileCache(self._get_spill_dir())
+
+        with self.metrics.stage("parse", file_name) as stage:
+            for file_type, columns in BulkCSVReader(file_name, chunk_size, encoding).iter_chunks():
+                stage["elements"] += len(columns["value"])
+                if file_type == "trade":
+                    records = self._get_bulk_trade_records(columns, commodities, years, encoded_names)
+                    kept = self._keep_bulk_records(spill_cache, file_name, len(self.country_records), records)
+                    self.country_records.append((file_name, file_type, kept, threshold))
+                    chunk_matrices, count, total_count, warnings = self._aggregate_trade_records(records, threshold)
+                    self._add_arrays(matrices, chunk_matrices)
+                    self._add_arrays(trade_counts, count)
+                    trade_total += total_count
+                    for name, occurrences in zip(records["names"], records["name_occurrences"]):
+                        if occurrences > 0 and self.tag_regions[name] < 0:
+                            unknown_names[name] = unknown_names.get(name, 0) + occurrences
+                else:
+                    records = self._get_bulk_production_records(columns, commodities, years, encoded_names)
+                    kept = self._keep_bulk_records(spill_cache, file_name, len(self.country_records), records)
+                    self.country_records.append((file_name, file_type, kept, 0))
+                    chunk_productions, count, total_count = self._aggregate_production_records(records)
+                    self._add_arrays(productions, chunk_productions)
+                    self._add_arrays(production_counts, count)
+                    production_total += total_count
+
+        if trade_counts:
+            warnings = ["WARNING! Unknown country: {} ({} entries ignored)".format(self.name_decode(name), occurrences)
+                        for name, occurrences in unknown_names.items()]
+            self._merge_trade_data((matrices, trade_counts, trade_total, warnings), file_name = file_name)
+        if production_counts:
+            self._merge_production_data((productions, production_counts, production_total), file_name = file_name)
+
+    ## Returns what to keep in country_records of the records of a chunk of a bulk file.
+    # @param cache The ParsedFileCache to spill the records to, or None to keep them in memory.
+    # @param file_name Path to the bulk file.
+    # @param number A number telling the chunk apart from the others spilled by the class (e.g. the index of its entry).
+    # @param records A dictionary of Numpy arrays.
+    # @return The records, or a function reading them back from the cache.
+    @staticmethod
+    def _keep_bulk_records(cache, file_name, number, records):
+        if cache is None:
+            return records
+        cache.store_chunk(file_name, number, records)
+        return functools.partial(cache.load_chunk, file_name, number)
+
+    ## Returns the folder where the records of bulk files are spilled: the cache directory, or a temporary
+    # folder (see spill_dir) if there is none.
+    def _get_spill_dir(self):
+        if self.cache_dir is not None:
+            return self.cache_dir
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix = "faostat-")
+            atexit.register(shutil.rmtree, self.spill_dir, True)
+        return self.spill_dir
+
+    ## Returns the records of an entry of country_records, reading them back from disk if they were spilled.
+    # @param records The records of the entry.
+    # @return A dictionary of Numpy arrays.
+    @staticmethod
+    def _get_records(records):
+        return records() if callable(records) else records
+
+    ## Adds the values of a dictionary to the values of another one, in place.
+    # @param totals The dictionary holding the totals, whose new keys are added in the order of values.
+    # @param values A dictionary of numbers or Numpy arrays.
+    @staticmethod
+    def _add_arrays(totals, values):
+        for key, value in values.items():
+            if key in totals:
+                totals[key] = totals[key] + value
+            else:
+                totals[key] = value
+
+    ## Selects the rows of a chunk of a bulk CSV file to load.
+    # @param columns A dictionary of column arrays (see BulkCSVReader.iter_chunks()).
+    # @param elements The elements to load.
+    # @param commodities A list of commodities to load, or None for all commodities.
+    # @param years A list of years to load, or None for all years.
+    # @param code_columns The columns holding area codes, which must not be FAOStat aggregates.
+    # @return A boolean Numpy array telling which rows to load.
+    @staticmethod
+    def _select_bulk_rows(columns, elements, commodities, years, code_columns):
+        selected = np.in1d(columns["element"], elements) & ~np.isnan(columns["value"])
+        if commodities is not None:
+            selected &= np.in1d(columns["item"], commodities)
+        if years is not None:
+            selected &= np.in1d(columns["year"], years)
+        for column in code_columns:
+            selected &= columns[column] < 5000
+        return selected
+
+    ## Returns the encoded form of country names.
+    # @param names A Numpy array of country names.
+    # @param encoded_names A dictionary caching the encoded form of the names.
+    # @return A Numpy array of encoded names.
+    def _encode_names(self, names, encoded_names):
+        for name in names:
+            if name not in encoded_names:
+                encoded_names[name] = self._fix_name(name.strip())
+        return np.array([encoded_names[name] for name in names] or [u""], dtype = unicode)[:len(names)]
+
+    ## Turns a chunk of a bulk trade file into country-level records, as returned by _read_trade_records().
+    # Each reporter/year/item/element combination of the chunk makes a table.
+    # @param columns A dictionary of column arrays (see BulkCSVReader.iter_chunks()).
+    # @param commodities A list of commodities to load, or None for all commodities.
+    # @param years A list of years to load, or None for all years.
+    # @param encoded_names A dictionary caching the encoded form of the names.
+    def _get_bulk_trade_records(self, columns, commodities, years, encoded_names):
+        elements = ["Export Quantity", "Import Quantity"] if self.with_imports else ["Export Quantity"]
+        selected = self._select_bulk_rows(columns, elements, commodities, years, ("reporter_code", "partner_code"))
+        reporters = columns["reporter"][selected]
+        partners = columns["partner"][selected]
+        is_import = columns["element"][selected] == "Import Quantity"
+        row_years = columns["year"][selected]
+
+        names, name_numbers = np.unique(np.concatenate([reporters, partners]), return_inverse = True)
+        reporter_numbers, partner_numbers = name_numbers[:len(reporters)], name_numbers[len(reporters):]
+        items, item_numbers = np.unique(columns["item"][selected], return_inverse = True)
+        unique_years, year_numbers = np.unique(row_years, return_inverse = True)
+
+        # Number the tables through a single integer key per row
+        keys = ((reporter_numbers * len(unique_years) + year_numbers) * len(items) + item_numbers) * 2 + is_import
+        table_keys, first_rows, flow_tables = np.unique(keys, return_index = True, return_inverse = True)
+
+        return {
+            "names": self._encode_names(names, encoded_names),
+            "name_occurrences": np.bincount(partner_numbers, minlength = len(names)),
+            "commodities": items,
+            "table_reporter": reporter_numbers[first_rows],
+            "table_year": row_years[first_rows],
+            "table_commodity": item_numbers[first_rows],
+            "table_import": is_import[first_rows],
+            "flow_table": flow_tables,
+            "flow_partner": partner_numbers,
+            "flow_quantity": np.rint(columns["value"][selected]).astype(np.int),
+        }
+
+    ## Turns a chunk of a bulk production file into country-level records, as returned by _read_production_records().
+    # Each area/item combination of the chunk makes a table.
+    # @param columns A dictionary of column arrays (see BulkCSVReader.iter_chunks()).
+    # @param commodities A list of commodities to load, or None for all commodities.
+    # @param years A list of years to load, or None for all years.
+    # @param encoded_names A dictionary caching the encoded form of the names.
+    def _get_bulk_production_records(self, columns, commodities, years, encoded_names):
+        selected = self._select_bulk_rows(columns, ["Production"], commodities, years, ("area_code",))
+        names, area_numbers = np.unique(columns["area"][selected], return_inverse = True)
+        items, item_numbers = np.unique(columns["item"][selected], return_inverse = True)
+        table_keys, first_rows, entry_tables = np.unique(area_numbers * len(items) + item_numbers,
+                                                         return_index = True, return_inverse = True)
+
+        return {
+            "names": self._encode_names(names, encoded_names),
+            "commodities": items,
+            "table_country": area_numbers[first_rows],
+            "table_commodity": item_numbers[first_rows],
+            "entry_table": entry_tables,
+            "entry_year": columns["year"][selected],
+            "entry_quantity": np.rint(columns["value"][selected]).astype(np.int),
+        }
 
     ## Loads production data from a faostat XML file into the class.
     # Years and commodities are automatically detected and added.
     # @param file_name A faostat XML file holding commodity production data.
-    def load_production_data(self, file_name):
-        print("Loading trade data from file: {}".format(file_name))
-        data_set = etree.parse(file_name).getroot()
-        num_regions = len(self.region_numbers)
-        count = dict(zip(self.region_numbers.keys(), [0] * num_regions))
-        total_count = 0
+    # @param streaming Boolean indicating whether to parse the file incrementally (see _iter_tables()).
+    def load_production_data(self, file_name, streaming = True):
+        self.metrics.log("Loading trade data from file: {}".format(file_name))
+        file_type, records = self._read_records(file_name, "production", streaming)
+        self.country_records.append((file_name, file_type, records, 0))
+        with self.metrics.stage("aggregate", file_name) as stage:
+            parsed = self._aggregate_production_records(records)
+            stage["elements"] = len(records["entry_quantity"])
+        self._merge_production_data(parsed, file_name = file_name)
+
+    ## Reads the country-level production quantities of a faostat XML production file.
+    # The records do not depend on the regions, so that they can be cached (see faostat_cache.py).
+    # @param file_name A faostat XML file holding commodity production data.
+    # @param streaming Boolean indicating whether to parse the file incrementally (see _iter_tables()).
+    # @return A dictionary of Numpy arrays: "names" (encoded country names), "commodities", one "table_*" entry
+    # per production table (country and commodity) and one "entry_*" entry per year (table, year and quantity,
+    # with empty entries counted as 0).
+    def _read_production_records(self, file_name, streaming = True):
+        names = OrderedDict()
+        commodities = OrderedDict()
+        tables = ([], [])
+        entries = ([], [], [])
 
-        for table in data_set:
+        for table in self._iter_tables(file_name, streaming):
             # We only look at production quantities, so ignore other info (e.g. yield).
             trade_type = table.find("element").text
             if trade_type != "Production (tonnes)":
@@ -180,34 +645,444 @@ class FAOStatTradeData:
             # See what this table deals with
             country_name = self._fix_name(table.find("countries").text.strip())
             commodity = table.find("item").text
-            region = self.country_regions[country_name]
-            region_number = self.region_numbers[region]
+            table_number = len(tables[0])
+            tables[0].append(names.setdefault(country_name, len(names)))
+            tables[1].append(commodities.setdefault(commodity, len(commodities)))
 
             # Loop over all years in the <Table1> element
             for entry in table:
                 # Skip tags already dealt with
                 if entry.tag in ("countries", "country_x0020_codes", "item", "item_x0020_codes", "element", "element_x0020_codes"):
                     continue
-                year = int(self.name_decode(entry.tag))
                 quantity = entry.text
+                entries[0].append(table_number)
+                entries[1].append(int(self.name_decode(entry.tag)))
+                entries[2].append(int(quantity) if quantity is not None else 0)
+
+        return {
+            "names": np.array(list(names), dtype = unicode),
+            "commodities": np.array(list(commodities), dtype = unicode),
+            "table_country": np.array(tables[0], dtype = np.int),
+            "table_commodity": np.array(tables[1], dtype = np.int),
+            "entry_table": np.array(entries[0], dtype = np.int),
+            "entry_year": np.array(entries[1], dtype = np.int),
+            "entry_quantity": np.array(entries[2], dtype = np.int),
+        }
+
+    ## Aggregates country-level production quantities into region production quantities.
+    # @param records A dictionary of arrays returned by _read_production_records().
+    # @return A (productions, count, total_count) tuple, where productions is an ordered dictionary
+    # indexed by (year, commodity) holding Numpy arrays of production quantities indexed by region number.
+    def _aggregate_production_records(self, records):
+        num_regions = len(self.region_numbers)
+        names = records["names"]
+        commodities = records["commodities"]
+
+        # Countries must be known
+        table_regions = self._get_name_regions(names)[records["table_country"]]
+        if np.any(table_regions < 0):
+            sys.exit("ERROR: Unknown producer country {}".format(
+                self.name_decode(names[records["table_country"][table_regions < 0][0]])))
+
+        entry_table = records["entry_table"]
+        entry_commodities = records["table_commodity"][entry_table]
+        keys = OrderedDict()
+        entry_keys = np.array([keys.setdefault((int(year), commodities[commodity]), len(keys))
+            for year, commodity in zip(records["entry_year"], entry_commodities)], dtype = np.int)
+
+        regions = table_regions[entry_table]
+        quantities = records["entry_quantity"]
+        totals = np.zeros([len(keys), num_regions], dtype = np.int)
+        np.add.at(totals, (entry_keys, regions), quantities)
+        productions = OrderedDict((key, totals[i]) for key, i in keys.items())
+
+        selected = quantities != 0
+        region_counts = np.bincount(regions[selected], minlength = num_regions)
+        count = dict((region, int(region_counts[i])) for region, i in self.region_numbers.items())
+
+        return productions, count, int(selected.sum())
+
+    ## Adds the result of _aggregate_production_records() to the production quantities of the class.
+    # @param parsed A (productions, count, total_count) tuple returned by _aggregate_production_records().
+    # @param verbose Boolean indicating whether to print the number of production values per region.
+    # @param file_name The file the data comes from, if any, to which the measurements are attributed.
+    def _merge_production_data(self, parsed, verbose = True, file_name = None):
+        productions, count, total_count = parsed
+
+        with self.metrics.stage("merge", file_name) as stage:
+            for key, quantities in productions.items():
+                if key not in self.productions:
+                    self.productions[key] = quantities
+                else:
+                    self.productions[key] += quantities
+            self.derived_series.clear()
+            stage["elements"] = total_count
+
+        if verbose:
+            self.metrics.log(" - Loaded {} production values:".format(total_count))
+            for key in sorted(count.keys()):
+                self.metrics.log("   - {}: {} production values".format(self.name_decode(key), count[key]), Metrics.DETAILS)
+
+    ## Rebuilds the trade matrices and production quantities from the country-level data of all
+    # the files loaded so far, using the current regions and country-to-region mapping.
+    # No XML file is parsed again.
+    def reaggregate(self):
+        with self.metrics.stage("reaggregate") as stage:
+            self.trade_matrices = TradeTensor(len(self.region_numbers))
+            self.productions = ProductionTensor(len(self.region_numbers))
+
+            for file_name, file_type, records, threshold in self.country_records:
+                records = self._get_records(records)
+                if file_type == "trade":
+                    self._merge_trade_data(self._aggregate_trade_records(records, threshold), verbose = False)
+                    stage["elements"] += len(records["flow_quantity"])
+                else:
+                    self._merge_production_data(self._aggregate_production_records(records), verbose = False)
+                    stage["elements"] += len(records["entry_quantity"])
+
+        # Bulk files make one entry per chunk
+        num_files = len(set(file_name for file_name, file_type, records, threshold in self.country_records))
+        self.metrics.log("Aggregated {} files into {} regions".format(num_files, len(self.region_numbers)))
+
+    ## Reads again given files among the ones loaded so far (e.g. files which have changed on disk), replacing their
+    # country-level data, and rebuilds the trade matrices and production quantities (see reaggregate()).
+    # The other files are not parsed again.
+    # @param file_names A list of files loaded by load_trade_data(), load_production_data() or load_data_parallel().
+    def reload_files(self, file_names):
+        for i, (file_name, file_type, records, threshold) in enumerate(self.country_records):
+            if file_name in file_names:
+                self.metrics.log("Reloading data from file: {}".format(file_name))
+                file_type, records = self._read_records(file_name, file_type)
+                self.country_records[i] = (file_name, file_type, records, threshold)
+        self.reaggregate()
+
+    ## Combines the flows reported by the exporters with the ones reported by the importers (the import tables),
+    # so that flows missing from the exporter data are filled in.
+    # Flows are combined per pair of countries, over all years and commodities and all the files loaded so far,
+    # and the result is then aggregated into regions (see _aggregate_trade_records()). Combining the region
+    # matrices instead would let the exports of some countries of a region hide the missing exports of others.
+    # Each flow is combined according to a policy:
+    #  - "max": the larger of the two quantities;
+    #  - "exporter-first": the exporter quantity, or the importer quantity where the exporter reported nothing;
+    #  - "mean": the mean of the two quantities where both are reported, or the only one reported;
+    #  - "cif-fob": as "exporter-first", importer quantities being divided by cif_fob_factor first, since imports
+    #    are reported CIF (i.e. including freight and insurance) while exports are reported FOB.
+    # The result holds the combinations found in either the export or the import tables. It does not replace
+    # trade_matrices, which is left to the caller, keeping in mind that reaggregate() rebuilds the exporter matrices.
+    # Data opened from a tensor store has no country-level data, and is left out. The import tables are only kept
+    # when with_imports is True: otherwise the result only holds the exporter data.
+    # @param policy One of reconciliation_policies.
+    # @param cif_fob_factor The ratio between the CIF and FOB quantities of a flow (used by the "cif-fob" policy).
+    # @return A TradeTensor holding the reconciled trade matrices.
+    def reconcile(self, policy = "max", cif_fob_factor = 1.1):
+        if policy not in self.reconciliation_policies:
+            sys.exit("ERROR: Unknown reconciliation policy {} (expected one of {})".format(
+                policy, ", ".join(self.reconciliation_policies)))
 
-                # We look if there's already an entry for that commodity/year combination
-                if (year, commodity) not in self.productions.keys():
-                    self.productions[(year, commodity)] = dict()
-                prod_dict = self.productions[(year, commodity)]
+        with self.metrics.stage("reconcile") as stage:
+            names, commodities, keys, flows, reported, mirror = self._get_country_flows()
 
-                # We look if there's already an entry for this region
-                if region not in prod_dict.keys():
-                    prod_dict[region] = 0
+            if policy == "max":
+                reconciled = np.maximum(reported, mirror)
+            elif policy == "mean":
+                both = (reported > 0) & (mirror > 0)
+                reconciled = np.where(both, np.rint((reported + mirror) / 2.0).astype(np.int), reported + mirror)
+            else:
+                if policy == "cif-fob":
+                    mirror = np.rint(mirror / float(cif_fob_factor)).astype(np.int)
+                reconciled = np.where(reported > 0, reported, mirror)
 
-                if quantity is not None and int(quantity) != 0:
-                    prod_dict[region] += int(quantity)
-                    count[region] += 1
-                    total_count += 1
+            # Flows involving unknown countries are left out of the region matrices anyway, and tables must have
+            # a known reporter (here the exporter)
+            name_regions = self._get_name_regions(names)
+            selected = (reconciled > 0) & (name_regions[flows[:, 2]] >= 0) & (name_regions[flows[:, 3]] >= 0)
+            tables, flow_table = self._get_unique_rows(flows[selected, :3])
+            records = {
+                "names": names,
+                # Unknown countries were reported when the files were loaded
+                "name_occurrences": np.zeros(len(names), dtype = np.int),
+                "commodities": commodities,
+                "table_reporter": tables[:, 2],
+                "table_year": tables[:, 1],
+                "table_commodity": tables[:, 0],
+                "table_import": np.zeros(len(tables), dtype = bool),
+                "flow_table": flow_table,
+                "flow_partner": flows[selected, 3],
+                "flow_quantity": reconciled[selected],
+            }
+            matrices = self._aggregate_trade_records(records)[0]
 
-        print(" - Loaded {} production values:".format(total_count))
-        for key in sorted(count.keys()):
-            print ("   - {}: {} production values".format(self.name_decode(key), count[key]))
+            result = TradeTensor(len(self.region_numbers))
+            num_regions = len(self.region_numbers)
+            for commodity in sorted(set(commodity for year, commodity in keys)):
+                for year in sorted(set(year for year, key_commodity in keys if key_commodity == commodity)):
+                    key = (year, commodity)
+                    result[key] = matrices.get(key, np.zeros([num_regions, num_regions], dtype = np.int))
+            filled = int(((reported == 0) & (reconciled > 0)).sum())
+            stage["elements"] = len(reconciled)
+
+        self.metrics.log("Reconciled {} trade matrices with policy {}: {} country flows filled from import data".format(
+            len(result), policy, filled))
+        return result
+
+    ## Gathers the country-level flows of all the trade files loaded so far, as reported by the exporters (export
+    # tables) and by the importers (import tables), for reconcile(). Names and commodities are numbered over all
+    # the files, the quantities not above the threshold of their file are left out, and the quantities of a flow
+    # reported by several tables are summed.
+    # @return A (names, commodities, keys, flows, reported, mirror) tuple, where names and commodities are Numpy arrays
+    # of encoded country names and commodities, keys the set of (year, commodity) combinations of all the tables,
+    # flows a 2D Numpy array holding the (commodity, year, exporter, importer) numbers of each flow, and reported
+    # and mirror the quantities of each flow reported by the exporter and by the importer (0 if not reported).
+    def _get_country_flows(self):
+        names, commodities = OrderedDict(), OrderedDict()
+        keys = set()
+        columns = [[] for i in range(6)]
+
+        for file_name, file_type, records, threshold in self.country_records:
+            if file_type != "trade":
+                continue
+            records = self._get_records(records)
+            name_numbers = np.array([names.setdefault(name, len(names)) for name in records["names"]], dtype = np.int)
+            commodity_numbers = np.array([commodities.setdefault(commodity, len(commodities))
+                for commodity in records["commodities"]], dtype = np.int)
+            keys.update(zip(records["table_year"].tolist(), records["commodities"][records["table_commodity"]].tolist()))
+
+            selected = records["flow_quantity"] > threshold
+            flow_table = records["flow_table"][selected]
+            reporters = name_numbers[records["table_reporter"][flow_table]]
+            partners = name_numbers[records["flow_partner"][selected]]
+            # The reporter of an import table is the importer
+            is_import = records["table_import"][flow_table]
+            for column, values in zip(columns, (commodity_numbers[records["table_commodity"][flow_table]],
+                    records["table_year"][flow_table], np.where(is_import, partners, reporters),
+                    np.where(is_import, reporters, partners), is_import, records["flow_quantity"][selected])):
+                column.append(values)
+
+        commodity_column, year_column, exporter_column, importer_column, is_import, quantities = [
+            np.concatenate(column) if column else np.zeros(0, dtype = np.int) for column in columns]
+        is_import = is_import.astype(bool)
+        flows, flow_numbers = self._get_unique_rows(
+            np.column_stack([commodity_column, year_column, exporter_column, importer_column]))
+        reported = np.zeros(len(flows), dtype = np.int)
+        np.add.at(reported, flow_numbers[~is_import], quantities[~is_import])
+        mirror = np.zeros(len(flows), dtype = np.int)
+        np.add.at(mirror, flow_numbers[is_import], quantities[is_import])
+
+        return (np.array(list(names), dtype = unicode), np.array(list(commodities), dtype = unicode), keys,
+                flows, reported, mirror)
+
+    ## Returns the distinct rows of a 2D array, in lexicographic order, along with the number of the distinct row
+    # matching each row (as np.unique() does with an axis, which fails on empty arrays in older Numpy versions).
+    # @param rows A 2D Numpy array of integers.
+    # @return A (distinct_rows, numbers) tuple of Numpy arrays.
+    @staticmethod
+    def _get_unique_rows(rows):
+        order = np.lexsort(rows.T[::-1])
+        sorted_rows = rows[order]
+        first = np.ones(len(rows), dtype = bool)
+        first[1:] = np.any(sorted_rows[1:] != sorted_rows[:-1], axis = 1)
+        numbers = np.empty(len(rows), dtype = np.int)
+        numbers[order] = np.cumsum(first) - 1
+        return sorted_rows[first], numbers
+
+    ## Switches to another set of regions and rebuilds the trade matrices and production
+    # quantities accordingly (see reaggregate()).
+    # @param regions_file A regions CSV file (see load_regions()).
+    # @param country_regions_file A country-to-region mapping CSV file (see load_country_regions()).
+    def regroup(self, regions_file, country_regions_file):
+        self.country_regions = dict()
+        self.load_regions(regions_file)
+        self.load_country_regions(country_regions_file)
+        self.reaggregate()
+
+    ## Saves the trade matrices and production quantities to a folder, from which they can be
+    # memory-mapped by open_store(). Each store is a Numpy .npy file, and a small JSON header (store.json) holds
+    # the region numbers along with the commodities and years of each store.
+    # The header is written last, so that processes opening the folder never see a partial store.
+    # @param store_dir Path to the folder, created if needed.
+    def save_store(self, store_dir):
+        with self.metrics.stage("save_store", store_dir) as stage:
+            try:
+                os.makedirs(store_dir)
+            except OSError:
+                pass
+
+            header = {
+                "version": self.store_version,
+                "regions": [self.region_numbers_reverse[i] for i in range(len(self.region_numbers))],
+                "country_regions": self.country_regions,
+            }
+            for name in ("trade_matrices", "productions"):
+                header[name] = getattr(self, name).save(os.path.join(store_dir, name + ".npy"))
+                stage["elements"] += getattr(self, name).get_array().size
+
+            header_file = os.path.join(store_dir, "store.json")
+            with open(header_file + ".tmp", 'w') as f:
+                json.dump(header, f)
+            os.rename(header_file + ".tmp", header_file)
+
+        self.metrics.log("Trade matrices and production quantities saved to {}".format(store_dir))
+
+    ## Opens a folder written by save_store(), replacing the regions, trade matrices and
+    # production quantities of the class. The data is memory-mapped rather than read: opening the store is
+    # immediate, pages are only read when accessed, and all the processes opening the store share them.
+    # No country-level data is loaded, so that reaggregate() only rebuilds the data of the files loaded afterwards.
+    # @param store_dir Path to the folder.
+    # @param mode The memory-mapping mode: "r" (read-only), "r+" (read-write) or "c" (copy-on-write, private to the process).
+    def open_store(self, store_dir, mode = "r"):
+        self.metrics.log("Opening trade matrices and production quantities from {}".format(store_dir))
+        header_file = os.path.join(store_dir, "store.json")
+        try:
+            with open(header_file, 'r') as f:
+                header = json.load(f)
+        except (IOError, ValueError) as error:
+            sys.exit("ERROR: Cannot read tensor store header {}: {}".format(header_file, error))
+        if header.get("version") != self.store_version:
+            sys.exit("ERROR: Tensor store {} has version {} instead of {}".format(store_dir, header.get("version"), self.store_version))
+
+        regions = header["regions"]
+        self.region_numbers = dict((region, i) for i, region in enumerate(regions))
+        self.region_numbers_reverse = dict(enumerate(regions))
+        self.country_regions = header["country_regions"]
+        self._build_tag_regions()
+        self.trade_matrices = TradeTensor(len(regions))
+        self.productions = ProductionTensor(len(regions))
+        self.country_records = []
+        for name in ("trade_matrices", "productions"):
+            getattr(self, name).load(os.path.join(store_dir, name + ".npy"), header[name], mode)
+
+        self.metrics.log(" - Opened {} trade matrices for {} regions!".format(len(self.trade_matrices), len(regions)))
+
+    ## Reads the country-level records of a faostat XML file, from the cache if it holds
+    # up-to-date records for that file (see faostat_cache.py).
+    # @param file_name A faostat XML file.
+    # @param file_type Either "trade", "production" or None to detect it (see _get_file_type()).
+    # @param streaming Boolean indicating whether to parse the file incrementally (see _iter_tables()).
+    # @return A (file_type, records) tuple, where records is the result of the matching _read_*_records() method.
+    def _read_records(self, file_name, file_type = None, streaming = True):
+        with self.metrics.stage("parse", file_name) as stage:
+            file_type, records = self._read_records_from_cache_or_file(file_name, file_type, streaming, stage)
+            stage["elements"] = len(records["flow_quantity"] if file_type == "trade" else records["entry_quantity"])
+        return file_type, records
+
+    ## Implementation of _read_records().
+    # @param file_name A faostat XML file.
+    # @param file_type Either "trade", "production" or None to detect it (see _get_file_type()).
+    # @param streaming Boolean indicating whether to parse the file incrementally (see _iter_tables()).
+    # @param stage The measurements of the parse stage, where "cached" tells whether the records come from the cache.
+    def _read_records_from_cache_or_file(self, file_name, file_type, streaming, stage):
+        cache = None
+        stage["cached"] = False
+        if self.cache_dir is not None:
+            cache = ParsedFileCache(self.cache_dir)
+            cached = cache.load(file_name, self.with_imports)
+            if cached is not None and file_type in (None, cached[0]):
+                stage["cached"] = True
+                self.metrics.count("cache_hits")
+                return cached
+            self.metrics.count("cache_misses")
+
+        if file_type is None:
+            file_type = self._get_file_type(file_name)
+        if file_type == "trade":
+            records = self._read_trade_records(file_name, streaming)
+        else:
+            records = self._read_production_records(file_name, streaming)
+
+        if cache is not None:
+            cache.store(file_name, file_type, records, self.with_imports)
+        return file_type, records
+
+    ## Returns the number of a name in an ordered dictionary of names, adding it if needed.
+    # @param names An ordered dictionary mapping names to their number.
+    # @param occurrences A list holding the number of occurrences of each name.
+    # @param name The name to look up.
+    # @param increment The value to add to the number of occurrences of the name.
+    @staticmethod
+    def _intern_name(names, occurrences, name, increment):
+        number = names.get(name)
+        if number is None:
+            number = len(names)
+            names[name] = number
+            occurrences.append(0)
+        occurrences[number] += increment
+        return number
+
+    ## Returns the country-to-region aggregation matrix of an array of encoded country names.
+    # Since each country belongs to a single region, the matrix is stored as the column of its
+    # only non-zero entry on each row, i.e. the region number of each country.
+    # Names are looked up in tag_regions, where unknown names are added (see tag_lookup_counts).
+    # @param names An array of encoded country names.
+    # @return An integer Numpy array holding the region number of each name, or -1 for unknown countries.
+    def _get_name_regions(self, names):
+        regions = np.empty(len(names), dtype = np.int)
+        for i, name in enumerate(names):
+            region_number = self.tag_regions.get(name)
+            if region_number is None:
+                self.tag_lookup_counts["misses"] += 1
+                region_number = self.region_numbers.get(self.country_regions.get(self._fix_name(name)), -1)
+                self.tag_regions[name] = region_number
+            else:
+                self.tag_lookup_counts["hits"] += 1
+            regions[i] = region_number
+        return regions
+
+    ## Tells whether a faostat XML file holds a trade matrix or production data,
+    # based on the tags found in its first <Table1> element.
+    # @param file_name A faostat XML file.
+    # @return Either "trade" or "production".
+    def _get_file_type(self, file_name):
+        for table in self._iter_tables(file_name):
+            if table.find("reporter") is not None:
+                return "trade"
+            if table.find("countries") is not None:
+                return "production"
+            break
+        sys.exit("ERROR: Unable to tell the type of data held in file {}".format(file_name))
+
+    ## Loads any number of trade matrix and production files in parallel.
+    # Each file is parsed in a separate worker process. The partial trade matrices and
+    # production quantities are then merged into the class in the order of the jobs,
+    # so that the result is exactly the same as when loading the files one after another
+    # with load_trade_data() and load_production_data().
+    # @param jobs A list of (commodity, file_name) tuples. The type of each file (trade matrix or production) is detected automatically.
+    # @param threshold A lower bound value below which trade quantities are ignored
+    # @param processes The number of worker processes (defaults to the number of CPUs).
+    # @param streaming Boolean indicating whether to parse the files incrementally (see _iter_tables()).
+    # @param pool A multiprocessing pool to parse the files with, or None to create one for the call.
+    # A pool created up front lets a multithreaded program avoid forking worker processes while other threads run.
+    def load_data_parallel(self, jobs, threshold = 0, processes = None, streaming = True, pool = None):
+        # The workers only need the region mappings, not the data loaded so far
+        template = FAOStatTradeData(metrics = self.metrics.create_child(), with_imports = self.with_imports)
+        template.region_numbers = self.region_numbers
+        template.region_numbers_reverse = self.region_numbers_reverse
+        template.country_regions = self.country_regions
+        template.cache_dir = self.cache_dir
+        template.tag_regions = self.tag_regions
+
+        tasks = [(template, file_name, threshold, streaming) for commodity, file_name in jobs]
+        if pool is not None:
+            results = pool.map(_parse_data_file, tasks)
+        else:
+            pool = multiprocessing.Pool(processes)
+            try:
+                results = pool.map(_parse_data_file, tasks)
+            finally:
+                pool.close()
+                pool.join()
+
+        for (commodity, file_name), (file_type, records, parsed, tag_lookup_counts, report) in zip(jobs, results):
+            self.metrics.log("Loading trade data from file: {}".format(file_name))
+            if file_type == "error":
+                sys.exit(parsed)
+            for key, value in tag_lookup_counts.items():
+                self.tag_lookup_counts[key] += value
+            self.metrics.merge(report)
+            self.country_records.append((file_name, file_type, records, threshold if file_type == "trade" else 0))
+            if file_type == "trade":
+                self._merge_trade_data(parsed, file_name = file_name)
+            else:
+                self._merge_production_data(parsed, file_name = file_name)
 
     ## Returns a trade matrix for a given year/commodity combination as a square 2D Numpy array.
     # @param year The year, as an integer or string.
@@ -217,7 +1092,7 @@ class FAOStatTradeData:
         try:
             matrix = self.trade_matrices[(int(year),commodity)]
         except KeyError:
-            print("No data matching commodity {} for year {}!".format(commodity, year))
+            self.metrics.warn("No data matching commodity {} for year {}!".format(commodity, year))
             raise
         return matrix
 
@@ -229,66 +1104,223 @@ class FAOStatTradeData:
     # @param with_production Boolean indicating whether to take the production quantities into account
     # @param threshold A quantity lower bound which filters out regions whose total imports + production is below the value
     def save_trade_matrix(self, year, commodity, file_name, with_production = False, threshold = 0):
+        with self.metrics.stage("save", file_name) as stage:
+            sizes, regions_to_write = self._get_region_sizes(year, commodity, threshold)
+
+            # Open a file descriptor to the target path
+            with open(file_name, 'w') as file_handle:
+                contents = self._format_trade_matrix(year, commodity, sizes, regions_to_write, with_production)
+                file_handle.write(contents)
+            stage["elements"] = len(contents)
+
+        self.metrics.log("Matrix for commodity {} and year {} saved to {}".format(commodity, year, file_name))
+
+    ## Saves the trade matrices of any number of year/commodity combinations as files readable by the
+    # Circos tableviewer utility, both with and without the production quantities (see save_trade_matrix()).
+    # The region sizes are computed once for both files.
+    # @param output_dir Path to the folder where to save the files.
+    # @param years A list of years, or None for all the years loaded.
+    # @param commodities A list of commodities, or None for all the commodities loaded.
+    # @param threshold A quantity lower bound which filters out regions whose total imports + production is below the value
+    # @param threads The number of threads writing the files, or None to write them from the calling thread.
+    # @param file_name_format Path of the files relative to output_dir, where {commodity}, {year} and {suffix}
+    # (empty or "_without_productions") are replaced. Missing folders are created.
+    # @return The list of saved files.
+    def save_trade_matrices(self, output_dir, years = None, commodities = None, threshold = 0, threads = None,
+            file_name_format = os.path.join("{commodity}", "{commodity}_{year}{suffix}.txt")):
+        if years is None:
+            years = sorted(self.trade_matrices.years)
+        if commodities is None:
+            commodities = self.trade_matrices.commodities
+
+        jobs = [(year, commodity) for year in years for commodity in commodities]
+        if threads is None:
+            saved_files = [self._save_trade_matrix_pair(output_dir, year, commodity, threshold, file_name_format)
+                for year, commodity in jobs]
+        else:
+            pool = ThreadPool(threads)
+            try:
+                saved_files = pool.map(lambda job: self._save_trade_matrix_pair(output_dir, job[0], job[1],
+                    threshold, file_name_format), jobs)
+            finally:
+                pool.close()
+                pool.join()
+
+        return [file_name for pair in saved_files for file_name in pair]
+
+    ## Saves the trade matrix of a year/commodity combination with and without production quantities.
+    # @param output_dir Path to the folder where to save the files.
+    # @param year The year, as an integer.
+    # @param commodity The commodity, as a string.
+    # @param threshold A quantity lower bound which filters out regions whose total imports + production is below the value
+    # @param file_name_format Path of the files relative to output_dir (see save_trade_matrices()).
+    # @return The paths of the two files.
+    def _save_trade_matrix_pair(self, output_dir, year, commodity, threshold, file_name_format):
+        saved_files = []
+
+        for suffix, contents in self.format_trade_matrix_pair(year, commodity, threshold):
+            file_name = os.path.join(output_dir, file_name_format.format(commodity = commodity, year = year, suffix = suffix))
+            with self.metrics.stage("save", file_name) as stage:
+                try:
+                    os.makedirs(os.path.dirname(file_name))
+                except OSError:
+                    pass
+
+                with open(file_name, 'w') as file_handle:
+                    file_handle.write(contents)
+                stage["elements"] = len(contents)
+            self.metrics.log("Matrix for commodity {} and year {} saved to {}".format(commodity, year, file_name))
+            saved_files.append(file_name)
+
+        return saved_files
+
+    ## Formats the trade matrix of a year/commodity combination with and without production quantities,
+    # as expected by the Circos tableviewer utility (see save_trade_matrix()).
+    # @param year The year, as an integer or string.
+    # @param commodity The commodity, as a string.
+    # @param threshold A quantity lower bound which filters out regions whose total imports + production is below the value
+    # @return A list of two (suffix, contents) tuples, where suffix is appended to the file names
+    # (empty with production quantities, "_without_productions" otherwise).
+    def format_trade_matrix_pair(self, year, commodity, threshold = 0):
+        sizes, regions_to_write = self._get_region_sizes(year, commodity, threshold)
+        return [(suffix, self._format_trade_matrix(year, commodity, sizes, regions_to_write, with_production))
+            for with_production, suffix in ((True, ""), (False, "_without_productions"))]
+
+    ## Computes the "size" of each region (i.e. imports + production) for a given year/commodity combination.
+    # @param year The year, as an integer or string.
+    # @param commodity The commodity, as a string.
+    # @param threshold A quantity lower bound which filters out regions whose total imports + production is below the value
+    # @return A (sizes, regions_to_write) tuple, where sizes is a Numpy array indexed by region number and
+    # regions_to_write an array holding the numbers of the regions whose size is above the threshold.
+    def _get_region_sizes(self, year, commodity, threshold = 0):
         # Retrieve the matrix
         matrix = self._get_trade_matrix(year, commodity)
-        prod_dict = self.productions[(year, commodity)]
+
+        # The size is the imported quantity plus the production, if any (bulk files cover items without production)
+        sizes = matrix.sum(axis = 0) + self.productions.get((int(year), commodity), 0)
+
+        # If the size is above the threshold, we take this region into account
+        selected = sizes > threshold
+        if "Unspecified" in self.region_numbers:
+            selected[self.region_numbers["Unspecified"]] = False
+
+        return sizes, np.flatnonzero(selected)
+
+    ## Computes the "size" of each region (i.e. imports + production) for many year/commodity combinations at once.
+    # Combinations without trade or production data count as zeros.
+    # @param commodities A list of commodities, or None for all the commodities loaded.
+    # @param years A list of years, or None for all the years loaded, in chronological order.
+    # @return A (commodities, years, sizes) tuple, where sizes is a Numpy array indexed by [commodity, year, region].
+    def get_region_sizes(self, commodities = None, years = None):
+        if commodities is None:
+            commodities = sorted(set(self.trade_matrices.commodities) | set(self.productions.commodities))
+        if years is None:
+            years = sorted(set(self.trade_matrices.years) | set(self.productions.years))
+        imports = self.trade_matrices.get_aligned_array(commodities, years).sum(axis = 2)
+        return commodities, years, imports + self.productions.get_aligned_array(commodities, years)
+
+    ## Returns the index of the flows of the trade matrices, creating a new one if the trade matrices were replaced
+    # (e.g. by reaggregate() or open_store()).
+    def _get_flow_index(self):
+        if self.flow_index.matrices is not self.trade_matrices:
+            self.flow_index = FlowIndex(self.trade_matrices)
+        return self.flow_index
+
+    ## Indexes the flows of the trade matrices ahead of the queries (see get_top_flows()), which otherwise index
+    # each year/commodity combination the first time it is queried.
+    # @param years A list of years, or None for all the years loaded.
+    # @param commodities A list of commodities, or None for all the commodities loaded.
+    def build_flow_index(self, years = None, commodities = None):
+        keys = [(year, commodity) for year, commodity in self.trade_matrices.keys()
+            if (years is None or year in years) and (commodities is None or commodity in commodities)]
+        with self.metrics.stage("build_flow_index") as stage:
+            stage["elements"] = self._get_flow_index().build(keys)
+
+    ## Returns the largest flows of a year/commodity combination.
+    # @param year The year, as an integer or string.
+    # @param commodity The commodity, as a string.
+    # @param k The number of flows to return.
+    # @param exporters A list of exporting region names to restrict the flows to, or None.
+    # @param importers A list of importing region names to restrict the flows to, or None.
+    # @return A list of at most k (exporter, importer, quantity) tuples by decreasing quantity.
+    def get_top_flows(self, year, commodity, k = 10, exporters = None, importers = None):
+        if exporters is not None:
+            exporters = [self.region_numbers[region] for region in exporters]
+        if importers is not None:
+            importers = [self.region_numbers[region] for region in importers]
+        flows = self._get_flow_index().get_top_flows(int(year), commodity, k, exporters, importers)
+        return self._name_flows(flows)
+
+    ## Returns the flows of a year/commodity combination above a quantity.
+    # @param year The year, as an integer or string.
+    # @param commodity The commodity, as a string.
+    # @param threshold The quantity the flows must exceed.
+    # @return A list of (exporter, importer, quantity) tuples by decreasing quantity.
+    def get_flows_above(self, year, commodity, threshold):
+        return self._name_flows(self._get_flow_index().get_flows_above(int(year), commodity, threshold))
+
+    ## Returns the quantity below which a given percentage of the flows of a year/commodity combination fall.
+    # Zero flows are not counted.
+    # @param year The year, as an integer or string.
+    # @param commodity The commodity, as a string.
+    # @param percentile The percentage, between 0 and 100.
+    # @return The quantity, as a float, or None if there is no flow.
+    def get_flow_percentile(self, year, commodity, percentile):
+        return self._get_flow_index().get_percentile(int(year), commodity, percentile)
+
+    ## Returns the largest partners of a region over time, e.g. its 10 largest suppliers each year.
+    # @param region The name of the region.
+    # @param commodity The commodity, as a string.
+    # @param k The number of partners to return for each year.
+    # @param years A list of years, or None for all the years loaded. Years without trade matrix are skipped.
+    # @param exporters Boolean telling whether to rank the exporters to the region (True)
+    # or the importers from the region (False).
+    # @return A list of (year, partners) tuples in chronological order, where partners is a list of at most k
+    # (region, quantity) tuples by decreasing quantity.
+    def get_top_partners(self, region, commodity, k = 10, years = None, exporters = True):
+        flow_index = self._get_flow_index()
+        number = self.region_numbers[region]
+        if years is None:
+            years = self.trade_matrices.get_sorted_years()[0].tolist()
+        return [(year, [(self.region_numbers_reverse[partner], quantity)
+                for partner, quantity in flow_index.get_top_partners(int(year), commodity, number, k, exporters)])
+            for year in years if (int(year), commodity) in self.trade_matrices]
+
+    ## Replaces the region numbers of flows by the region names.
+    # @param flows A list of (exporter, importer, quantity) tuples.
+    def _name_flows(self, flows):
+        return [(self.region_numbers_reverse[exporter], self.region_numbers_reverse[importer], quantity)
+            for exporter, importer, quantity in flows]
+
+    ## Formats a trade matrix as expected by the Circos tableviewer utility.
+    # @param year The year, as an integer or string.
+    # @param commodity The commodity, as a string.
+    # @param sizes The size of each region (see _get_region_sizes()).
+    # @param regions_to_write The numbers of the regions to write (see _get_region_sizes()).
+    # @param with_production Boolean indicating whether to write the size of each region
+    # @param matrix The integer matrix to write, or None for the trade matrix of the year/commodity combination.
+    # @return The contents of the file, as a string.
+    def _format_trade_matrix(self, year, commodity, sizes, regions_to_write, with_production = False, matrix = None):
+        if matrix is None:
+            matrix = self._get_trade_matrix(year, commodity)
         num_regions = len(self.region_numbers)
+        names = [self.region_numbers_reverse[i] for i in regions_to_write]
 
-        # Open a file descriptor to the target path
-        with open(file_name, 'w') as file_handle:
-            # Write the header on the first line:
-            # word "data" followed by the country names, separated by tabs
-            file_handle.write("data\tdata\t")
-            if with_production:
-                file_handle.write("data\t")
-            regions_to_write = []
-
-            # This dictionary will hold the "size" of each regions (i.e. imports + production)
-            sizes = dict()
-
-            # Loop over all regions
-            for i in range(num_regions):
-                region_name = self.region_numbers_reverse[i]
-                if region_name == "Unspecified":
-                    continue
+        # Write the header on the first line:
+        # word "data" followed by the country names, separated by tabs
+        # (there is a tab after each name except the name of the last region, if written).
+        lines = ["data\tdata\t" + ("data\t" if with_production else "") + "".join(
+            name + ('\t' if i != num_regions - 1 else '') for i, name in zip(regions_to_write, names)) + '\n']
+
+        # Write the lines of the matrix, starting each row by the region number and name,
+        # followed by the entries in integer format, with tabs as delimiter.
+        rows = matrix[np.ix_(regions_to_write, regions_to_write)].tolist()
+        region_sizes = sizes[regions_to_write].tolist()
+        for i, name, size, row in zip(regions_to_write, names, region_sizes, rows):
+            prefix = "{}\t{}\t".format(i, size) if with_production else "{}\t".format(i)
+            lines.append(prefix + name + '\t' + '\t'.join(map(str, row)) + '\n')
 
-                # We first set the size equal to the imported quantity
-                sizes[region_name] = np.sum(matrix[:,i])
-
-                # If this region produces something, we add it to the size
-                if prod_dict.has_key(region_name):
-                    sizes[region_name] += prod_dict[region_name]
-
-                # If the size is not null, we take this region into account
-                if sizes[region_name] > threshold:
-                    regions_to_write.append(region_name)
-                    file_handle.write(self.region_numbers_reverse[i])
-                    # Add a tab if this is not the last region
-                    if i != num_regions - 1:
-                        file_handle.write('\t')
-
-            file_handle.write('\n')
-
-            # Write the lines of the matrix, starting each row by the country name.
-            for region in regions_to_write:
-                i = self.region_numbers[region]
-                file_handle.write(str(i))
-                file_handle.write('\t')
-                if with_production:
-                    file_handle.write(str(sizes[region]))
-                    file_handle.write('\t')
-                file_handle.write(region)
-                file_handle.write('\t')
-
-                # Write each entry in the matrix in integer format, with tabs as delimiter.
-                for partner in regions_to_write:
-                    j = self.region_numbers[partner]
-                    file_handle.write("{:d}".format(matrix[i,j]))
-                    if partner != regions_to_write[-1]:
-                        file_handle.write('\t')
-                file_handle.write('\n')
-
-        print("Matrix for commodity {} and year {} saved to {}".format(commodity, year, file_name))
+        return "".join(lines)
 
     ## Loads all countries (both reported and partner countries)
     # contained in a faostat XML trade matrix.
@@ -333,43 +1365,50 @@ class FAOStatTradeData:
 
     ## This static function returns a copy of the input string as a Unicode object with all
     # unicode characters, spaces, parentheses, commas and apostrophes replaced
-    # by _x####_ where ### is the correpsonding unicode hex number.
+    # by _x####_ where ### is the correpsonding unicode hex number (see faostat_name_codec.py).
     # @param name The text to parse, assumed to be a Unicode object, or an ASCII text string.
     @staticmethod
     def name_encode(name):
-        # Break the text into a list of characters
-        string_list = list(unicode(name).strip())
-
-        for i, val in enumerate(string_list):
-            # Convert all characters that are not pure ASCII alphanumeric
-            if not val.isalnum() and val != u'_' or ord(val) >= 128:
-                string_list[i] = u'_x{:04X}_'.format(ord(val))
-
-        # Assemble the characters back into a string
-        fixed_string = u''.join(string_list)
-
-        return fixed_string
+        return name_codec.encode(name)
 
     ## This static function is the inverse of the _name_encode method and
     # returns a Unicode object corresponding to the input string
-    # with all codes translated back to their corresponding character.
+    # with all codes translated back to their corresponding character (see faostat_name_codec.py).
     # @param name The text to decode (an ASCII text string with only alphanumeric characters or underscores).
     @staticmethod
     def name_decode(name):
-        # Pattern corresponding to a character code
-        pattern = re.compile("_x([0-9a-fA-F]{4})_")
-        # Find all matches in the text string
-        fixed_string = name
-        for match in pattern.finditer(name):
-            # The code is the first and only "group"
-            # (i.e. parenthesized sub-expression in the pattern above).
-            code = match.groups()[0]
-            # Convert the code to integer, knowing that it's in base 16 (hexadecimal).
-            hex_code = int(code, 16)
-            # Replace the pattern by the right character
-            fixed_string = re.sub("_x" + code + "_", unichr(hex_code), fixed_string)
-
-        return fixed_string
+        return name_codec.decode(name)
+
+## Parses a trade matrix or production file in a worker process (see FAOStatTradeData.load_data_parallel()).
+# This is a module-level function because bound methods cannot be sent to other processes.
+# @param task A (data_structure, file_name, threshold, streaming) tuple.
+# @return A (file_type, records, parsed, tag_lookup_counts, report) tuple, where records is the result of the matching
+# _read_*_records() method, parsed the result of the matching _aggregate_*_records() method,
+# tag_lookup_counts the lookups done in the worker (see FAOStatTradeData.tag_lookup_counts)
+# and report the measurements made in the worker (see Metrics.pop_report()).
+# If the file cannot be loaded, file_type is "error" and parsed holds the error message.
+def _parse_data_file(task):
+    data_structure, file_name, threshold, streaming = task
+    # The same data structure is used for all the tasks of a chunk, whose measurements are reported separately
+    data_structure.tag_lookup_counts = {"hits": 0, "misses": 0}
+    metrics = data_structure.metrics
+    try:
+        file_type, records = data_structure._read_records(file_name, None, streaming)
+        with metrics.stage("aggregate", file_name) as stage:
+            if file_type == "trade":
+                parsed = data_structure._aggregate_trade_records(records, threshold)
+                stage["elements"] = len(records["flow_quantity"])
+            else:
+                parsed = data_structure._aggregate_production_records(records)
+                stage["elements"] = len(records["entry_quantity"])
+    except SystemExit as error:
+        # The pool would otherwise wait forever for the result of the exited worker
+        return "error", None, str(error), data_structure.tag_lookup_counts, metrics.pop_report()
+    except EnvironmentError as error:
+        # Such errors cannot be sent back to the parent process as they are
+        return ("error", None, "ERROR: Cannot read file {}: {}".format(file_name, error.strerror),
+                data_structure.tag_lookup_counts, metrics.pop_report())
+    return file_type, records, parsed, data_structure.tag_lookup_counts, metrics.pop_report()
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,354 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file faostat_trade_tensor.py
+#
+# This file contains the dense storage used for the trade matrices and the production quantities.
+
+# Numpy provides handy matrix support.
+import numpy as np
+# Module needed to write the stores atomically.
+import os
+
+## This class stores all trade matrices in a single 4D Numpy array indexed by
+# [commodity, year, exporter, importer].
+# Commodities and years are numbered in the order in which they are added (see commodity_numbers
+# and year_numbers). The array grows geometrically along the first two axes, so that adding a
+# commodity or a year does not require copying the data every time.
+#
+# The class behaves like a dictionary of square 2D trade matrices indexed by (year, commodity)
+# tuples: each matrix is a view onto the 4D array. Views remain valid until a new year or
+# commodity is added, which may cause the array to be reallocated.
+class TradeTensor:
+
+    # Attributes
+
+    ## Names of the axes of the array.
+    axes = ("commodity", "year", "exporter", "importer")
+    ## 4D Numpy array holding the data (its first two dimensions may be larger than needed).
+    data = None
+    ## 2D boolean Numpy array telling which commodity/year combinations have been added.
+    present = None
+    ## List of commodities, in the order of their numbers.
+    commodities = None
+    ## List of years, in the order of their numbers.
+    years = None
+    ## Dictionary holding the commodity-to-number mapping.
+    commodity_numbers = None
+    ## Dictionary holding the year-to-number mapping.
+    year_numbers = None
+    ## Number of regions (i.e. size of the trade matrices).
+    num_regions = None
+
+    ## The constructor initializes an empty store.
+    # @param num_regions The number of regions.
+    # @param dtype The Numpy data type of the matrices.
+    def __init__(self, num_regions, dtype = np.int):
+        self.num_regions = num_regions
+        self.commodities = []
+        self.years = []
+        self.commodity_numbers = dict()
+        self.year_numbers = dict()
+        self.data = np.zeros([0, 0] + self._get_item_shape(), dtype = dtype)
+        self.present = np.zeros([0, 0], dtype = bool)
+
+    ## Returns the shape of the data stored for each commodity/year combination.
+    def _get_item_shape(self):
+        return [self.num_regions] * (len(self.axes) - 2)
+
+    ## Returns the (commodity, year) indices of a key, or None if the combination has not been added.
+    # @param key A (year, commodity) tuple.
+    def _get_indices(self, key):
+        year, commodity = key
+        c = self.commodity_numbers.get(commodity)
+        y = self.year_numbers.get(year)
+        if c is None or y is None or not self.present[c, y]:
+            return None
+        return c, y
+
+    ## Adds a commodity/year combination, growing the array if needed.
+    # @param key A (year, commodity) tuple.
+    # @return The (commodity, year) indices of the key.
+    def _add_key(self, key):
+        year, commodity = key
+        if commodity not in self.commodity_numbers:
+            self.commodity_numbers[commodity] = len(self.commodities)
+            self.commodities.append(commodity)
+        if year not in self.year_numbers:
+            self.year_numbers[year] = len(self.years)
+            self.years.append(year)
+
+        c = self.commodity_numbers[commodity]
+        y = self.year_numbers[year]
+        if c >= self.data.shape[0] or y >= self.data.shape[1]:
+            self._grow(c + 1, y + 1)
+        self.present[c, y] = True
+        return c, y
+
+    ## Reallocates the array so that it can hold at least the given number of commodities and years.
+    # @param num_commodities The number of commodities.
+    # @param num_years The number of years.
+    def _grow(self, num_commodities, num_years):
+        old_commodities, old_years = self.present.shape
+        if num_commodities > old_commodities:
+            num_commodities = max(num_commodities, 2 * old_commodities)
+        else:
+            num_commodities = old_commodities
+        if num_years > old_years:
+            num_years = max(num_years, 2 * old_years)
+        else:
+            num_years = old_years
+
+        data = np.zeros([num_commodities, num_years] + self._get_item_shape(), dtype = self.data.dtype)
+        data[:old_commodities, :old_years] = self.data
+        present = np.zeros([num_commodities, num_years], dtype = bool)
+        present[:old_commodities, :old_years] = self.present
+        self.data = data
+        self.present = present
+
+    # Dictionary interface
+
+    def __contains__(self, key):
+        return self._get_indices(key) is not None
+
+    def __getitem__(self, key):
+        indices = self._get_indices(key)
+        if indices is None:
+            raise KeyError(key)
+        return self.data[indices]
+
+    def __setitem__(self, key, matrix):
+        indices = self._get_indices(key)
+        if indices is None:
+            indices = self._add_key(key)
+        self.data[indices] = matrix
+
+    def __len__(self):
+        return int(self.present.sum())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    ## Returns the (year, commodity) tuples of all combinations added so far.
+    def keys(self):
+        return [(self.years[y], self.commodities[c]) for c, y in zip(*np.nonzero(self.present))]
+
+    ## Returns the trade matrices of all combinations added so far, as views.
+    def values(self):
+        return [self.data[c, y] for c, y in zip(*np.nonzero(self.present))]
+
+    ## Returns (key, matrix) tuples for all combinations added so far (see keys() and values()).
+    def items(self):
+        return zip(self.keys(), self.values())
+
+    ## Returns the trade matrix of a given combination, or a default value if it has not been added.
+    # @param key A (year, commodity) tuple.
+    # @param default The value to return if there is no matrix for the key.
+    def get(self, key, default = None):
+        indices = self._get_indices(key)
+        if indices is None:
+            return default
+        return self.data[indices]
+
+    # Persistence
+
+    ## Saves the data to a Numpy .npy file, which can be memory-mapped by load().
+    # Only the part of the array holding data is written. The file is written through a temporary file,
+    # so that processes which have it mapped keep seeing the previous version.
+    # @param file_name Path to the file.
+    # @return A dictionary holding the commodities, the years and the combinations added,
+    # to be given back to load() (e.g. through a JSON file).
+    def save(self, file_name):
+        temp_name = file_name + ".tmp"
+        array = np.lib.format.open_memmap(temp_name, mode = "w+", dtype = self.data.dtype, shape = self.get_array().shape)
+        array[...] = self.get_array()
+        array.flush()
+        del array
+        os.rename(temp_name, file_name)
+        return {
+            "commodities": list(self.commodities),
+            "years": list(self.years),
+            "present": self.present[:len(self.commodities), :len(self.years)].tolist(),
+        }
+
+    ## Replaces the data with a memory-mapped Numpy .npy file written by save().
+    # The pages of the file are shared by all the processes mapping it and only read when accessed,
+    # so that opening the store is immediate and its size is not limited by the available memory.
+    # In read-only mode, matrices cannot be modified, but adding a commodity or a year copies the array into memory.
+    # @param file_name Path to the file.
+    # @param metadata The dictionary returned by save().
+    # @param mode The memory-mapping mode: "r" (read-only), "r+" (read-write) or "c" (copy-on-write).
+    def load(self, file_name, metadata, mode = "r"):
+        data = np.load(file_name, mmap_mode = mode)
+        if data.shape[2:] != tuple(self._get_item_shape()):
+            raise ValueError("{} holds data for {} regions instead of {}".format(file_name, data.shape[2], self.num_regions))
+        self.data = data
+        self.commodities = list(metadata["commodities"])
+        self.years = list(metadata["years"])
+        self.commodity_numbers = dict((commodity, i) for i, commodity in enumerate(self.commodities))
+        self.year_numbers = dict((year, i) for i, year in enumerate(self.years))
+        self.present = np.array(metadata["present"], dtype = bool).reshape(data.shape[:2])
+
+    # Vectorized accessors
+
+    ## Returns the part of the array holding data, as a view indexed by the axes (see TradeTensor.axes).
+    # Combinations which have not been added hold zeros.
+    def get_array(self):
+        return self.data[:len(self.commodities), :len(self.years)]
+
+    ## Returns the data of given commodities and years, with zeros for the combinations which have not been added,
+    # so that the arrays of two stores can be lined up.
+    # @param commodities A list of commodities.
+    # @param years A list of years.
+    # @return A new Numpy array indexed by [commodity, year] followed by the region axes.
+    def get_aligned_array(self, commodities, years):
+        array = np.zeros([len(commodities), len(years)] + self._get_item_shape(), dtype = self.data.dtype)
+        for i, commodity in enumerate(commodities):
+            for j, year in enumerate(years):
+                indices = self._get_indices((year, commodity))
+                if indices is not None:
+                    array[i, j] = self.data[indices]
+        return array
+
+    ## Stores the data of given commodities and years at once (the inverse of get_aligned_array()).
+    # @param commodities A list of commodities.
+    # @param years A list of years.
+    # @param array A Numpy array indexed by [commodity, year] followed by the region axes.
+    # @param present A 2D boolean Numpy array indexed by [commodity, year] telling which combinations to store,
+    # or None to store them all.
+    def set_aligned_array(self, commodities, years, array, present = None):
+        for i, commodity in enumerate(commodities):
+            for j, year in enumerate(years):
+                if present is None or present[i, j]:
+                    self[(year, commodity)] = array[i, j]
+
+    ## Returns the years in chronological order, along with their numbers.
+    # @return A (years, numbers) tuple of Numpy arrays.
+    def get_sorted_years(self):
+        numbers = np.argsort(self.years, kind = "mergesort")
+        return np.array(self.years, dtype = np.int)[numbers], numbers
+
+    ## Returns a sub-array for a selection of commodities, years, exporters and importers.
+    # Each selection is a list (whose order is kept in the result) or None to select everything.
+    # Years are returned in chronological order when they are not given explicitly.
+    # @param commodities A list of commodities, or None.
+    # @param years A list of years, or None.
+    # @param exporters A list of exporting region numbers, or None.
+    # @param importers A list of importing region numbers, or None.
+    # @return A new 4D Numpy array indexed by [commodity, year, exporter, importer].
+    def get_slice(self, commodities = None, years = None, exporters = None, importers = None):
+        if commodities is None:
+            c = np.arange(len(self.commodities))
+        else:
+            c = [self.commodity_numbers[commodity] for commodity in commodities]
+        if years is None:
+            y = self.get_sorted_years()[1]
+        else:
+            y = [self.year_numbers[year] for year in years]
+        if exporters is None:
+            exporters = np.arange(self.num_regions)
+        if importers is None:
+            importers = np.arange(self.num_regions)
+        return self.data[np.ix_(c, y, exporters, importers)]
+
+    ## Sums the array over one or several axes.
+    # Years are kept in chronological order when the year axis is not summed over.
+    # @param axes The names of the axes to sum over (see TradeTensor.axes).
+    # @return A Numpy array indexed by the remaining axes, in the order of TradeTensor.axes.
+    def get_sum(self, *axes):
+        for axis in axes:
+            if axis not in self.axes:
+                raise ValueError("Unknown axis: {}".format(axis))
+        array = self.get_array()
+        if "year" not in axes:
+            array = array[:, self.get_sorted_years()[1]]
+        return array.sum(axis = tuple(self.axes.index(axis) for axis in axes))
+
+    ## Returns the time series of the quantities traded from one region to another.
+    # @param exporter The number of the exporting region.
+    # @param importer The number of the importing region.
+    # @param commodity A commodity, or None to get the series of all commodities.
+    # @return A (years, series) tuple, where years is in chronological order and series is a 1D Numpy
+    # array (for a single commodity) or a 2D array indexed by [commodity, year].
+    def get_time_series(self, exporter, importer, commodity = None):
+        years, numbers = self.get_sorted_years()
+        series = self.get_array()[:, numbers, exporter, importer]
+        if commodity is not None:
+            series = series[self.commodity_numbers[commodity]]
+        return years, series
+
+## This class stores all production quantities in a single 3D Numpy array indexed by
+# [commodity, year, region], with the same dictionary interface as TradeTensor:
+# each (year, commodity) key gives a 1D array of production quantities indexed by region number.
+class ProductionTensor(TradeTensor):
+
+    # Attributes
+
+    ## Names of the axes of the array.
+    axes = ("commodity", "year", "region")
+
+    ## Returns a sub-array for a selection of commodities, years and regions.
+    # Each selection is a list (whose order is kept in the result) or None to select everything.
+    # Years are returned in chronological order when they are not given explicitly.
+    # @param commodities A list of commodities, or None.
+    # @param years A list of years, or None.
+    # @param regions A list of region numbers, or None.
+    # @return A new 3D Numpy array indexed by [commodity, year, region].
+    def get_slice(self, commodities = None, years = None, regions = None):
+        if commodities is None:
+            c = np.arange(len(self.commodities))
+        else:
+            c = [self.commodity_numbers[commodity] for commodity in commodities]
+        if years is None:
+            y = self.get_sorted_years()[1]
+        else:
+            y = [self.year_numbers[year] for year in years]
+        if regions is None:
+            regions = np.arange(self.num_regions)
+        return self.data[np.ix_(c, y, regions)]
+
+    ## Returns the time series of the production quantities of a region.
+    # @param region The number of the region.
+    # @param commodity A commodity, or None to get the series of all commodities.
+    # @return A (years, series) tuple, where years is in chronological order and series is a 1D Numpy
+    # array (for a single commodity) or a 2D array indexed by [commodity, year].
+    def get_time_series(self, region, commodity = None):
+        years, numbers = self.get_sorted_years()
+        series = self.get_array()[:, numbers, region]
+        if commodity is not None:
+            series = series[self.commodity_numbers[commodity]]
+        return years, series
+
+    ## Computes the year-over-year growth of the production quantities of every region.
+    # @return A (years, growth) tuple, where years is in chronological order (without the first year) and growth
+    # a float Numpy array indexed by [commodity, year, region], holding NaN where the previous quantity is 0.
+    def get_growth(self):
+        years, numbers = self.get_sorted_years()
+        array = self.get_array()[:, numbers].astype(np.float)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            growth = np.where(array[:, :-1] > 0, array[:, 1:] / array[:, :-1] - 1, np.nan)
+        return years[1:], growth
+
+    ## Computes the share of every region in the production of each commodity and year.
+    # @return A (years, shares) tuple, where years is in chronological order and shares a float Numpy
+    # array indexed by [commodity, year, region], holding zeros where nothing is produced.
+    def get_shares(self):
+        years, numbers = self.get_sorted_years()
+        array = self.get_array()[:, numbers].astype(np.float)
+        totals = array.sum(axis = 2)[:, :, np.newaxis]
+        return years, array / np.where(totals > 0, totals, 1)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file test_reconcile.py
+#
+# This file contains the tests of FAOStatTradeData.reconcile(), run with "python -m unittest discover tests".
+
+import os, os.path, sys
+import unittest
+import tempfile, shutil
+import xml.etree.ElementTree as ET
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from faostat_trade_data import FAOStatTradeData
+from faostat_metrics import Metrics
+
+## Returns a <Table1> element of a faostat XML trade matrix.
+# @param element Either "Export" or "Import".
+# @param reporter The reporter country.
+# @param quantities A dictionary of quantities indexed by partner country.
+def _get_table(element, reporter, quantities):
+    table = ET.Element("Table1")
+    for tag, text in (("reporter", reporter), ("years", "2000"), ("items", "Maize"), ("element", element)):
+        ET.SubElement(table, tag).text = text
+    for partner, quantity in sorted(quantities.items()):
+        ET.SubElement(table, partner).text = str(quantity)
+    return table
+
+## Tests of reconcile() with two regions, West (countries A and B) and East (countries C and D).
+# Exporters A and B report 100 to C and 50 to C, importers C and D report 150 from A and 80 from B:
+# the flow from B to D is only reported by its importer, although the West-to-East cell of the
+# export matrices is not zero.
+class ReconcileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.data_dir, "regions.csv"), 'w') as f:
+            f.write("West\t1\nEast\t2\n")
+        with open(os.path.join(self.data_dir, "country_regions.csv"), 'w') as f:
+            f.write("A\tWest\nB\tWest\nC\tEast\nD\tEast\n")
+
+        self.data_structure = FAOStatTradeData(metrics = Metrics(Metrics.QUIET), with_imports = True)
+        self.data_structure.load_regions(os.path.join(self.data_dir, "regions.csv"))
+        self.data_structure.load_country_regions(os.path.join(self.data_dir, "country_regions.csv"))
+
+        # Exports and imports are loaded from different files, as flows may be reported in either
+        exports = [_get_table("Export", "A", {"C": 100}), _get_table("Export", "B", {"C": 50})]
+        imports = [_get_table("Import", "C", {"A": 150}), _get_table("Import", "D", {"B": 80})]
+        for file_name, tables in (("exports.xml", exports), ("imports.xml", imports)):
+            parsed = self.data_structure._get_trade_records(tables)
+            self.data_structure.country_records.append((file_name, "trade", parsed, 0))
+        self.data_structure.reaggregate()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    ## Returns the reconciled West-to-East quantity.
+    # @param policy One of FAOStatTradeData.reconciliation_policies.
+    def _get_west_to_east(self, policy, **arguments):
+        reconciled = self.data_structure.reconcile(policy, **arguments)
+        regions = self.data_structure.region_numbers
+        return reconciled[(2000, u"Maize")][regions[u"West"], regions[u"East"]]
+
+    def test_exports_only(self):
+        regions = self.data_structure.region_numbers
+        self.assertEqual(self.data_structure.trade_matrices[(2000, u"Maize")][regions[u"West"], regions[u"East"]], 150)
+
+    def test_exporter_first(self):
+        self.assertEqual(self._get_west_to_east("exporter-first"), 100 + 50 + 80)
+
+    def test_max(self):
+        self.assertEqual(self._get_west_to_east("max"), 150 + 50 + 80)
+
+    def test_mean(self):
+        self.assertEqual(self._get_west_to_east("mean"), 125 + 50 + 80)
+
+    def test_cif_fob(self):
+        self.assertEqual(self._get_west_to_east("cif-fob", cif_fob_factor = 1.25), 100 + 50 + 64)
+
+    def test_without_imports(self):
+        data_structure = FAOStatTradeData(metrics = Metrics(Metrics.QUIET))
+        records = data_structure._get_trade_records([_get_table("Export", "A", {"C": 100}), _get_table("Import", "D", {"B": 80})])
+        self.assertEqual(records["table_import"].tolist(), [False])
+        self.assertEqual(records["flow_quantity"].tolist(), [100])
+
+    def test_other_cells(self):
+        reconciled = self.data_structure.reconcile("max")
+        regions = self.data_structure.region_numbers
+        matrix = reconciled[(2000, u"Maize")]
+        self.assertEqual(matrix.sum(), matrix[regions[u"West"], regions[u"East"]])
+
+## Tests of the data loaded from a FAOStat bulk CSV file, with the regions of ReconcileTest.
+# Exporter A reports 100 to C, and importer C reports 80 from B, which B does not report.
+class BulkReconcileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.data_dir, "regions.csv"), 'w') as f:
+            f.write("West\t1\nEast\t2\n")
+        with open(os.path.join(self.data_dir, "country_regions.csv"), 'w') as f:
+            f.write("A\tWest\nB\tWest\nC\tEast\nD\tEast\n")
+        self.bulk_file = os.path.join(self.data_dir, "trade.csv")
+        with open(self.bulk_file, 'w') as f:
+            f.write("Reporter Country Code,Reporter Countries,Partner Country Code,Partner Countries,Item,Element,Year,Value\n")
+            f.write("1,A,3,C,Maize,Export Quantity,2000,100\n")
+            f.write("3,C,2,B,Maize,Import Quantity,2000,80\n")
+
+        self.data_structure = FAOStatTradeData(metrics = Metrics(Metrics.QUIET), with_imports = True)
+        self.data_structure.load_regions(os.path.join(self.data_dir, "regions.csv"))
+        self.data_structure.load_country_regions(os.path.join(self.data_dir, "country_regions.csv"))
+        self.data_structure.load_bulk_data(self.bulk_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+
+    ## Returns the West-to-East quantity of a trade tensor.
+    # @param matrices A TradeTensor.
+    def _get_west_to_east(self, matrices):
+        regions = self.data_structure.region_numbers
+        return matrices[(2000, u"Maize")][regions[u"West"], regions[u"East"]]
+
+    def test_reaggregate(self):
+        self.data_structure.reaggregate()
+        self.assertEqual(self._get_west_to_east(self.data_structure.trade_matrices), 100)
+
+    def test_reconcile(self):
+        self.assertEqual(self._get_west_to_east(self.data_structure.reconcile("max")), 100 + 80)
+
+    def test_reaggregate_spilled(self):
+        data_structure = FAOStatTradeData(os.path.join(self.data_dir, "cache"), Metrics(Metrics.QUIET))
+        data_structure.load_regions(os.path.join(self.data_dir, "regions.csv"))
+        data_structure.load_country_regions(os.path.join(self.data_dir, "country_regions.csv"))
+        data_structure.load_bulk_data(self.bulk_file)
+        self.assertTrue(callable(data_structure.country_records[0][2]))
+        data_structure.reaggregate()
+        self.assertEqual(self._get_west_to_east(data_structure.trade_matrices), 100)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python2
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+## @file test_save_trade_matrices.py
+#
+# This file contains the tests checking that the tableviewer files written by FAOStatTradeData.save_trade_matrices()
+# are the same, byte for byte, whichever way the XML files are loaded, and the same as the files written cell by cell
+# as the original save_trade_matrix() did. Run with "python -m unittest discover tests".
+
+import os, os.path, sys
+import unittest
+import tempfile, shutil
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+from faostat_trade_data import FAOStatTradeData
+from faostat_synthetic_data import SyntheticDataGenerator
+from faostat_metrics import Metrics
+
+## Formats a trade matrix as the original save_trade_matrix() wrote it, one cell at a time.
+# @param data_structure A FAOStatTradeData object with the data loaded.
+# @param year The year, as an integer.
+# @param commodity The commodity, as a string.
+# @param with_production Boolean indicating whether to take the production quantities into account.
+def _format_trade_matrix_by_cell(data_structure, year, commodity, with_production):
+    matrix = data_structure.trade_matrices[(year, commodity)]
+    productions = data_structure.productions.get((year, commodity))
+    num_regions = len(data_structure.region_numbers)
+
+    parts = ["data\tdata\t"]
+    if with_production:
+        parts.append("data\t")
+    regions_to_write = []
+    sizes = dict()
+    for i in range(num_regions):
+        region_name = data_structure.region_numbers_reverse[i]
+        if region_name == "Unspecified":
+            continue
+        sizes[region_name] = np.sum(matrix[:,i])
+        if productions is not None:
+            sizes[region_name] += productions[i]
+        if sizes[region_name] > 0:
+            regions_to_write.append(region_name)
+            parts.append(region_name)
+            if i != num_regions - 1:
+                parts.append('\t')
+    parts.append('\n')
+
+    for region in regions_to_write:
+        i = data_structure.region_numbers[region]
+        parts += [str(i), '\t']
+        if with_production:
+            parts += [str(sizes[region]), '\t']
+        parts += [region, '\t']
+        for partner in regions_to_write:
+            parts.append("{:d}".format(matrix[i,data_structure.region_numbers[partner]]))
+            if partner != regions_to_write[-1]:
+                parts.append('\t')
+        parts.append('\n')
+    return "".join(parts)
+
+## Tests of the tableviewer files written from a small synthetic data folder (see faostat_synthetic_data.py),
+# holding import tables as well.
+class SaveTradeMatricesTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_dir = tempfile.mkdtemp()
+        cls.data_dir = os.path.join(cls.temp_dir, "data")
+        generator = SyntheticDataGenerator(num_countries = 12, num_regions = 4, years = range(2000, 2006),
+                                           num_commodities = 2, density = 0.5, import_density = 0.3)
+        cls.description = generator.generate(cls.data_dir)
+        cls.jobs = [(commodity, os.path.join(cls.data_dir, file_name))
+                    for commodity, file_name in cls.description["trade_files"] + cls.description["production_files"]]
+
+        # Reference files: the whole trees are parsed, one file after another, and written cell by cell
+        data_structure = cls._load_regions()
+        for commodity, file_name in cls.description["trade_files"]:
+            data_structure.load_trade_data(os.path.join(cls.data_dir, file_name), streaming = False)
+        for commodity, file_name in cls.description["production_files"]:
+            data_structure.load_production_data(os.path.join(cls.data_dir, file_name), streaming = False)
+        cls.expected = dict()
+        for year, commodity in data_structure.trade_matrices.keys():
+            for with_production, suffix in ((True, ""), (False, "_without_productions")):
+                file_name = os.path.join(commodity, "{}_{}{}.txt".format(commodity, year, suffix))
+                cls.expected[file_name] = _format_trade_matrix_by_cell(data_structure, year, commodity, with_production)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_dir)
+
+    ## Returns a FAOStatTradeData object with the regions and the country-to-region mapping loaded.
+    # @param cache_dir Directory where to cache the parsed XML files, or None.
+    @classmethod
+    def _load_regions(cls, cache_dir = None):
+        data_structure = FAOStatTradeData(cache_dir, Metrics(Metrics.QUIET))
+        data_structure.load_regions(os.path.join(cls.data_dir, "regions.csv"))
+        data_structure.load_country_regions(os.path.join(cls.data_dir, "country_regions.csv"))
+        return data_structure
+
+    ## Checks that the files written by save_trade_matrices() match the reference files.
+    # @param data_structure A FAOStatTradeData object with the data loaded.
+    # @param threads The number of threads writing the files, or None.
+    def _check_saved_files(self, data_structure, threads = None):
+        output_dir = tempfile.mkdtemp(dir = self.temp_dir)
+        saved_files = data_structure.save_trade_matrices(output_dir, threads = threads)
+        self.assertEqual(sorted(os.path.relpath(f, output_dir) for f in saved_files), sorted(self.expected))
+        for file_name, contents in self.expected.items():
+            with open(os.path.join(output_dir, file_name), 'rb') as f:
+                self.assertEqual(f.read(), contents.encode('utf-8'), file_name)
+
+    def test_serial(self):
+        data_structure = self._load_regions()
+        for commodity, file_name in self.description["trade_files"]:
+            data_structure.load_trade_data(os.path.join(self.data_dir, file_name))
+        for commodity, file_name in self.description["production_files"]:
+            data_structure.load_production_data(os.path.join(self.data_dir, file_name))
+        self._check_saved_files(data_structure)
+
+    def test_parallel(self):
+        data_structure = self._load_regions()
+        data_structure.load_data_parallel(self.jobs, processes = 2)
+        self._check_saved_files(data_structure, threads = 2)
+
+    def test_lazy(self):
+        data_structure = self._load_regions()
+        for commodity, file_name in self.description["trade_files"]:
+            data_structure.load_trade_data_lazy(os.path.join(self.data_dir, file_name))
+        for commodity, file_name in self.description["production_files"]:
+            data_structure.load_production_data(os.path.join(self.data_dir, file_name))
+        self._check_saved_files(data_structure)
+
+    def test_cached(self):
+        cache_dir = tempfile.mkdtemp(dir = self.temp_dir)
+        self._load_regions(cache_dir).load_data_parallel(self.jobs, processes = 2)
+        data_structure = self._load_regions(cache_dir)
+        data_structure.load_data_parallel(self.jobs, processes = 2)
+        self.assertEqual(data_structure.metrics.counters.get("cache_hits"), len(self.jobs))
+        self._check_saved_files(data_structure)
+
+if __name__ == "__main__":
+    unittest.main()